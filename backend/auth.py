@@ -1,15 +1,21 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
+import time
 from dotenv import load_dotenv
 
-from database import get_db
-from models import User
+from database import get_db, session_scope
+from models import User, UserRole, UserStatus
 
 load_dotenv()
 
@@ -17,10 +23,32 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing configuration
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+LOGIN_CONCURRENCY = int(os.getenv("LOGIN_CONCURRENCY", "8"))
+LOGIN_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LOGIN_QUEUE_TIMEOUT_SECONDS", "5"))
+
+# Hashes at any other cost are flagged so login can rehash them transparently
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 security = HTTPBearer()
 
+# bcrypt releases the GIL, so a small dedicated pool hashes in parallel
+# without competing with the default threadpool used for database calls
+_password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+_login_slots = asyncio.Semaphore(LOGIN_CONCURRENCY)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -29,6 +57,34 @@ def get_password_hash(password: str) -> str:
     """Hash a password"""
     return pwd_context.hash(password)
 
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password off the event loop; returns a new hash if the cost changed"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _password_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
+async def hash_password(password: str) -> str:
+    """Hash a password off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, pwd_context.hash, password)
+
+@asynccontextmanager
+async def login_slot():
+    """Limit concurrent password checks so login bursts can't starve other requests"""
+    try:
+        await asyncio.wait_for(_login_slots.acquire(), timeout=LOGIN_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        yield
+    finally:
+        _login_slots.release()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -37,10 +93,75 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_user_access_token(user: User, expires_delta: Optional[timedelta] = None):
+    """Create an access token carrying the claims get_current_user needs"""
+    return create_access_token(
+        data={
+            "sub": user.email,
+            "uid": user.id,
+            "bid": user.business_id,
+            "name": user.name,
+            "role": user.role.value,
+            "status": user.status.value
+        },
+        expires_delta=expires_delta
+    )
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user, resolved from token claims or the database"""
+    id: int
+    email: str
+    name: str
+    business_id: Optional[int]
+    role: UserRole
+    status: UserStatus
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            email=user.email,
+            name=user.name,
+            business_id=user.business_id,
+            role=user.role,
+            status=user.status
+        )
+
+    @classmethod
+    def from_claims(cls, payload: dict) -> "Principal":
+        return cls(
+            id=payload["uid"],
+            email=payload["sub"],
+            name=payload.get("name", ""),
+            business_id=payload.get("bid"),
+            role=UserRole(payload["role"]),
+            status=UserStatus(payload["status"])
+        )
+
+# Per-process principal cache. Token claims are only trusted while the token
+# is younger than PRINCIPAL_CACHE_TTL_SECONDS, and not after a team change
+# to its user in this process; otherwise the user is re-read from the
+# database and cached for that TTL (None marks a removed user). Either way
+# a role or status change reaches every process within the TTL.
+_principal_cache: Dict[int, Tuple[float, Optional[Principal]]] = {}
+_principal_changed_at: Dict[int, float] = {}
+
+def invalidate_principal(user_id: int):
+    """Stop trusting existing tokens for a user whose role or status changed"""
+    now = time.time()
+    _principal_cache.pop(user_id, None)
+    _principal_changed_at[user_id] = now
+
+    # Claims of tokens older than the TTL aren't trusted anyway
+    horizon = now - PRINCIPAL_CACHE_TTL_SECONDS
+    for stale_id in [uid for uid, changed_at in _principal_changed_at.items() if changed_at < horizon]:
+        del _principal_changed_at[stale_id]
+
 def verify_token(token: str) -> dict:
     """Verify and decode a JWT token"""
     try:
@@ -58,27 +179,60 @@ def verify_token(token: str) -> dict:
             detail="Could not validate credentials"
         )
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get the current authenticated user"""
-    token = credentials.credentials
+async def resolve_principal(token: str, db: AsyncSession) -> Principal:
+    """The user an access token belongs to"""
     payload = verify_token(token)
-    email = payload.get("sub")
+    user_id = payload.get("uid")
     
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
+    if user_id is not None and "role" in payload:
+        # Trust the claims of a fresh token, unless the user changed after it was issued
+        issued_at = payload.get("iat", 0)
+        changed_at = _principal_changed_at.get(user_id)
+        if issued_at > time.time() - PRINCIPAL_CACHE_TTL_SECONDS and (changed_at is None or issued_at > changed_at):
+            return Principal.from_claims(payload)
+        
+        cached = _principal_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            principal = cached[1]
+        else:
+            user = await db.get(User, user_id)
+            principal = Principal.from_user(user) if user else None
+            _principal_cache[user_id] = (time.monotonic() + PRINCIPAL_CACHE_TTL_SECONDS, principal)
+    else:
+        # Tokens issued before the claims were added
+        user = await db.scalar(select(User).where(User.email == payload.get("sub")))
+        principal = Principal.from_user(user) if user else None
+    
+    if principal is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
     
-    return user
+    return principal
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+) -> Principal:
+    """Get the current authenticated user"""
+    return await resolve_principal(credentials.credentials, db)
+
+async def get_stream_user(
+    token: str = Query(..., description="Access token (EventSource and WebSocket clients can't send headers)")
+) -> Principal:
+    """Authenticate a long-lived stream from its token query parameter.
+
+    Uses its own short session rather than get_db, so no connection is held
+    for as long as the stream stays open.
+    """
+    async with session_scope() as db:
+        current_user = await resolve_principal(token, db)
+    return await get_current_active_user(current_user)
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     """Get the current active user"""
-    if current_user.status != "active":
+    if current_user.status != UserStatus.ACTIVE:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Inactive user"
@@ -87,7 +241,7 @@ def get_current_active_user(current_user: User = Depends(get_current_user)) -> U
 
 def require_role(required_roles: list):
     """Decorator to require specific roles"""
-    def role_checker(current_user: User = Depends(get_current_active_user)):
+    async def role_checker(current_user: Principal = Depends(get_current_active_user)):
         if current_user.role.value not in required_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -97,8 +251,8 @@ def require_role(required_roles: list):
     return role_checker
 
 # Role-based dependencies
-def get_admin_user(current_user: User = Depends(require_role(["admin"]))):
+async def get_admin_user(current_user: Principal = Depends(require_role(["admin"]))):
     return current_user
 
-def get_manager_or_admin_user(current_user: User = Depends(require_role(["admin", "manager"]))):
+async def get_manager_or_admin_user(current_user: Principal = Depends(require_role(["admin", "manager"]))):
     return current_user
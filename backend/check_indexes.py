@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Check that the hot queries are planned with the indexes meant for them
+Runs EXPLAIN against DATABASE_URL (Postgres or SQLite) and exits non-zero
+if any query doesn't use its index, or sorts when the index should already
+return rows in order. Run after `alembic upgrade head`.
+On Postgres, sequential scans are discouraged for the check, so small
+development tables still show which index the planner would pick.
+"""
+
+import json
+import re
+import sys
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import select, func
+
+from database import engine
+from models import (
+    Notification,
+    Payment,
+    PaymentItem,
+    PaymentMethod,
+    PaymentStatus,
+    Product
+)
+from routers.notifications import notification_keyset
+from routers.payments import payment_keyset
+
+def hot_queries():
+    """(description, statement, indexes any of which should serve it, whether it must not sort)"""
+    now = datetime(2025, 1, 31)
+    cursor = SimpleNamespace(created_at=now, id=1000)
+    return [
+        (
+            "Completed payments of a business in a date range (dashboard, analytics)",
+            select(func.sum(Payment.amount)).where(
+                Payment.business_id == 1,
+                Payment.status == PaymentStatus.COMPLETED,
+                Payment.created_at >= now - timedelta(days=30),
+                Payment.created_at < now
+            ),
+            {"ix_payments_business_status_created"},
+            False
+        ),
+        (
+            "Payment listing filtered by status, newest first",
+            select(Payment.id).where(
+                Payment.business_id == 1,
+                Payment.status == PaymentStatus.PENDING
+            ).order_by(Payment.created_at.desc()).limit(100),
+            {"ix_payments_business_status_created"},
+            True
+        ),
+        (
+            "Payment listing page after a cursor",
+            payment_keyset.apply(
+                select(Payment.id).where(Payment.business_id == 1),
+                payment_keyset.encode(cursor),
+                100
+            ),
+            {"ix_payments_business_created"},
+            True
+        ),
+        (
+            "Overdue pending M-Pesa payments (reconciliation)",
+            select(Payment.id).where(
+                Payment.status == PaymentStatus.PENDING,
+                Payment.method == PaymentMethod.MPESA,
+                Payment.created_at < now
+            ),
+            {"ix_payments_reconcile"},
+            False
+        ),
+        (
+            "Line items of a page of payments",
+            select(PaymentItem.id).where(PaymentItem.payment_id.in_([1, 2, 3])),
+            {"ix_payment_items_payment_id"},
+            False
+        ),
+        (
+            "Sales of a product",
+            select(func.sum(PaymentItem.quantity)).where(PaymentItem.product_id == 1),
+            {"ix_payment_items_product_id"},
+            False
+        ),
+        (
+            "A user's unread notifications, newest first",
+            select(Notification.id).where(
+                Notification.user_id == 1,
+                Notification.read == False
+            ).order_by(Notification.created_at.desc()).limit(50),
+            {"ix_notifications_user_read_created"},
+            True
+        ),
+        (
+            "A user's notifications page after a cursor",
+            notification_keyset.apply(
+                select(Notification.id).where(Notification.user_id == 1),
+                notification_keyset.encode(cursor),
+                50
+            ),
+            {"ix_notifications_user_created"},
+            True
+        ),
+        (
+            "Unread counts of a batch of users (counter repair)",
+            select(Notification.user_id, func.count()).where(
+                Notification.user_id.in_([1, 2, 3]),
+                Notification.read == False
+            ).group_by(Notification.user_id),
+            {"ix_notifications_user_read_created"},
+            False
+        ),
+        (
+            "Low-stock products of a business",
+            select(Product.id).where(
+                Product.business_id == 1,
+                Product.stock <= Product.low_stock_threshold
+            ),
+            {"ix_products_low_stock"},
+            False
+        )
+    ]
+
+def _postgres_nodes(plan):
+    if isinstance(plan, dict):
+        if "Node Type" in plan:
+            yield plan
+        for value in plan.values():
+            yield from _postgres_nodes(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _postgres_nodes(value)
+
+def query_plan(conn, sql: str):
+    """(indexes the plan uses, whether it sorts)"""
+    if engine.dialect.name == "postgresql":
+        plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+        nodes = list(_postgres_nodes(plan if isinstance(plan, list) else json.loads(plan)))
+        return (
+            {node["Index Name"] for node in nodes if "Index Name" in node},
+            any(node["Node Type"] in ("Sort", "Incremental Sort") for node in nodes)
+        )
+    details = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    return (
+        {
+            match.group(1)
+            for detail in details
+            for match in [re.search(r"USING (?:COVERING )?INDEX (\w+)", detail)] if match
+        },
+        any("USE TEMP B-TREE" in detail for detail in details)
+    )
+
+def check_indexes() -> bool:
+    print(f"🔍 Checking query plans on {engine.dialect.name}...\n")
+    ok = True
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("SET enable_seqscan = off")
+        for description, statement, expected, in_index_order in hot_queries():
+            sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+            used, sorts = query_plan(conn, sql)
+            if not used & expected:
+                ok = False
+                print(f"❌ {description}: expected {', '.join(sorted(expected))}, plan uses {', '.join(sorted(used)) or 'no index'}")
+            elif in_index_order and sorts:
+                ok = False
+                print(f"❌ {description}: {', '.join(sorted(used & expected))}, but the plan sorts the rows")
+            else:
+                print(f"✅ {description}: {', '.join(sorted(used & expected))}")
+        conn.rollback()
+
+    print("\n🎉 All hot queries use their indexes!" if ok else "\n⚠️  Some queries aren't using their indexes (run `alembic upgrade head`?)")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if check_indexes() else 1)
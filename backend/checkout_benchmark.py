@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for checkout: N simultaneous cash sales of the same hot product
+Reports throughput and latency, and checks that stock was never oversold
+Point --database-url at a throwaway PostgreSQL database for meaningful numbers;
+SQLite serialises every writer, so keep --concurrency low there
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent checkouts of one product")
+    parser.add_argument("--database-url", default="sqlite:///./checkout_benchmark.db",
+                        help="Database to run against (use a throwaway database)")
+    parser.add_argument("--checkouts", type=int, default=500, help="Total checkouts to attempt")
+    parser.add_argument("--concurrency", type=int, default=10, help="Simultaneous checkouts")
+    parser.add_argument("--stock", type=int, default=400, help="Starting stock of the hot product")
+    parser.add_argument("--quantity", type=int, default=1, help="Units bought per checkout")
+    return parser.parse_args()
+
+async def run_benchmark(args):
+    import httpx
+    from sqlalchemy import select
+
+    import main
+    from auth import create_user_access_token
+    from database import session_scope
+    from models import Business, User, UserRole, Customer, Product
+
+    async with session_scope() as db:
+        business = Business(name="Checkout Benchmark")
+        db.add(business)
+        await db.flush()
+
+        user = User(
+            name="Benchmark Admin",
+            email=f"bench-{int(time.time() * 1000)}@example.com",
+            hashed_password="!",
+            role=UserRole.ADMIN,
+            business_id=business.id
+        )
+        customer = Customer(name="Walk-in", phone="0700000000", business_id=business.id, total_purchases=0.0)
+        product = Product(
+            name="Hot Product",
+            category="benchmark",
+            price=100.0,
+            stock=args.stock,
+            low_stock_threshold=0,
+            business_id=business.id
+        )
+        db.add_all([user, customer, product])
+        await db.commit()
+
+        token = create_user_access_token(user)
+        customer_id, product_id = customer.id, product.id
+
+    headers = {"Authorization": f"Bearer {token}"}
+    body = {
+        "customer_id": customer_id,
+        "amount": 100.0 * args.quantity,
+        "method": "cash",
+        "items": [{"product_id": product_id, "quantity": args.quantity, "unit_price": 100.0}]
+    }
+
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, statuses = [], {}
+
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def checkout():
+            async with slots:
+                started = time.perf_counter()
+                response = await client.post("/api/payments/", json=body, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(checkout() for _ in range(args.checkouts)))
+        elapsed = time.perf_counter() - started
+
+    async with session_scope() as db:
+        final_stock = await db.scalar(select(Product.stock).where(Product.id == product_id))
+
+    sold = statuses.get(200, 0)
+    latencies.sort()
+
+    print(f"\n📊 {args.checkouts} checkouts, {args.concurrency} concurrent, {args.stock} units in stock")
+    print(f"   Elapsed: {elapsed:.2f}s")
+    print(f"   Throughput: {args.checkouts / elapsed:.1f} checkouts/s")
+    print(f"   Latency p50: {statistics.median(latencies) * 1000:.1f}ms, "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"   Responses: {dict(sorted(statuses.items()))}")
+    print(f"   Sold: {sold * args.quantity} units, stock left: {final_stock}")
+
+    if final_stock < 0 or final_stock != args.stock - sold * args.quantity:
+        print("❌ Stock does not match the completed sales")
+        return False
+
+    print("✅ No overselling")
+    return True
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+
+    if not asyncio.run(run_benchmark(args)):
+        sys.exit(1)
@@ -1,6 +1,12 @@
+from contextlib import asynccontextmanager
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.functions import now
+from starlette.concurrency import run_in_threadpool
 import os
 from dotenv import load_dotenv
 
@@ -14,6 +20,9 @@ if not DATABASE_URL:
     DATABASE_URL = "sqlite:///./test.db"
     print("⚠️  Using SQLite for development. Set DATABASE_URL for production.")
 
+# Run queries on the asyncio drivers (asyncpg / aiosqlite) instead of the threadpool
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "false").lower() in ("1", "true", "yes")
+
 # Create engine with appropriate configuration
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
@@ -32,16 +41,143 @@ else:
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def create_async_database_engine(database_url: str):
+    """Create an engine for the asyncio driver matching the configured database"""
+    url = make_url(database_url)
+
+    if url.get_backend_name() == "sqlite":
+        return create_async_engine(url.set(drivername="sqlite+aiosqlite"), echo=False)
+
+    # asyncpg takes ssl as a connect argument and rejects libpq-only options
+    query = dict(url.query)
+    sslmode = query.pop("sslmode", None)
+    query.pop("channel_binding", None)
+    connect_args = {"ssl": sslmode} if sslmode and sslmode != "disable" else {}
+
+    return create_async_engine(
+        url.set(drivername="postgresql+asyncpg", query=query),
+        connect_args=connect_args,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        echo=False
+    )
+
+if DATABASE_ASYNC:
+    async_engine = create_async_database_engine(DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+else:
+    async_engine = None
+    AsyncSessionLocal = None
+
 # Create Base class
 Base = declarative_base()
 
+@compiles(now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    # SQLite keeps timestamps as text and compares them as text. Bound
+    # datetimes are stored with six fractional digits, so store now() (and
+    # server defaults) the same way, rather than CURRENT_TIMESTAMP's whole
+    # seconds, or equal times would compare unequal
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+class ThreadedSession:
+    """Exposes a synchronous Session through the AsyncSession API.
+
+    Every call that talks to the database runs in the threadpool, so the
+    routers are written once against the async API and never block the
+    event loop, whichever driver is configured.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def bind(self):
+        return self.sync_session.bind
+
+    @property
+    def info(self):
+        return self.sync_session.info
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def scalars(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalars, statement, params, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self, objects=None):
+        await run_in_threadpool(self.sync_session.flush, objects)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def stream(self, statement, params=None, **kwargs):
+        result = await run_in_threadpool(
+            self.sync_session.execute, statement.execution_options(stream_results=True), params, **kwargs
+        )
+        return ThreadedResult(result)
+
+class ThreadedResult:
+    """A streamed Result read through the AsyncResult API (partitions fetched in the threadpool)"""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size=None):
+        partitions = self.result.partitions(size)
+        while True:
+            rows = await run_in_threadpool(next, partitions, None)
+            if rows is None:
+                return
+            yield rows
+
+    async def close(self):
+        await run_in_threadpool(self.result.close)
+
+@asynccontextmanager
+async def session_scope():
+    """Open a session for the configured driver (routers, workers and scripts)"""
+    if DATABASE_ASYNC:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = ThreadedSession(SessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
+
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with session_scope() as db:
         yield db
-    finally:
-        db.close()
 
 # Test database connection
 def test_connection():
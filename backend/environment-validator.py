@@ -52,8 +52,10 @@ def check_required_vars():
     optional_vars = {
         'FRONTEND_URL': 'Frontend application URL',
         'MPESA_CALLBACK_URL': 'M-Pesa callback URL',
+        'MPESA_BASE_URL': 'M-Pesa Daraja host (defaults to the sandbox)',
         'CLOUDINARY_CLOUD_NAME': 'Cloudinary cloud name for file uploads',
         'REDIS_URL': 'Redis URL for caching',
+        'DATABASE_ASYNC': 'Use the asyncio database drivers (true/false)',
     }
     
     all_good = True
@@ -14,6 +14,7 @@ CREATE TYPE payment_status AS ENUM ('completed', 'pending', 'failed');
 CREATE TYPE payment_method AS ENUM ('mpesa', 'cash');
 CREATE TYPE notification_type AS ENUM ('low_stock', 'payment', 'system', 'role_invite');
 CREATE TYPE notification_priority AS ENUM ('high', 'medium', 'low');
+CREATE TYPE job_status AS ENUM ('pending', 'running', 'done', 'failed');
 
 -- Create tables (these will be created by SQLAlchemy, but this shows the structure)
 
@@ -27,6 +28,7 @@ CREATE TABLE IF NOT EXISTS businesses (
     phone VARCHAR,
     email VARCHAR,
     currency VARCHAR DEFAULT 'KES',
+    timezone VARCHAR NOT NULL DEFAULT 'Africa/Nairobi',
     tax_pin VARCHAR,
     business_license VARCHAR,
     logo_url VARCHAR,
@@ -83,7 +85,9 @@ CREATE TABLE IF NOT EXISTS payments (
     status payment_status DEFAULT 'pending',
     method payment_method NOT NULL,
     transaction_id VARCHAR UNIQUE,
+    checkout_request_id VARCHAR UNIQUE,
     mpesa_receipt_number VARCHAR,
+    status_checked_at TIMESTAMP,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE
 );
@@ -110,6 +114,49 @@ CREATE TABLE IF NOT EXISTS notifications (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Read notifications past the retention period
+CREATE TABLE IF NOT EXISTS notification_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    type notification_type NOT NULL,
+    title VARCHAR NOT NULL,
+    message TEXT NOT NULL,
+    priority notification_priority,
+    created_at TIMESTAMP WITH TIME ZONE,
+    archived_at TIMESTAMP NOT NULL
+);
+
+-- Notification retention job runs
+CREATE TABLE IF NOT EXISTS notification_retention_runs (
+    id SERIAL PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL,
+    duration_seconds DOUBLE PRECISION NOT NULL,
+    mode VARCHAR NOT NULL,
+    cutoff TIMESTAMP NOT NULL,
+    batches INTEGER NOT NULL DEFAULT 0,
+    archived INTEGER NOT NULL DEFAULT 0,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    finished BOOLEAN NOT NULL
+);
+
+-- Unread notifications per user (kept in step by the API)
+CREATE TABLE IF NOT EXISTS notification_counters (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Low-stock alert state per product
+CREATE TABLE IF NOT EXISTS low_stock_alerts (
+    product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    business_id INTEGER NOT NULL REFERENCES businesses(id),
+    low BOOLEAN NOT NULL DEFAULT TRUE,
+    pending BOOLEAN NOT NULL DEFAULT TRUE,
+    crossed_at TIMESTAMP NOT NULL,
+    notified_at TIMESTAMP,
+    coalesced INTEGER NOT NULL DEFAULT 0
+);
+
 -- Team invitations table
 CREATE TABLE IF NOT EXISTS team_invitations (
     id SERIAL PRIMARY KEY,
@@ -125,6 +172,96 @@ CREATE TABLE IF NOT EXISTS team_invitations (
     expires_at TIMESTAMP WITH TIME ZONE
 );
 
+-- Daily sales rollup table (per product and category)
+CREATE TABLE IF NOT EXISTS daily_sales_rollup (
+    id SERIAL PRIMARY KEY,
+    business_id INTEGER NOT NULL REFERENCES businesses(id),
+    day DATE NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    category VARCHAR NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    CONSTRAINT uq_daily_sales_rollup_key UNIQUE (business_id, day, product_id, category)
+);
+
+-- Daily customer rollup table (per customer)
+CREATE TABLE IF NOT EXISTS daily_customer_rollup (
+    id SERIAL PRIMARY KEY,
+    business_id INTEGER NOT NULL REFERENCES businesses(id),
+    day DATE NOT NULL,
+    customer_id INTEGER REFERENCES customers(id),
+    orders INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    CONSTRAINT uq_daily_customer_rollup_key UNIQUE (business_id, day, customer_id)
+);
+
+-- Monthly revenue rollup table (per payment method)
+CREATE TABLE IF NOT EXISTS monthly_revenue_rollup (
+    id SERIAL PRIMARY KEY,
+    business_id INTEGER NOT NULL REFERENCES businesses(id),
+    month DATE NOT NULL,
+    method payment_method NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    CONSTRAINT uq_monthly_revenue_rollup_key UNIQUE (business_id, month, method)
+);
+
+-- Idempotency keys table (stored responses for retried requests)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    business_id INTEGER NOT NULL REFERENCES businesses(id),
+    key VARCHAR(255) NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    CONSTRAINT uq_idempotency_keys_key UNIQUE (business_id, key)
+);
+
+-- Background jobs table (durable job queue)
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    priority INTEGER NOT NULL DEFAULT 0,
+    status job_status NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMP NOT NULL,
+    locked_by VARCHAR,
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    dedupe_key VARCHAR UNIQUE,
+    pending_key VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+-- M-Pesa callback inbox (raw callbacks, applied in batches)
+CREATE TABLE IF NOT EXISTS mpesa_callback_inbox (
+    id SERIAL PRIMARY KEY,
+    payload TEXT NOT NULL,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    processed_at TIMESTAMP,
+    checkout_request_id VARCHAR,
+    outcome VARCHAR
+);
+
+-- M-Pesa reconciliation sweeps (payments still pending, checked against Daraja)
+CREATE TABLE IF NOT EXISTS mpesa_reconciliation_runs (
+    id SERIAL PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL,
+    duration_seconds DOUBLE PRECISION NOT NULL,
+    backlog INTEGER NOT NULL,
+    queried INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    still_pending INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    concurrency_limit DOUBLE PRECISION NOT NULL
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_business_id ON users(business_id);
@@ -138,7 +275,27 @@ CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status);
 CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments(created_at);
 CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications(user_id);
 CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(read);
+CREATE INDEX IF NOT EXISTS ix_notifications_user_read_created ON notifications(user_id, read, created_at);
+CREATE INDEX IF NOT EXISTS idx_low_stock_alerts_business_id ON low_stock_alerts(business_id);
 CREATE INDEX IF NOT EXISTS idx_team_invitations_token ON team_invitations(invitation_token);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
+CREATE INDEX IF NOT EXISTS ix_jobs_claim ON jobs(status, priority, run_at);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_jobs_pending_key ON jobs(pending_key);
+CREATE INDEX IF NOT EXISTS idx_mpesa_callback_inbox_processed_at ON mpesa_callback_inbox(processed_at);
+CREATE INDEX IF NOT EXISTS idx_mpesa_callback_inbox_checkout_request_id ON mpesa_callback_inbox(checkout_request_id);
+CREATE INDEX IF NOT EXISTS ix_payments_reconcile ON payments(status, method, created_at);
+CREATE INDEX IF NOT EXISTS idx_mpesa_reconciliation_runs_started_at ON mpesa_reconciliation_runs(started_at);
+CREATE INDEX IF NOT EXISTS ix_notifications_retention ON notifications(read, created_at);
+CREATE INDEX IF NOT EXISTS idx_notification_archive_user_id ON notification_archive(user_id);
+CREATE INDEX IF NOT EXISTS idx_notification_retention_runs_started_at ON notification_retention_runs(started_at);
+CREATE INDEX IF NOT EXISTS ix_products_business_name ON products(business_id, name, id);
+CREATE INDEX IF NOT EXISTS ix_customers_business_name ON customers(business_id, name, id);
+CREATE INDEX IF NOT EXISTS ix_payments_business_created ON payments(business_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_payments_business_status_created ON payments(business_id, status, created_at);
+CREATE INDEX IF NOT EXISTS ix_payment_items_payment_id ON payment_items(payment_id);
+CREATE INDEX IF NOT EXISTS ix_payment_items_product_id ON payment_items(product_id);
+CREATE INDEX IF NOT EXISTS ix_products_low_stock ON products(business_id) WHERE stock <= low_stock_threshold;
+CREATE INDEX IF NOT EXISTS ix_notifications_user_created ON notifications(user_id, created_at, id);
 
 -- Insert sample data
 INSERT INTO businesses (name, business_type, description, address, phone, email) VALUES
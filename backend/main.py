@@ -10,6 +10,10 @@ from dotenv import load_dotenv
 from database import get_db, engine, Base, test_connection
 from routers import auth, business, products, customers, payments, sales, team, notifications
 from models import *  # Import all models to ensure they're created
+from services.jobs import JobRunner, JOB_WORKER_IN_PROCESS
+from services.mpesa import mpesa_service
+from services.notifications import hub as notification_hub
+import services.tasks  # Register the job handlers
 
 load_dotenv()
 
@@ -42,6 +46,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Next-Cursor",
+        "Content-Disposition",
+        "X-Total-Records",
+        "X-Total-Revenue",
+        "X-Average-Transaction"
+    ],
 )
 
 # Security
@@ -57,6 +68,20 @@ app.include_router(sales.router, prefix="/api/sales", tags=["Sales"])
 app.include_router(team.router, prefix="/api/team", tags=["Team"])
 app.include_router(notifications.router, prefix="/api/notifications", tags=["Notifications"])
 
+job_runner = JobRunner()
+
+@app.on_event("startup")
+async def start_background_work():
+    await notification_hub.start()
+    if JOB_WORKER_IN_PROCESS:
+        await job_runner.start()
+
+@app.on_event("shutdown")
+async def stop_background_work():
+    await job_runner.stop()
+    await notification_hub.stop()
+    await mpesa_service.aclose()
+
 @app.get("/")
 async def root():
     return {
@@ -71,6 +96,7 @@ async def health_check():
     return {
         "status": "healthy" if db_status else "unhealthy",
         "database": "connected" if db_status else "disconnected",
+        "mpesa": mpesa_service.breaker_states(),
         "timestamp": datetime.utcnow()
     }
 
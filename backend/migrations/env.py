@@ -0,0 +1,45 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from database import Base, engine
+import models  # noqa: F401 (registers the tables on Base.metadata)
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    """Emit the migration SQL for DATABASE_URL without connecting"""
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"}
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        # The app creates missing tables on startup; do the same here, so
+        # migrations only deal with tables that already exist
+        Base.metadata.create_all(connection)
+        connection.commit()
+
+        # One transaction per migration, so a migration can step out of it
+        # (autocommit_block) for batched backfills and concurrent indexes
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            transaction_per_migration=True
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,65 @@
+"""Payment columns for M-Pesa callbacks and reconciliation
+
+Adds payments.checkout_request_id and payments.status_checked_at to
+databases created before them. M-Pesa payments from before the callback
+inbox kept the CheckoutRequestID in transaction_id; it is copied across in
+batches, each committed on its own, before the unique index is built.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 19:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    # Offline (--sql) there's nothing to inspect: assume the columns are missing
+    offline = context.is_offline_mode()
+    columns = set() if offline else {column["name"] for column in sa.inspect(bind).get_columns("payments")}
+    if "checkout_request_id" not in columns:
+        op.add_column("payments", sa.Column("checkout_request_id", sa.String()))
+    if "status_checked_at" not in columns:
+        op.add_column("payments", sa.Column("status_checked_at", sa.DateTime()))
+
+    legacy = (
+        "checkout_request_id IS NULL AND method = 'MPESA' AND transaction_id LIKE 'ws!_CO!_%' ESCAPE '!'"
+    )
+    with op.get_context().autocommit_block():
+        if offline:
+            op.execute(f"UPDATE payments SET checkout_request_id = transaction_id WHERE {legacy}")
+        else:
+            batch = sa.text(
+                "UPDATE payments SET checkout_request_id = transaction_id"
+                f" WHERE id IN (SELECT id FROM payments WHERE {legacy} LIMIT {BACKFILL_BATCH_SIZE})"
+            )
+            while bind.execute(batch).rowcount == BACKFILL_BATCH_SIZE:
+                pass
+        op.create_index(
+            "ix_payments_checkout_request_id",
+            "payments",
+            ["checkout_request_id"],
+            unique=True,
+            if_not_exists=True,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_payments_checkout_request_id", table_name="payments", if_exists=True, postgresql_concurrently=True)
+    op.drop_column("payments", "status_checked_at")
+    op.drop_column("payments", "checkout_request_id")
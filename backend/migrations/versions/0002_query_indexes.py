@@ -0,0 +1,81 @@
+"""Composite and partial indexes for the router query patterns
+
+Built with CREATE INDEX CONCURRENTLY on Postgres, so writes carry on while
+they build. A concurrent build that fails leaves an invalid index behind;
+it is dropped and rebuilt on the next upgrade.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 19:05:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LOW_STOCK = sa.text("stock <= low_stock_threshold")
+
+# (name, table, columns, options), matching the Index definitions in models.py
+INDEXES = [
+    # Payment listings, dashboard and analytics: one business, one status, a time range
+    ("ix_payments_business_status_created", "payments", ["business_id", "status", "created_at"], {}),
+    # Keyset pagination of a business's payments
+    ("ix_payments_business_created", "payments", ["business_id", "created_at", "id"], {}),
+    # Reconciliation sweep over pending M-Pesa payments
+    ("ix_payments_reconcile", "payments", ["status", "method", "created_at"], {}),
+    # Line items of a payment, and sales of a product
+    ("ix_payment_items_payment_id", "payment_items", ["payment_id"], {}),
+    ("ix_payment_items_product_id", "payment_items", ["product_id"], {}),
+    # A user's (unread) notifications, newest first; also serves unread counts
+    ("ix_notifications_user_read_created", "notifications", ["user_id", "read", "created_at"], {}),
+    ("ix_notifications_user_created", "notifications", ["user_id", "created_at", "id"], {}),
+    ("ix_notifications_retention", "notifications", ["read", "created_at"], {}),
+    # Product and customer listings by name
+    ("ix_products_business_name", "products", ["business_id", "name", "id"], {}),
+    ("ix_customers_business_name", "customers", ["business_id", "name", "id"], {}),
+    # Low-stock listing: only the rows at or below their threshold are indexed
+    ("ix_products_low_stock", "products", ["business_id"], {"postgresql_where": LOW_STOCK, "sqlite_where": LOW_STOCK}),
+]
+
+# Superseded by ix_notifications_user_read_created
+REPLACED_INDEXES = [("ix_notifications_user_unread", "notifications")]
+
+
+def _drop_if_invalid(name: str):
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql" or context.is_offline_mode():
+        return
+    invalid = bind.execute(sa.text(
+        "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid"
+        " WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            _drop_if_invalid(name)
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True, **options)
+        for name, table in REPLACED_INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_notifications_user_unread", "notifications", ["user_id", "read"],
+            if_not_exists=True, postgresql_concurrently=True
+        )
+        for name, table, columns, options in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,38 @@
+"""Business timezone
+
+Adds businesses.timezone, the IANA zone the dashboard and analytics count
+days, weeks and months in. Existing businesses get Africa/Nairobi. The
+daily rollups of existing data were bucketed by UTC day; run
+rebuild_rollups.py afterwards to re-bucket them by business day.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 19:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Offline (--sql) there's nothing to inspect: assume the column is missing
+    if not context.is_offline_mode():
+        if "timezone" in {column["name"] for column in sa.inspect(op.get_bind()).get_columns("businesses")}:
+            return
+    op.add_column(
+        "businesses",
+        sa.Column("timezone", sa.String(), nullable=False, server_default="Africa/Nairobi")
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("businesses", "timezone")
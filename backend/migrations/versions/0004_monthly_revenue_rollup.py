@@ -0,0 +1,52 @@
+"""Monthly revenue rollup
+
+Adds monthly_revenue_rollup: completed payments per business, month (in the
+business's timezone) and payment method, kept up to date as payments
+complete. Run rebuild_rollups.py afterwards to backfill it from history.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 19:15:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Online, env.py has already created it from the models; offline (--sql) emit it
+    if not context.is_offline_mode() and sa.inspect(op.get_bind()).has_table("monthly_revenue_rollup"):
+        return
+    op.create_table(
+        "monthly_revenue_rollup",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("business_id", sa.Integer(), sa.ForeignKey("businesses.id"), nullable=False),
+        sa.Column("month", sa.Date(), nullable=False),
+        # The payments table's enum type, which already exists on Postgres
+        sa.Column(
+            "method",
+            sa.Enum("MPESA", "CASH", name="paymentmethod").with_variant(
+                postgresql.ENUM("MPESA", "CASH", name="paymentmethod", create_type=False), "postgresql"
+            ),
+            nullable=False
+        ),
+        sa.Column("orders", sa.Integer(), nullable=False),
+        sa.Column("revenue", sa.Float(), nullable=False),
+        sa.UniqueConstraint("business_id", "month", "method", name="uq_monthly_revenue_rollup_key")
+    )
+    op.create_index("ix_monthly_revenue_rollup_id", "monthly_revenue_rollup", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_monthly_revenue_rollup_id", table_name="monthly_revenue_rollup")
+    op.drop_table("monthly_revenue_rollup")
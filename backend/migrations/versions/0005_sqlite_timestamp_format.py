@@ -0,0 +1,44 @@
+"""Comparable timestamps on SQLite
+
+SQLite keeps timestamps as text. Rows written with a bound datetime carry
+six fractional digits, while server defaults (CURRENT_TIMESTAMP) had none,
+so equal times compared unequal and keyset cursors could not compare the
+bare created_at column. New databases default to now() with six digits
+(see database.py); this pads existing rows of the keyset-paginated tables
+and gives those tables the new default. Nothing to do on Postgres.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 19:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["payments", "notifications"]
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name != "sqlite":
+        return
+    for table in TABLES:
+        op.execute(f"UPDATE {table} SET created_at = created_at || '.000000' WHERE length(created_at) = 19")
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column("created_at", existing_type=sa.DateTime(timezone=True), server_default=sa.func.now())
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != "sqlite":
+        return
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column("created_at", existing_type=sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"))
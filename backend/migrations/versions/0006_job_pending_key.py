@@ -0,0 +1,36 @@
+"""Job pending keys
+
+Adds jobs.pending_key: a dedupe key that only holds while the job waits to
+run, and is cleared when a worker claims it. M-Pesa callbacks use it, so a
+callback arriving after the apply job has started queues another one.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 19:35:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Offline (--sql) there's nothing to inspect: assume the column is missing
+    if context.is_offline_mode() or "pending_key" not in {
+        column["name"] for column in sa.inspect(op.get_bind()).get_columns("jobs")
+    }:
+        op.add_column("jobs", sa.Column("pending_key", sa.String()))
+    op.create_index("ix_jobs_pending_key", "jobs", ["pending_key"], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobs_pending_key", table_name="jobs", if_exists=True)
+    op.drop_column("jobs", "pending_key")
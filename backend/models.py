@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, Text, ForeignKey, Enum, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -29,6 +29,12 @@ class NotificationType(enum.Enum):
     SYSTEM = "system"
     ROLE_INVITE = "role_invite"
 
+class JobStatus(enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
 class NotificationPriority(enum.Enum):
     HIGH = "high"
     MEDIUM = "medium"
@@ -64,6 +70,8 @@ class Business(Base):
     phone = Column(String)
     email = Column(String)
     currency = Column(String, default="KES")
+    # IANA zone the business's days, weeks and months are counted in
+    timezone = Column(String, nullable=False, default="Africa/Nairobi", server_default="Africa/Nairobi")
     tax_pin = Column(String)
     business_license = Column(String)
     logo_url = Column(String)
@@ -79,6 +87,16 @@ class Business(Base):
 # Product model
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_products_business_name", "business_id", "name", "id"),
+        # Only low-stock rows, so the low-stock listing reads a handful of entries
+        Index(
+            "ix_products_low_stock",
+            "business_id",
+            postgresql_where=text("stock <= low_stock_threshold"),
+            sqlite_where=text("stock <= low_stock_threshold")
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -97,6 +115,9 @@ class Product(Base):
 # Customer model
 class Customer(Base):
     __tablename__ = "customers"
+    __table_args__ = (
+        Index("ix_customers_business_name", "business_id", "name", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -116,6 +137,11 @@ class Customer(Base):
 # Payment model
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_reconcile", "status", "method", "created_at"),
+        Index("ix_payments_business_created", "business_id", "created_at", "id"),
+        Index("ix_payments_business_status_created", "business_id", "status", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
@@ -124,7 +150,9 @@ class Payment(Base):
     status = Column(Enum(PaymentStatus), default=PaymentStatus.PENDING)
     method = Column(Enum(PaymentMethod), nullable=False)
     transaction_id = Column(String, unique=True)
+    checkout_request_id = Column(String, unique=True, index=True)  # Daraja CheckoutRequestID of the STK push
     mpesa_receipt_number = Column(String)
+    status_checked_at = Column(DateTime)  # Last Daraja status query by the reconciliation sweep
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -138,8 +166,8 @@ class PaymentItem(Base):
     __tablename__ = "payment_items"
     
     id = Column(Integer, primary_key=True, index=True)
-    payment_id = Column(Integer, ForeignKey("payments.id"))
-    product_id = Column(Integer, ForeignKey("products.id"))
+    payment_id = Column(Integer, ForeignKey("payments.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     quantity = Column(Integer, default=1)
     unit_price = Column(Float, nullable=False)
     total_price = Column(Float, nullable=False)
@@ -151,6 +179,11 @@ class PaymentItem(Base):
 # Notification model
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_user_read_created", "user_id", "read", "created_at"),
+        Index("ix_notifications_retention", "read", "created_at"),
+        Index("ix_notifications_user_created", "user_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -164,6 +197,56 @@ class Notification(Base):
     # Relationships
     user = relationship("User", back_populates="notifications")
 
+# Read notifications past the retention period (services.retention), kept
+# out of the live table
+class NotificationArchive(Base):
+    __tablename__ = "notification_archive"
+    
+    id = Column(Integer, primary_key=True)  # the notification's original id
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    type = Column(Enum(NotificationType), nullable=False)
+    title = Column(String, nullable=False)
+    message = Column(Text, nullable=False)
+    priority = Column(Enum(NotificationPriority))
+    created_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime, nullable=False)
+
+# One pass of the notification retention job
+class NotificationRetentionRun(Base):
+    __tablename__ = "notification_retention_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    started_at = Column(DateTime, nullable=False, index=True)
+    duration_seconds = Column(Float, nullable=False)
+    mode = Column(String, nullable=False)  # archive or delete
+    cutoff = Column(DateTime, nullable=False)
+    batches = Column(Integer, nullable=False, default=0)
+    archived = Column(Integer, nullable=False, default=0)
+    deleted = Column(Integer, nullable=False, default=0)
+    finished = Column(Boolean, nullable=False)  # False when the time budget ran out first
+
+# Unread notifications per user, kept in step with every notification write
+# (services.notifications), so badges are a point read
+class NotificationCounter(Base):
+    __tablename__ = "notification_counters"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    unread_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Low-stock alert state per product (services.low_stock): alerts fire when
+# stock crosses the threshold, at most once per product per window
+class LowStockAlert(Base):
+    __tablename__ = "low_stock_alerts"
+    
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False, index=True)
+    low = Column(Boolean, nullable=False, default=True)  # at or below threshold since the last crossing
+    pending = Column(Boolean, nullable=False, default=True)  # crossing not yet handled by the alert job
+    crossed_at = Column(DateTime, nullable=False)
+    notified_at = Column(DateTime)
+    coalesced = Column(Integer, nullable=False, default=0)  # crossings folded into the last alert
+
 # Team Invitation model
 class TeamInvitation(Base):
     __tablename__ = "team_invitations"
@@ -179,3 +262,112 @@ class TeamInvitation(Base):
     invited_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True))
+
+# Daily sales rollup (per product and category, maintained as payments complete)
+class DailySalesRollup(Base):
+    __tablename__ = "daily_sales_rollup"
+    __table_args__ = (
+        UniqueConstraint("business_id", "day", "product_id", "category", name="uq_daily_sales_rollup_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    category = Column(String, nullable=False)
+    quantity = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+
+# Daily customer rollup (per customer, backs revenue, order and active customer metrics)
+class DailyCustomerRollup(Base):
+    __tablename__ = "daily_customer_rollup"
+    __table_args__ = (
+        UniqueConstraint("business_id", "day", "customer_id", name="uq_daily_customer_rollup_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id"))
+    orders = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+
+# Monthly revenue rollup (per payment method, backs the revenue analytics)
+class MonthlyRevenueRollup(Base):
+    __tablename__ = "monthly_revenue_rollup"
+    __table_args__ = (
+        UniqueConstraint("business_id", "month", "method", name="uq_monthly_revenue_rollup_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    month = Column(Date, nullable=False)  # First day of the month, in the business's timezone
+    method = Column(Enum(PaymentMethod), nullable=False)
+    orders = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+
+# Idempotency keys (stored responses for retried requests)
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("business_id", "key", name="uq_idempotency_keys_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    response = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# Background jobs (durable queue drained by services.jobs.JobRunner)
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_claim", "status", "priority", "run_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    payload = Column(Text, nullable=False, default="{}")
+    priority = Column(Integer, nullable=False, default=0)
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False)
+    locked_by = Column(String)
+    locked_at = Column(DateTime)
+    last_error = Column(Text)
+    dedupe_key = Column(String, unique=True)
+    # Like dedupe_key, but only held until the job is claimed (services.jobs.enqueue_once)
+    pending_key = Column(String, unique=True, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime)
+
+# Raw M-Pesa callbacks, acknowledged on arrival and applied in batches
+class MpesaCallbackInbox(Base):
+    __tablename__ = "mpesa_callback_inbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    payload = Column(Text, nullable=False)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime, index=True)
+    checkout_request_id = Column(String, index=True)
+    outcome = Column(String)  # completed, failed, duplicate, unmatched or invalid
+
+# One reconciliation sweep that found M-Pesa payments still pending (services.reconciliation)
+class MpesaReconciliationRun(Base):
+    __tablename__ = "mpesa_reconciliation_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    started_at = Column(DateTime, nullable=False, index=True)
+    duration_seconds = Column(Float, nullable=False)
+    backlog = Column(Integer, nullable=False)
+    queried = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    still_pending = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    concurrency_limit = Column(Float, nullable=False)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+STK push latency and throughput against a local Daraja stand-in
+Shows how many OAuth token requests and TCP connections MpesaService really makes
+Uses the Daraja simulator (mpesa_simulator.py) with callbacks turned off
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import uvicorn
+
+from mpesa_simulator import SimulatorConfig, create_simulator
+
+async def run_benchmark(args):
+    from services.mpesa import MpesaService
+
+    stand_in = create_simulator(SimulatorConfig(
+        latency_ms=args.latency_ms,
+        token_lifetime=args.token_lifetime,
+        callbacks=False
+    ))
+    server = uvicorn.Server(uvicorn.Config(stand_in, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    service = MpesaService(base_url=f"http://127.0.0.1:{args.port}")
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def push(n):
+        nonlocal failures
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await service.stk_push("0712345678", 1, f"BENCH-{n}", "Benchmark")
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(push(n) for n in range(args.requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await service.aclose()
+        server.should_exit = True
+        await serving
+
+    latencies.sort()
+    print(f"\n📊 {args.requests} STK pushes, {args.concurrency} concurrent, {args.latency_ms}ms Daraja latency")
+    print(f"   Elapsed: {elapsed:.2f}s")
+    print(f"   Throughput: {args.requests / elapsed:.1f} pushes/s")
+    print(f"   Latency p50: {statistics.median(latencies) * 1000:.1f}ms, "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"   Failures: {failures}")
+    print(f"   OAuth token requests: {stand_in.state.stats.token_requests}")
+    print(f"   TCP connections opened: {len(stand_in.state.stats.connections)}")
+
+    if failures:
+        print("❌ Some STK pushes failed")
+        return False
+
+    print("✅ Benchmark complete")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MpesaService against a local Daraja stand-in")
+    parser.add_argument("--requests", type=int, default=1000, help="Total STK pushes")
+    parser.add_argument("--concurrency", type=int, default=50, help="Simultaneous STK pushes")
+    parser.add_argument("--latency-ms", type=int, default=50, help="Stand-in response latency")
+    parser.add_argument("--token-lifetime", type=int, default=3599, help="Token expires_in, in seconds")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the stand-in")
+    args = parser.parse_args()
+
+    if not asyncio.run(run_benchmark(args)):
+        sys.exit(1)
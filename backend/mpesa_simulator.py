@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Local Daraja (M-Pesa) simulator for load and latency testing
+Implements the OAuth, STK push and STK query endpoints MpesaService calls, and
+sends the customer's answer to the callback URL a little later, like Safaricom does
+Point the API at it with MPESA_BASE_URL=http://127.0.0.1:8090
+"""
+
+import argparse
+import asyncio
+import base64
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Non-zero result codes a customer can end an STK push with
+FAILURE_RESULTS = [
+    (1032, "Request cancelled by user"),
+    (1037, "DS timeout user cannot be reached"),
+    (1, "The balance is insufficient for the transaction"),
+    (2001, "The initiator information is invalid")
+]
+
+@dataclass
+class SimulatorConfig:
+    latency_ms: float = 50             # API response latency
+    latency_jitter_ms: float = 0       # plus a uniform random extra of up to this
+    api_error_rate: float = 0.0        # STK push / query requests answered with HTTP 500
+    token_lifetime: int = 3599         # expires_in of issued access tokens
+    callbacks: bool = True             # send result callbacks at all
+    callback_url: Optional[str] = None # overrides the CallBackURL sent in each push
+    callback_delay_ms: float = 3000    # time the "customer" takes to answer the prompt
+    callback_jitter_ms: float = 2000
+    failure_rate: float = 0.1          # pushes the customer cancels or that fail
+    duplicate_rate: float = 0.0        # callbacks Daraja delivers twice
+    drop_rate: float = 0.0             # callbacks that are never delivered (STK query still answers)
+
+class Stats:
+    def __init__(self):
+        self.token_requests = 0
+        self.stk_requests = 0
+        self.query_requests = 0
+        self.api_errors = 0
+        self.callbacks_sent = 0
+        self.callbacks_duplicated = 0
+        self.callbacks_dropped = 0
+        self.callbacks_failed = 0
+        self.callback_latencies = []
+        self.connections = set()
+
+    def to_dict(self) -> dict:
+        latencies = sorted(self.callback_latencies)
+        return {
+            "token_requests": self.token_requests,
+            "stk_requests": self.stk_requests,
+            "query_requests": self.query_requests,
+            "api_errors": self.api_errors,
+            "callbacks_sent": self.callbacks_sent,
+            "callbacks_duplicated": self.callbacks_duplicated,
+            "callbacks_dropped": self.callbacks_dropped,
+            "callbacks_failed": self.callbacks_failed,
+            "callback_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "callback_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+            "connections": len(self.connections)
+        }
+
+def stk_callback_body(checkout_request_id: str, transaction: dict) -> dict:
+    """The JSON Daraja posts to CallBackURL once the customer has answered"""
+    callback = {
+        "MerchantRequestID": transaction["merchant_request_id"],
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": transaction["result_code"],
+        "ResultDesc": transaction["result_desc"]
+    }
+    if transaction["result_code"] == 0:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": transaction["amount"]},
+            {"Name": "MpesaReceiptNumber", "Value": transaction["receipt"]},
+            {"Name": "TransactionDate", "Value": int(datetime.now().strftime("%Y%m%d%H%M%S"))},
+            {"Name": "PhoneNumber", "Value": transaction["phone"]}
+        ]}
+    return {"Body": {"stkCallback": callback}}
+
+def create_simulator(config: SimulatorConfig) -> FastAPI:
+    app = FastAPI(title="Daraja simulator")
+    app.state.config = config
+    app.state.stats = Stats()
+    tokens: Dict[str, float] = {}
+    transactions: Dict[str, dict] = {}
+    pending_callbacks = set()
+    client: Optional[httpx.AsyncClient] = None
+
+    def error(status_code: int, code: str, message: str) -> JSONResponse:
+        return JSONResponse(
+            status_code=status_code,
+            content={"requestId": uuid.uuid4().hex, "errorCode": code, "errorMessage": message}
+        )
+
+    async def respond_delay(request: Request):
+        app.state.stats.connections.add((request.client.host, request.client.port))
+        await asyncio.sleep((config.latency_ms + random.uniform(0, config.latency_jitter_ms)) / 1000)
+
+    def authorised(request: Request) -> bool:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return tokens.get(token, 0) > time.monotonic()
+
+    async def deliver(url: str, body: dict, started: float):
+        try:
+            response = await client.post(url, json=body)
+            response.raise_for_status()
+            app.state.stats.callbacks_sent += 1
+            app.state.stats.callback_latencies.append(time.monotonic() - started)
+        except httpx.HTTPError:
+            app.state.stats.callbacks_failed += 1
+
+    async def answer(checkout_request_id: str, url: str):
+        """Let the customer answer, then send the callback (maybe twice, maybe never)"""
+        delay = config.callback_delay_ms + random.uniform(0, config.callback_jitter_ms)
+        await asyncio.sleep(delay / 1000)
+        transaction = transactions[checkout_request_id]
+        transaction["done"] = True
+
+        if not config.callbacks:
+            return
+        if random.random() < config.drop_rate:
+            app.state.stats.callbacks_dropped += 1
+            return
+
+        body = stk_callback_body(checkout_request_id, transaction)
+        started = time.monotonic()
+        deliveries = [deliver(url, body, started)]
+        if random.random() < config.duplicate_rate:
+            app.state.stats.callbacks_duplicated += 1
+            deliveries.append(deliver(url, body, started))
+        await asyncio.gather(*deliveries)
+
+    @app.on_event("startup")
+    async def open_client():
+        nonlocal client
+        client = httpx.AsyncClient(timeout=httpx.Timeout(30, connect=5))
+
+    @app.on_event("shutdown")
+    async def close_client():
+        for task in list(pending_callbacks):
+            task.cancel()
+        await client.aclose()
+
+    @app.get("/oauth/v1/generate")
+    async def generate_token(request: Request):
+        app.state.stats.token_requests += 1
+        await respond_delay(request)
+        try:
+            credentials = base64.b64decode(request.headers.get("Authorization", "").removeprefix("Basic ")).decode()
+        except ValueError:
+            credentials = ""
+        if ":" not in credentials:
+            return error(400, "400.008.01", "Invalid Authentication passed")
+
+        token = uuid.uuid4().hex
+        tokens[token] = time.monotonic() + config.token_lifetime
+        return {"access_token": token, "expires_in": str(config.token_lifetime)}
+
+    @app.post("/mpesa/stkpush/v1/processrequest")
+    async def stk_push(request: Request):
+        app.state.stats.stk_requests += 1
+        await respond_delay(request)
+        if not authorised(request):
+            return error(401, "404.001.03", "Invalid Access Token")
+        if random.random() < config.api_error_rate:
+            app.state.stats.api_errors += 1
+            return error(500, "500.003.02", "System is busy. Please try again in few minutes.")
+
+        payload = await request.json()
+        checkout_request_id = f"ws_CO_{datetime.now().strftime('%d%m%Y%H%M%S')}{uuid.uuid4().hex[:12]}"
+        failed = random.random() < config.failure_rate
+        result_code, result_desc = random.choice(FAILURE_RESULTS) if failed else (
+            0, "The service request is processed successfully."
+        )
+        transactions[checkout_request_id] = {
+            "merchant_request_id": uuid.uuid4().hex[:20],
+            "amount": payload.get("Amount"),
+            "phone": payload.get("PhoneNumber", "254700000000"),
+            "result_code": result_code,
+            "result_desc": result_desc,
+            "receipt": uuid.uuid4().hex[:10].upper(),
+            "done": False
+        }
+
+        task = asyncio.create_task(answer(checkout_request_id, config.callback_url or payload.get("CallBackURL")))
+        pending_callbacks.add(task)
+        task.add_done_callback(pending_callbacks.discard)
+
+        return {
+            "MerchantRequestID": transactions[checkout_request_id]["merchant_request_id"],
+            "CheckoutRequestID": checkout_request_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing"
+        }
+
+    @app.post("/mpesa/stkpushquery/v1/query")
+    async def stk_query(request: Request):
+        app.state.stats.query_requests += 1
+        await respond_delay(request)
+        if not authorised(request):
+            return error(401, "404.001.03", "Invalid Access Token")
+        if random.random() < config.api_error_rate:
+            app.state.stats.api_errors += 1
+            return error(500, "500.003.02", "System is busy. Please try again in few minutes.")
+
+        checkout_request_id = (await request.json()).get("CheckoutRequestID")
+        transaction = transactions.get(checkout_request_id)
+        if transaction is None:
+            return error(400, "400.002.02", "Bad Request - Invalid CheckoutRequestID")
+        if not transaction["done"]:
+            return error(500, "500.001.1001", "The transaction is being processed")
+
+        return {
+            "ResponseCode": "0",
+            "ResponseDescription": "The service request has been accepted successsfully",
+            "MerchantRequestID": transaction["merchant_request_id"],
+            "CheckoutRequestID": checkout_request_id,
+            "ResultCode": str(transaction["result_code"]),
+            "ResultDesc": transaction["result_desc"]
+        }
+
+    @app.get("/simulator/stats")
+    async def stats():
+        return {
+            **app.state.stats.to_dict(),
+            "transactions": len(transactions),
+            "awaiting_answer": sum(1 for transaction in transactions.values() if not transaction["done"])
+        }
+
+    return app
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a local Daraja (M-Pesa) simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=50, help="API response latency")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0, help="Random extra API latency, up to this")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="Share of push/query requests answered with HTTP 500")
+    parser.add_argument("--token-lifetime", type=int, default=3599, help="Access token expires_in, in seconds")
+    parser.add_argument("--callback-url", help="Send callbacks here instead of each push's CallBackURL")
+    parser.add_argument("--callback-delay-ms", type=float, default=3000, help="Time before the customer answers")
+    parser.add_argument("--callback-jitter-ms", type=float, default=2000, help="Random extra answer time, up to this")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="Share of pushes that fail or are cancelled")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Share of callbacks delivered twice")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of callbacks never delivered")
+    parser.add_argument("--no-callbacks", action="store_true", help="Don't send callbacks at all")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = SimulatorConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        api_error_rate=args.api_error_rate,
+        token_lifetime=args.token_lifetime,
+        callbacks=not args.no_callbacks,
+        callback_url=args.callback_url,
+        callback_delay_ms=args.callback_delay_ms,
+        callback_jitter_ms=args.callback_jitter_ms,
+        failure_rate=args.failure_rate,
+        duplicate_rate=args.duplicate_rate,
+        drop_rate=args.drop_rate
+    )
+    print(f"🚀 Daraja simulator on http://{args.host}:{args.port} (stats at /simulator/stats)")
+    print(f"   Set MPESA_BASE_URL=http://{args.host}:{args.port} for the API and workers")
+    uvicorn.run(create_simulator(config), host=args.host, port=args.port, log_level="warning")
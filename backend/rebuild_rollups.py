@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Backfill or rebuild the sales analytics rollups from the payments history
+Run once after deploying the rollup tables, or whenever the rollups need repair
+"""
+
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy import select, func
+
+from database import session_scope, engine, Base
+from models import *  # Import all models to ensure the rollup tables exist
+from services.rollup import rebuild_rollups
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild the daily sales and monthly revenue rollups")
+    parser.add_argument("--business-id", type=int, help="Only rebuild this business")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    async with session_scope() as db:
+        try:
+            scope = f"business {args.business_id}" if args.business_id else "all businesses"
+            print(f"🔄 Rebuilding sales rollups for {scope}...")
+
+            await rebuild_rollups(db, business_id=args.business_id)
+            await db.commit()
+
+            sales_rows = await db.scalar(select(func.count()).select_from(DailySalesRollup))
+            customer_rows = await db.scalar(select(func.count()).select_from(DailyCustomerRollup))
+            month_rows = await db.scalar(select(func.count()).select_from(MonthlyRevenueRollup))
+            print(f"   Daily sales rows: {sales_rows}")
+            print(f"   Daily customer rows: {customer_rows}")
+            print(f"   Monthly revenue rows: {month_rows}")
+            print("\n✅ Rollups rebuilt successfully!")
+            return True
+
+        except Exception as e:
+            print(f"❌ Error rebuilding rollups: {str(e)}")
+            await db.rollback()
+            return False
+
+if __name__ == "__main__":
+    if not asyncio.run(main()):
+        sys.exit(1)
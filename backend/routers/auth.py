@@ -1,15 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
 from database import get_db
-from models import User, Business
+from models import User, Business, UserRole, UserStatus
 from schemas import Token, LoginRequest, RegisterRequest, User as UserSchema
 from auth import (
-    verify_password, 
-    get_password_hash, 
-    create_access_token, 
+    Principal,
+    verify_and_update_password, 
+    hash_password, 
+    login_slot,
+    create_user_access_token, 
     ACCESS_TOKEN_EXPIRE_MINUTES,
     get_current_active_user
 )
@@ -17,11 +20,11 @@ from auth import (
 router = APIRouter()
 
 @router.post("/register", response_model=Token)
-async def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
+async def register(user_data: RegisterRequest, db: AsyncSession = Depends(get_db)):
     """Register a new user and business"""
     
     # Check if user already exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == user_data.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -34,28 +37,26 @@ async def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
         email=user_data.email
     )
     db.add(business)
-    db.commit()
-    db.refresh(business)
+    await db.commit()
+    await db.refresh(business)
     
     # Create user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     user = User(
         name=user_data.name,
         email=user_data.email,
         hashed_password=hashed_password,
-        role="admin",  # First user is admin
+        role=UserRole.ADMIN,  # First user is admin
         business_id=business.id
     )
     
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
     
     return {
         "access_token": access_token,
@@ -64,29 +65,39 @@ async def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
     }
 
 @router.post("/login", response_model=Token)
-async def login(user_data: LoginRequest, db: Session = Depends(get_db)):
+async def login(user_data: LoginRequest, db: AsyncSession = Depends(get_db)):
     """Authenticate user and return token"""
     
     # Find user
-    user = db.query(User).filter(User.email == user_data.email).first()
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    user = await db.scalar(select(User).where(User.email == user_data.email))
+    
+    verified, new_hash = False, None
+    if user:
+        async with login_slot():
+            verified, new_hash = await verify_and_update_password(user_data.password, user.hashed_password)
+    
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
     # Check if user is active
-    if user.status != "active":
+    if user.status != UserStatus.ACTIVE:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Account is not active"
         )
     
+    # Upgrade hashes made with a different bcrypt cost
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        await db.refresh(user)
+    
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
     
     return {
         "access_token": access_token,
@@ -95,20 +106,31 @@ async def login(user_data: LoginRequest, db: Session = Depends(get_db)):
     }
 
 @router.get("/me", response_model=UserSchema)
-async def get_current_user_info(current_user: User = Depends(get_current_active_user)):
+async def get_current_user_info(
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
     """Get current user information"""
-    return current_user
+    return await db.get(User, current_user.id)
 
 @router.post("/refresh", response_model=Token)
-async def refresh_token(current_user: User = Depends(get_current_active_user)):
+async def refresh_token(
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
     """Refresh access token"""
+    user = await db.get(User, current_user.id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found"
+        )
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": current_user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "user": current_user
+        "user": user
     }
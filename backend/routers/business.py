@@ -1,21 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
 from database import get_db
-from models import Business, User
+from models import Business, Product, Customer, Payment, PaymentStatus
 from schemas import Business as BusinessSchema, BusinessUpdate
-from auth import get_current_active_user, get_admin_user
+from auth import Principal, get_current_active_user, get_admin_user
+from services.cache import response_cache, invalidate_after_commit
 
 router = APIRouter()
 
 @router.get("/profile", response_model=BusinessSchema)
 async def get_business_profile(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get business profile"""
-    business = db.query(Business).filter(Business.id == current_user.business_id).first()
+    business = await db.get(Business, current_user.business_id)
     if not business:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -26,11 +28,11 @@ async def get_business_profile(
 @router.put("/profile", response_model=BusinessSchema)
 async def update_business_profile(
     business_data: BusinessUpdate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update business profile (admin only)"""
-    business = db.query(Business).filter(Business.id == current_user.business_id).first()
+    business = await db.get(Business, current_user.business_id)
     if not business:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -41,32 +43,32 @@ async def update_business_profile(
     for field, value in business_data.dict(exclude_unset=True).items():
         setattr(business, field, value)
     
-    db.commit()
-    db.refresh(business)
+    # A new timezone moves the dashboard's days, weeks and months
+    invalidate_after_commit(db, business.id)
+    await db.commit()
+    await db.refresh(business)
     return business
 
-@router.get("/stats")
-async def get_business_stats(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """Get business statistics"""
-    from models import Product, Customer, Payment
-    
-    business_id = current_user.business_id
-    
+async def _business_stats(db: AsyncSession, business_id: int) -> dict:
+    """Counts and revenue totals of a business"""
     # Get counts
-    total_products = db.query(Product).filter(Product.business_id == business_id).count()
-    total_customers = db.query(Customer).filter(Customer.business_id == business_id).count()
-    total_payments = db.query(Payment).filter(Payment.business_id == business_id).count()
+    total_products = await db.scalar(
+        select(func.count()).select_from(Product).where(Product.business_id == business_id)
+    )
+    total_customers = await db.scalar(
+        select(func.count()).select_from(Customer).where(Customer.business_id == business_id)
+    )
+    total_payments = await db.scalar(
+        select(func.count()).select_from(Payment).where(Payment.business_id == business_id)
+    )
     
     # Get revenue
-    total_revenue = db.query(Payment).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed"
-    ).with_entities(Payment.amount).all()
-    
-    revenue_sum = sum([payment.amount for payment in total_revenue]) if total_revenue else 0
+    revenue_sum = await db.scalar(
+        select(func.sum(Payment.amount)).where(
+            Payment.business_id == business_id,
+            Payment.status == PaymentStatus.COMPLETED
+        )
+    ) or 0
     
     return {
         "total_products": total_products,
@@ -75,3 +77,17 @@ async def get_business_stats(
         "total_revenue": revenue_sum,
         "average_order_value": revenue_sum / total_payments if total_payments > 0 else 0
     }
+
+@router.get("/stats")
+async def get_business_stats(
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get business statistics"""
+    business_id = current_user.business_id
+    return await response_cache.get_or_compute(
+        db,
+        "business.stats",
+        business_id,
+        lambda session: _business_stats(session, business_id)
+    )
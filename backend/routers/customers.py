@@ -1,49 +1,73 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, status, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
 from database import get_db
-from models import Customer, User, Payment
+from models import Customer, Payment, PaymentStatus, UserStatus
 from schemas import Customer as CustomerSchema, CustomerCreate, CustomerUpdate
-from auth import get_current_active_user, get_manager_or_admin_user
+from auth import Principal, get_current_active_user, get_manager_or_admin_user
+from services.pagination import Keyset, InvalidCursorError, fetch_page
+from services.cache import response_cache, invalidate_after_commit
 
 router = APIRouter()
 
+customer_keyset = Keyset("customers", Customer.name, Customer.id)
+
 @router.get("/", response_model=List[CustomerSchema])
 async def get_customers(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: Optional[str] = None,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all customers for the business"""
-    query = db.query(Customer).filter(Customer.business_id == current_user.business_id)
+    """Get all customers for the business.
+
+    Pass cursor (empty for the first page) to page by keyset instead of
+    skip; the next page's cursor comes back in the X-Next-Cursor header.
+    """
+    query = select(Customer).where(Customer.business_id == current_user.business_id)
     
     if search:
-        query = query.filter(
+        query = query.where(
             Customer.name.ilike(f"%{search}%") |
             Customer.phone.ilike(f"%{search}%") |
             Customer.email.ilike(f"%{search}%")
         )
     
-    customers = query.offset(skip).limit(limit).all()
+    if cursor is not None:
+        try:
+            customers, next_cursor = await fetch_page(db, query, customer_keyset, cursor, limit)
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return customers
+    
+    customers = (await db.scalars(query.offset(skip).limit(limit))).all()
     return customers
 
 @router.post("/", response_model=CustomerSchema)
 async def create_customer(
     customer_data: CustomerCreate,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new customer"""
     # Check if customer with same email already exists
     if customer_data.email:
-        existing_customer = db.query(Customer).filter(
-            Customer.email == customer_data.email,
-            Customer.business_id == current_user.business_id
-        ).first()
+        existing_customer = await db.scalar(
+            select(Customer).where(
+                Customer.email == customer_data.email,
+                Customer.business_id == current_user.business_id
+            )
+        )
         
         if existing_customer:
             raise HTTPException(
@@ -57,21 +81,24 @@ async def create_customer(
     )
     
     db.add(customer)
-    db.commit()
-    db.refresh(customer)
+    invalidate_after_commit(db, current_user.business_id)
+    await db.commit()
+    await db.refresh(customer)
     return customer
 
 @router.get("/{customer_id}", response_model=CustomerSchema)
 async def get_customer(
     customer_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get a specific customer"""
-    customer = db.query(Customer).filter(
-        Customer.id == customer_id,
-        Customer.business_id == current_user.business_id
-    ).first()
+    customer = await db.scalar(
+        select(Customer).where(
+            Customer.id == customer_id,
+            Customer.business_id == current_user.business_id
+        )
+    )
     
     if not customer:
         raise HTTPException(
@@ -85,14 +112,16 @@ async def get_customer(
 async def update_customer(
     customer_id: int,
     customer_data: CustomerUpdate,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update a customer"""
-    customer = db.query(Customer).filter(
-        Customer.id == customer_id,
-        Customer.business_id == current_user.business_id
-    ).first()
+    customer = await db.scalar(
+        select(Customer).where(
+            Customer.id == customer_id,
+            Customer.business_id == current_user.business_id
+        )
+    )
     
     if not customer:
         raise HTTPException(
@@ -102,23 +131,28 @@ async def update_customer(
     
     # Update customer fields
     for field, value in customer_data.dict(exclude_unset=True).items():
+        if field == "status" and value:
+            value = UserStatus(value)
         setattr(customer, field, value)
     
-    db.commit()
-    db.refresh(customer)
+    invalidate_after_commit(db, current_user.business_id)
+    await db.commit()
+    await db.refresh(customer)
     return customer
 
 @router.delete("/{customer_id}")
 async def delete_customer(
     customer_id: int,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a customer"""
-    customer = db.query(Customer).filter(
-        Customer.id == customer_id,
-        Customer.business_id == current_user.business_id
-    ).first()
+    customer = await db.scalar(
+        select(Customer).where(
+            Customer.id == customer_id,
+            Customer.business_id == current_user.business_id
+        )
+    )
     
     if not customer:
         raise HTTPException(
@@ -126,22 +160,25 @@ async def delete_customer(
             detail="Customer not found"
         )
     
-    db.delete(customer)
-    db.commit()
+    await db.delete(customer)
+    invalidate_after_commit(db, current_user.business_id)
+    await db.commit()
     
     return {"message": "Customer deleted successfully"}
 
 @router.get("/{customer_id}/history")
 async def get_customer_purchase_history(
     customer_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get customer's purchase history"""
-    customer = db.query(Customer).filter(
-        Customer.id == customer_id,
-        Customer.business_id == current_user.business_id
-    ).first()
+    customer = await db.scalar(
+        select(Customer).where(
+            Customer.id == customer_id,
+            Customer.business_id == current_user.business_id
+        )
+    )
     
     if not customer:
         raise HTTPException(
@@ -150,14 +187,16 @@ async def get_customer_purchase_history(
         )
     
     # Get customer's payments with items
-    payments = db.query(Payment).filter(
-        Payment.customer_id == customer_id,
-        Payment.business_id == current_user.business_id
-    ).order_by(Payment.created_at.desc()).all()
+    payments = (await db.scalars(
+        select(Payment).where(
+            Payment.customer_id == customer_id,
+            Payment.business_id == current_user.business_id
+        ).order_by(Payment.created_at.desc())
+    )).all()
     
     # Calculate statistics
     total_orders = len(payments)
-    total_spent = sum([p.amount for p in payments if p.status == "completed"])
+    total_spent = sum([p.amount for p in payments if p.status == PaymentStatus.COMPLETED])
     average_order = total_spent / total_orders if total_orders > 0 else 0
     
     return {
@@ -170,15 +209,25 @@ async def get_customer_purchase_history(
         }
     }
 
+async def _top_customers(db: AsyncSession, business_id: int, limit: int):
+    return (await db.scalars(
+        select(Customer).where(
+            Customer.business_id == business_id
+        ).order_by(Customer.total_purchases.desc()).limit(limit)
+    )).all()
+
 @router.get("/analytics/top")
 async def get_top_customers(
     limit: int = 10,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get top customers by total purchases"""
-    customers = db.query(Customer).filter(
-        Customer.business_id == current_user.business_id
-    ).order_by(Customer.total_purchases.desc()).limit(limit).all()
-    
-    return customers
+    business_id = current_user.business_id
+    return await response_cache.get_or_compute(
+        db,
+        "customers.top",
+        business_id,
+        lambda session: _top_customers(session, business_id, limit),
+        limit=limit
+    )
@@ -1,31 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import asyncio
+import json
 
 from database import get_db
-from models import Notification, User
+from models import Notification
 from schemas import Notification as NotificationSchema, NotificationUpdate
-from auth import get_current_active_user
+from auth import Principal, get_current_active_user, get_stream_user
+from services.notifications import (
+    hub,
+    adjust_unread,
+    count_unread,
+    publish_after_commit,
+    NOTIFICATION_STREAM_HEARTBEAT_SECONDS
+)
+from services.pagination import Keyset, InvalidCursorError, fetch_page
 
 router = APIRouter()
 
+notification_keyset = Keyset("notifications", Notification.created_at, Notification.id, descending=True)
+
 @router.get("/", response_model=List[NotificationSchema])
 async def get_notifications(
+    response: Response,
     skip: int = 0,
     limit: int = 50,
     unread_only: bool = False,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get notifications for the current user"""
-    query = db.query(Notification).filter(Notification.user_id == current_user.id)
+    """Get notifications for the current user.
+
+    Pass cursor (empty for the first page) to page by keyset instead of
+    skip; the next page's cursor comes back in the X-Next-Cursor header.
+    """
+    query = select(Notification).where(Notification.user_id == current_user.id)
     
     if unread_only:
-        query = query.filter(Notification.read == False)
+        query = query.where(Notification.read == False)
     
-    notifications = query.order_by(
-        Notification.created_at.desc()
-    ).offset(skip).limit(limit).all()
+    if cursor is not None:
+        try:
+            notifications, next_cursor = await fetch_page(db, query, notification_keyset, cursor, limit)
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return notifications
+    
+    notifications = (await db.scalars(
+        query.order_by(Notification.created_at.desc()).offset(skip).limit(limit)
+    )).all()
     
     return notifications
 
@@ -33,14 +65,36 @@ async def get_notifications(
 async def update_notification(
     notification_id: int,
     notification_data: NotificationUpdate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update a notification (mark as read/unread)"""
-    notification = db.query(Notification).filter(
-        Notification.id == notification_id,
-        Notification.user_id == current_user.id
-    ).first()
+    # Only an actual change moves the unread counter, however many requests race
+    changed = await db.scalar(
+        update(Notification).where(
+            Notification.id == notification_id,
+            Notification.user_id == current_user.id,
+            Notification.read != notification_data.read
+        ).values(read=notification_data.read).returning(Notification.id).execution_options(
+            synchronize_session=False
+        )
+    )
+    
+    if changed:
+        unread_delta = -1 if notification_data.read else 1
+        await adjust_unread(db, {current_user.id: unread_delta})
+        publish_after_commit(db, current_user.id, "read", {
+            "notification_id": notification_id,
+            "read": notification_data.read,
+            "unread_delta": unread_delta
+        })
+    
+    notification = await db.scalar(
+        select(Notification).where(
+            Notification.id == notification_id,
+            Notification.user_id == current_user.id
+        )
+    )
     
     if not notification:
         raise HTTPException(
@@ -48,59 +102,129 @@ async def update_notification(
             detail="Notification not found"
         )
     
-    notification.read = notification_data.read
-    db.commit()
-    db.refresh(notification)
+    await db.commit()
+    await db.refresh(notification)
     
     return notification
 
 @router.post("/mark-all-read")
 async def mark_all_notifications_read(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Mark all notifications as read"""
-    db.query(Notification).filter(
-        Notification.user_id == current_user.id,
-        Notification.read == False
-    ).update({"read": True})
+    result = await db.execute(
+        update(Notification).where(
+            Notification.user_id == current_user.id,
+            Notification.read == False
+        ).values(read=True)
+    )
     
-    db.commit()
+    if result.rowcount:
+        await adjust_unread(db, {current_user.id: -result.rowcount})
+        publish_after_commit(db, current_user.id, "read_all", {"unread_delta": -result.rowcount})
+    await db.commit()
     
     return {"message": "All notifications marked as read"}
 
 @router.delete("/{notification_id}")
 async def delete_notification(
     notification_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a notification"""
-    notification = db.query(Notification).filter(
-        Notification.id == notification_id,
-        Notification.user_id == current_user.id
-    ).first()
+    was_read = await db.scalar(
+        delete(Notification).where(
+            Notification.id == notification_id,
+            Notification.user_id == current_user.id
+        ).returning(Notification.read).execution_options(synchronize_session=False)
+    )
     
-    if not notification:
+    if was_read is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Notification not found"
         )
     
-    db.delete(notification)
-    db.commit()
+    unread_delta = 0 if was_read else -1
+    await adjust_unread(db, {current_user.id: unread_delta})
+    publish_after_commit(db, current_user.id, "deleted", {
+        "notification_id": notification_id,
+        "unread_delta": unread_delta
+    })
+    await db.commit()
     
     return {"message": "Notification deleted successfully"}
 
 @router.get("/unread/count")
 async def get_unread_count(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get count of unread notifications"""
-    count = db.query(Notification).filter(
-        Notification.user_id == current_user.id,
-        Notification.read == False
-    ).count()
+    count = await count_unread(db, current_user.id)
+    await db.commit()
     
     return {"unread_count": count}
+
+@router.get("/stream")
+async def stream_notifications(current_user: Principal = Depends(get_stream_user)):
+    """Server-sent events for the current user, replacing polling.
+
+    Starts with the unread count, then sends `notification` (new, with
+    unread_delta 1), `read`, `read_all` and `deleted` events carrying
+    unread_delta, so clients keep the badge current without asking again.
+    A fresh `unread_count` is sent if the client falls behind. Pass the
+    access token as ?token=, since EventSource can't send headers.
+    """
+    stream = hub.subscribe(current_user.id)
+    
+    async def events():
+        try:
+            yield f"event: unread_count\ndata: {json.dumps(await stream.snapshot())}\n\n"
+            
+            while True:
+                try:
+                    event_name, data = await stream.next_event(timeout=NOTIFICATION_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            hub.unsubscribe(stream)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/ws")
+async def notifications_websocket(websocket: WebSocket, token: str = Query(...)):
+    """The same events as /stream over a WebSocket, as {"event": ..., "data": ...} messages"""
+    try:
+        current_user = await get_stream_user(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    stream = hub.subscribe(current_user.id)
+    
+    async def forward():
+        await websocket.send_json({"event": "unread_count", "data": await stream.snapshot()})
+        while True:
+            event_name, data = await stream.next_event()
+            await websocket.send_json({"event": event_name, "data": data})
+    
+    sender = asyncio.create_task(forward())
+    try:
+        # Clients don't send anything; receiving just notices when they go away
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        hub.unsubscribe(stream)
@@ -1,57 +1,185 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Request, Response
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from datetime import datetime
+from collections import defaultdict
+import math
 import uuid
 
 from database import get_db
-from models import Payment, PaymentItem, Customer, Product, User, Notification
+from models import (
+    Payment,
+    PaymentItem,
+    PaymentStatus,
+    PaymentMethod,
+    Customer,
+    Product,
+    MpesaCallbackInbox,
+    MpesaReconciliationRun,
+    MonthlyRevenueRollup
+)
 from schemas import (
     Payment as PaymentSchema, 
     PaymentCreate, 
     PaymentUpdate,
-    MpesaPaymentRequest
+    PaymentStatus as PaymentStatusFilter,
+    PaymentMethod as PaymentMethodFilter,
+    MpesaPaymentRequest,
+    OfflineSyncRequest,
+    OfflineSyncResponse,
+    MpesaReconciliationStatus
+)
+from auth import Principal, get_current_active_user, get_manager_or_admin_user
+from services.mpesa import mpesa_service
+from services.circuit_breaker import CircuitOpenError
+from services.jobs import enqueue, enqueue_once
+from services.tasks import (
+    initiate_stk_push,
+    record_low_stock,
+    apply_mpesa_callbacks,
+    stk_push_retry_after
+)
+from services.customers import record_purchases, revert_purchases
+from services.cache import invalidate_after_commit
+from services.pagination import Keyset, InvalidCursorError, fetch_page
+from services.reconciliation import reconciler
+from services.rollup import record_completed_payment, record_completed_payments, record_reverted_payments
+from services.time_buckets import business_buckets
+from services.offline_sync import sync_offline_sales, MAX_SYNC_SALES
+from services.inventory import deduct_stock, InsufficientStockError
+from services.idempotency import (
+    idempotency_store,
+    request_fingerprint,
+    IdempotencyKeyReused,
+    IdempotencyKeyInProgress,
+    MAX_KEY_LENGTH
 )
-from auth import get_current_active_user, get_manager_or_admin_user
-from services.mpesa import MpesaService
 
 router = APIRouter()
-mpesa_service = MpesaService()
+
+# Newest first, as the offset listing orders them
+payment_keyset = Keyset("payments", Payment.created_at, Payment.id, descending=True)
+
+# Months in the revenue analytics series, this one included
+REVENUE_MONTHS = 12
+
+# Relationships serialized by PaymentSchema, loaded up front so no lazy load hits the database
+payment_load_options = (
+    selectinload(Payment.customer),
+    selectinload(Payment.items).selectinload(PaymentItem.product)
+)
+
+async def load_payment(db: AsyncSession, payment_id: int) -> Payment:
+    """Reload a payment with the relationships its response needs"""
+    return await db.scalar(
+        select(Payment).options(*payment_load_options).where(
+            Payment.id == payment_id
+        ).execution_options(populate_existing=True)
+    )
 
 @router.get("/", response_model=List[PaymentSchema])
 async def get_payments(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    status_filter: Optional[str] = None,
-    method_filter: Optional[str] = None,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    status_filter: Optional[PaymentStatusFilter] = None,
+    method_filter: Optional[PaymentMethodFilter] = None,
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all payments for the business"""
-    query = db.query(Payment).filter(Payment.business_id == current_user.business_id)
+    """Get all payments for the business.
+
+    Pass cursor (empty for the first page) to page by keyset instead of
+    skip; the next page's cursor comes back in the X-Next-Cursor header.
+    """
+    query = select(Payment).options(*payment_load_options).where(
+        Payment.business_id == current_user.business_id
+    )
     
     if status_filter:
-        query = query.filter(Payment.status == status_filter)
+        query = query.where(Payment.status == PaymentStatus(status_filter))
     
     if method_filter:
-        query = query.filter(Payment.method == method_filter)
+        query = query.where(Payment.method == PaymentMethod(method_filter))
+    
+    if cursor is not None:
+        try:
+            payments, next_cursor = await fetch_page(db, query, payment_keyset, cursor, limit)
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return payments
     
-    payments = query.order_by(Payment.created_at.desc()).offset(skip).limit(limit).all()
+    payments = (await db.scalars(
+        query.order_by(Payment.created_at.desc()).offset(skip).limit(limit)
+    )).all()
     return payments
 
 @router.post("/", response_model=PaymentSchema)
 async def create_payment(
     payment_data: PaymentCreate,
-    background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """Create a new payment"""
+    """Create a new payment.
+
+    Send an Idempotency-Key header to make retries safe: a repeated request
+    with the same key and body replays the first response without running again.
+    """
+    if idempotency_key:
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"
+            )
+        
+        try:
+            stored = await idempotency_store.claim(
+                db,
+                current_user.business_id,
+                idempotency_key,
+                request_fingerprint(payment_data.model_dump(mode="json"))
+            )
+        except IdempotencyKeyReused:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used for a different payment"
+            )
+        except IdempotencyKeyInProgress:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A payment with this Idempotency-Key is still being processed"
+            )
+        
+        if stored:
+            return stored.to_response()
+    
+    # Shed M-Pesa checkouts while Daraja is failing or the STK push queue is full
+    if payment_data.method == "mpesa":
+        retry_after = await stk_push_retry_after(db)
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="M-Pesa is temporarily unavailable, please retry shortly or take another payment method",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+    
     # Verify customer exists
-    customer = db.query(Customer).filter(
-        Customer.id == payment_data.customer_id,
-        Customer.business_id == current_user.business_id
-    ).first()
+    customer = await db.scalar(
+        select(Customer).where(
+            Customer.id == payment_data.customer_id,
+            Customer.business_id == current_user.business_id
+        )
+    )
     
     if not customer:
         raise HTTPException(
@@ -59,91 +187,169 @@ async def create_payment(
             detail="Customer not found"
         )
     
-    # Create payment
+    # Validate the whole basket before writing anything
+    if any(item_data.quantity <= 0 for item_data in payment_data.items):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Item quantities must be positive"
+        )
+    
+    # Load every referenced product in one query
+    product_ids = {item_data.product_id for item_data in payment_data.items}
+    products = {
+        product.id: product
+        for product in (await db.scalars(
+            select(Product).where(
+                Product.id.in_(product_ids),
+                Product.business_id == current_user.business_id
+            )
+        )).all()
+    }
+    
+    quantities = {}
+    for item_data in payment_data.items:
+        if item_data.product_id not in products:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Product with id {item_data.product_id} not found"
+            )
+        quantities[item_data.product_id] = quantities.get(item_data.product_id, 0) + item_data.quantity
+    
+    # Create payment; everything below commits in one transaction
     payment = Payment(
         customer_id=payment_data.customer_id,
         business_id=current_user.business_id,
         amount=payment_data.amount,
-        method=payment_data.method,
+        method=PaymentMethod(payment_data.method),
         transaction_id=str(uuid.uuid4())
     )
     
     db.add(payment)
-    db.commit()
-    db.refresh(payment)
+    await db.flush()
+    invalidate_after_commit(db, current_user.business_id)
     
-    # Create payment items
-    for item_data in payment_data.items:
-        # Verify product exists
-        product = db.query(Product).filter(
-            Product.id == item_data.product_id,
-            Product.business_id == current_user.business_id
-        ).first()
-        
-        if not product:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Product with id {item_data.product_id} not found"
-            )
-        
-        # Check stock availability
-        if product.stock < item_data.quantity:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Insufficient stock for {product.name}"
-            )
-        
-        # Create payment item
-        payment_item = PaymentItem(
-            payment_id=payment.id,
-            product_id=item_data.product_id,
-            quantity=item_data.quantity,
-            unit_price=item_data.unit_price,
-            total_price=item_data.unit_price * item_data.quantity
+    # Create payment items in one bulk insert
+    if payment_data.items:
+        await db.execute(
+            insert(PaymentItem),
+            [
+                {
+                    "payment_id": payment.id,
+                    "product_id": item_data.product_id,
+                    "quantity": item_data.quantity,
+                    "unit_price": item_data.unit_price,
+                    "total_price": item_data.unit_price * item_data.quantity
+                } for item_data in payment_data.items
+            ]
         )
-        
-        db.add(payment_item)
-        
-        # Update product stock
-        product.stock -= item_data.quantity
-        
-        # Check for low stock
-        if product.stock <= product.low_stock_threshold:
-            background_tasks.add_task(
-                create_low_stock_notification, 
-                product, current_user, db
-            )
     
-    # If M-Pesa payment, initiate STK push
-    if payment_data.method == "mpesa":
-        background_tasks.add_task(
-            initiate_mpesa_payment,
-            payment, customer, db
+    # Take stock for the whole basket in one conditional update
+    try:
+        new_stock = await deduct_stock(db, current_user.business_id, quantities, products)
+    except InsufficientStockError as e:
+        names = ", ".join(products[product_id].name for product_id in e.product_ids)
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock for {names}"
         )
+    
+    # Alert staff about products this sale took below their threshold
+    await record_low_stock(db, current_user.business_id, [
+        product_id for product_id, stock in new_stock.items()
+        if stock <= products[product_id].low_stock_threshold
+    ])
+    
+    # If M-Pesa payment, initiate STK push once the payment is committed
+    if payment_data.method == "mpesa":
+        enqueue(db, initiate_stk_push, {"payment_id": payment.id})
     else:
         # Cash payment - mark as completed
-        payment.status = "completed"
+        payment.status = PaymentStatus.COMPLETED
         
-        # Update customer totals
-        customer.total_purchases += payment.amount
-        customer.last_purchase = datetime.utcnow()
+        # Update customer totals in place, so concurrent sales to the same customer add up
+        await record_purchases(db, {customer.id: payment.amount}, {customer.id: datetime.utcnow()})
+        
+        # Add the sale to the analytics rollups
+        await db.flush()
+        await record_completed_payment(db, payment, at=datetime.utcnow())
     
-    db.commit()
-    db.refresh(payment)
+    response = PaymentSchema.model_validate(await load_payment(db, payment.id))
     
-    return payment
+    # Store the response with the payment, so a retry can only replay committed work
+    stored = None
+    if idempotency_key:
+        stored = await idempotency_store.complete(
+            db, current_user.business_id, idempotency_key, status.HTTP_200_OK, response.model_dump_json()
+        )
+    
+    await db.commit()
+    
+    if stored:
+        idempotency_store.remember(stored)
+    
+    return response
+
+@router.post("/sync", response_model=OfflineSyncResponse)
+async def sync_offline_payments(
+    sync_data: OfflineSyncRequest,
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Record the sales a till queued while offline, in one request.
+
+    Every sale is reported as created, duplicate (already synced) or
+    rejected; re-sending the same batch after a dropped response is safe.
+    """
+    if len(sync_data.sales) > MAX_SYNC_SALES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Send at most {MAX_SYNC_SALES} sales per sync"
+        )
+    
+    try:
+        results, new_stock, products, stored = await sync_offline_sales(
+            db, current_user.business_id, sync_data.sales
+        )
+        invalidate_after_commit(db, current_user.business_id)
+        
+        # Alert staff about products these sales took below their threshold
+        await record_low_stock(db, current_user.business_id, [
+            product_id for product_id, stock in new_stock.items()
+            if stock <= products[product_id].low_stock_threshold
+        ])
+        
+        await db.commit()
+    except (IntegrityError, InsufficientStockError):
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Stock or these sales changed while syncing, retry shortly"
+        )
+    
+    for entry in stored:
+        idempotency_store.remember(entry)
+    
+    return OfflineSyncResponse(
+        created=sum(1 for result in results if result.status == "created"),
+        duplicates=sum(1 for result in results if result.status == "duplicate"),
+        rejected=sum(1 for result in results if result.status == "rejected"),
+        results=results
+    )
 
 @router.get("/{payment_id}", response_model=PaymentSchema)
 async def get_payment(
     payment_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get a specific payment"""
-    payment = db.query(Payment).filter(
-        Payment.id == payment_id,
-        Payment.business_id == current_user.business_id
-    ).first()
+    payment = await db.scalar(
+        select(Payment).options(*payment_load_options).where(
+            Payment.id == payment_id,
+            Payment.business_id == current_user.business_id
+        )
+    )
     
     if not payment:
         raise HTTPException(
@@ -153,18 +359,59 @@ async def get_payment(
     
     return payment
 
+async def change_payment_status(db: AsyncSession, payment_id: int, new_status: PaymentStatus):
+    """Move a payment to new_status, keeping customer totals and rollups in step.
+
+    The status only changes through a conditional UPDATE ... RETURNING, like
+    settle_payments, so of concurrent requests (or a request racing an
+    M-Pesa callback) only the one that actually moves the payment into or
+    out of completed counts it.
+    """
+    returned = (Payment.id, Payment.business_id, Payment.customer_id, Payment.amount, Payment.method, Payment.created_at)
+    if new_status == PaymentStatus.COMPLETED:
+        completed = (await db.execute(
+            update(Payment).where(
+                Payment.id == payment_id,
+                Payment.status != PaymentStatus.COMPLETED
+            ).values(status=new_status).returning(*returned).execution_options(synchronize_session=False)
+        )).all()
+        await record_purchases(
+            db,
+            {payment.customer_id: payment.amount for payment in completed},
+            {payment.customer_id: datetime.utcnow() for payment in completed}
+        )
+        await record_completed_payments(db, completed)
+        return
+
+    reverted = (await db.execute(
+        update(Payment).where(
+            Payment.id == payment_id,
+            Payment.status == PaymentStatus.COMPLETED
+        ).values(status=new_status).returning(*returned).execution_options(synchronize_session=False)
+    )).all()
+    if reverted:
+        await revert_purchases(db, {payment.customer_id: payment.amount for payment in reverted})
+        await record_reverted_payments(db, reverted)
+        return
+
+    await db.execute(
+        update(Payment).where(Payment.id == payment_id).values(status=new_status).execution_options(synchronize_session=False)
+    )
+
 @router.put("/{payment_id}", response_model=PaymentSchema)
 async def update_payment(
     payment_id: int,
     payment_data: PaymentUpdate,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update a payment"""
-    payment = db.query(Payment).filter(
-        Payment.id == payment_id,
-        Payment.business_id == current_user.business_id
-    ).first()
+    payment = await db.scalar(
+        select(Payment).where(
+            Payment.id == payment_id,
+            Payment.business_id == current_user.business_id
+        )
+    )
     
     if not payment:
         raise HTTPException(
@@ -173,25 +420,23 @@ async def update_payment(
         )
     
     # Update payment fields
-    for field, value in payment_data.dict(exclude_unset=True).items():
+    changes = payment_data.dict(exclude_unset=True)
+    new_status = changes.pop("status", None)
+    for field, value in changes.items():
         setattr(payment, field, value)
     
-    # If payment is now completed, update customer totals
-    if payment.status == "completed" and payment_data.status == "completed":
-        customer = db.query(Customer).filter(Customer.id == payment.customer_id).first()
-        if customer:
-            customer.total_purchases += payment.amount
-            customer.last_purchase = datetime.utcnow()
+    if new_status:
+        await change_payment_status(db, payment.id, PaymentStatus(new_status))
     
-    db.commit()
-    db.refresh(payment)
+    invalidate_after_commit(db, current_user.business_id)
+    await db.commit()
     
-    return payment
+    return await load_payment(db, payment.id)
 
 @router.post("/mpesa/initiate")
 async def initiate_mpesa_payment_endpoint(
     mpesa_data: MpesaPaymentRequest,
-    current_user: User = Depends(get_manager_or_admin_user)
+    current_user: Principal = Depends(get_manager_or_admin_user)
 ):
     """Initiate M-Pesa STK Push payment"""
     try:
@@ -202,6 +447,12 @@ async def initiate_mpesa_payment_endpoint(
             transaction_desc=mpesa_data.transaction_desc
         )
         return response
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="M-Pesa is temporarily unavailable, please retry shortly",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -210,114 +461,72 @@ async def initiate_mpesa_payment_endpoint(
 
 @router.post("/mpesa/callback")
 async def mpesa_callback(
-    callback_data: dict,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_db)
 ):
-    """Handle M-Pesa callback"""
-    try:
-        # Process M-Pesa callback
-        result_code = callback_data.get("Body", {}).get("stkCallback", {}).get("ResultCode")
-        checkout_request_id = callback_data.get("Body", {}).get("stkCallback", {}).get("CheckoutRequestID")
-        
-        # Find payment by checkout request ID (you'd store this when initiating)
-        # For now, we'll update based on transaction ID
-        
-        if result_code == 0:  # Success
-            # Extract payment details from callback
-            callback_metadata = callback_data.get("Body", {}).get("stkCallback", {}).get("CallbackMetadata", {}).get("Item", [])
-            
-            amount = None
-            mpesa_receipt = None
-            phone_number = None
-            
-            for item in callback_metadata:
-                if item.get("Name") == "Amount":
-                    amount = item.get("Value")
-                elif item.get("Name") == "MpesaReceiptNumber":
-                    mpesa_receipt = item.get("Value")
-                elif item.get("Name") == "PhoneNumber":
-                    phone_number = item.get("Value")
-            
-            # Update payment status (you'd need to match by checkout_request_id)
-            # This is a simplified version
-            return {"status": "success", "message": "Payment processed successfully"}
-        else:
-            # Payment failed
-            return {"status": "failed", "message": "Payment failed"}
-            
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Callback processing failed: {str(e)}"
-        )
+    """Handle M-Pesa callback.
+
+    The raw body goes into the callback inbox and Safaricom gets its
+    acknowledgement straight away; apply_mpesa_callbacks matches and
+    applies the inbox in batches.
+    """
+    db.add(MpesaCallbackInbox(payload=(await request.body()).decode("utf-8", errors="replace")))
+    
+    # Callbacks arriving while an apply job waits to run share it
+    await enqueue_once(db, apply_mpesa_callbacks, "mpesa.apply_callbacks:inbox", while_pending=True)
+    await db.commit()
+    
+    return {"ResultCode": 0, "ResultDesc": "Accepted"}
+
+@router.get("/mpesa/reconciliation", response_model=MpesaReconciliationStatus)
+async def get_mpesa_reconciliation_status(
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """M-Pesa payments still waiting for reconciliation, and how the latest sweeps went"""
+    backlog, oldest_pending_at = await reconciler.backlog(db, current_user.business_id)
+    recent_sweeps = (await db.scalars(
+        select(MpesaReconciliationRun).order_by(MpesaReconciliationRun.started_at.desc()).limit(10)
+    )).all()
+    
+    return MpesaReconciliationStatus(
+        backlog=backlog,
+        oldest_pending_at=oldest_pending_at,
+        recent_sweeps=recent_sweeps
+    )
 
 @router.get("/analytics/revenue")
 async def get_revenue_analytics(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get revenue analytics"""
-    from sqlalchemy import func, extract
-    
-    # Total revenue
-    total_revenue = db.query(func.sum(Payment.amount)).filter(
-        Payment.business_id == current_user.business_id,
-        Payment.status == "completed"
-    ).scalar() or 0
-    
-    # Monthly revenue
-    monthly_revenue = db.query(
-        extract('month', Payment.created_at).label('month'),
-        func.sum(Payment.amount).label('revenue')
-    ).filter(
-        Payment.business_id == current_user.business_id,
-        Payment.status == "completed"
-    ).group_by(extract('month', Payment.created_at)).all()
-    
-    # Payment method breakdown
-    method_breakdown = db.query(
-        Payment.method,
-        func.count(Payment.id).label('count'),
-        func.sum(Payment.amount).label('total')
-    ).filter(
-        Payment.business_id == current_user.business_id,
-        Payment.status == "completed"
-    ).group_by(Payment.method).all()
+    """Get revenue analytics from the monthly rollups, so the cost grows with months, not payments"""
+    rows = (await db.execute(
+        select(
+            MonthlyRevenueRollup.month,
+            MonthlyRevenueRollup.method,
+            MonthlyRevenueRollup.orders,
+            MonthlyRevenueRollup.revenue
+        ).where(MonthlyRevenueRollup.business_id == current_user.business_id)
+    )).all()
+    
+    by_month = defaultdict(float)
+    by_method = defaultdict(lambda: {"count": 0, "total": 0.0})
+    for row in rows:
+        by_month[row.month] += row.revenue
+        by_method[row.method]["count"] += row.orders
+        by_method[row.method]["total"] += row.revenue
+    
+    # The last REVENUE_MONTHS months of the business's calendar, empty months included
+    months = (await business_buckets(db, current_user.business_id)).months(REVENUE_MONTHS)
     
     return {
-        "total_revenue": total_revenue,
-        "monthly_revenue": [{"month": r.month, "revenue": r.revenue} for r in monthly_revenue],
-        "payment_methods": [{"method": r.method, "count": r.count, "total": r.total} for r in method_breakdown]
+        "total_revenue": sum(by_month.values()),
+        "monthly_revenue": [
+            {"month": f"{first:%Y-%m}", "revenue": by_month.get(first, 0)} for first, _, _ in months
+        ],
+        "payment_methods": [
+            {"method": method, "count": totals["count"], "total": totals["total"]}
+            for method, totals in sorted(by_method.items(), key=lambda item: item[1]["total"], reverse=True)
+        ]
     }
-
-async def initiate_mpesa_payment(payment: Payment, customer: Customer, db: Session):
-    """Background task to initiate M-Pesa payment"""
-    try:
-        response = await mpesa_service.stk_push(
-            phone_number=customer.phone,
-            amount=payment.amount,
-            account_reference=f"PAY-{payment.id}",
-            transaction_desc=f"Payment for order #{payment.id}"
-        )
-        
-        # Update payment with M-Pesa details
-        payment.transaction_id = response.get("CheckoutRequestID")
-        db.commit()
-        
-    except Exception as e:
-        # Mark payment as failed
-        payment.status = "failed"
-        db.commit()
-
-async def create_low_stock_notification(product: Product, user: User, db: Session):
-    """Create low stock notification"""
-    notification = Notification(
-        user_id=user.id,
-        type="low_stock",
-        title="Low Stock Alert",
-        message=f"{product.name} is running low ({product.stock} units remaining)",
-        priority="high" if product.stock == 0 else "medium"
-    )
-    
-    db.add(notification)
-    db.commit()
@@ -1,40 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
 from database import get_db
-from models import Product, User, Notification
+from models import Product
 from schemas import Product as ProductSchema, ProductCreate, ProductUpdate
-from auth import get_current_active_user, get_manager_or_admin_user
+from auth import Principal, get_current_active_user, get_manager_or_admin_user
+from services.low_stock import mark_restocked
+from services.pagination import Keyset, InvalidCursorError, fetch_page
+from services.tasks import record_low_stock
+from services.cache import invalidate_after_commit
 
 router = APIRouter()
 
+product_keyset = Keyset("products", Product.name, Product.id)
+
 @router.get("/", response_model=List[ProductSchema])
 async def get_products(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     category: Optional[str] = None,
     search: Optional[str] = None,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all products for the business"""
-    query = db.query(Product).filter(Product.business_id == current_user.business_id)
+    """Get all products for the business.
+
+    Pass cursor (empty for the first page) to page by keyset instead of
+    skip; the next page's cursor comes back in the X-Next-Cursor header.
+    """
+    query = select(Product).where(Product.business_id == current_user.business_id)
     
     if category:
-        query = query.filter(Product.category == category)
+        query = query.where(Product.category == category)
     
     if search:
-        query = query.filter(Product.name.ilike(f"%{search}%"))
-    
-    products = query.offset(skip).limit(limit).all()
+        query = query.where(Product.name.ilike(f"%{search}%"))
+    
+    if cursor is not None:
+        try:
+            products, next_cursor = await fetch_page(db, query, product_keyset, cursor, limit)
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return products
+    
+    products = (await db.scalars(query.offset(skip).limit(limit))).all()
     return products
 
 @router.post("/", response_model=ProductSchema)
 async def create_product(
     product_data: ProductCreate,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new product"""
     product = Product(
@@ -43,21 +68,24 @@ async def create_product(
     )
     
     db.add(product)
-    db.commit()
-    db.refresh(product)
+    invalidate_after_commit(db, current_user.business_id)
+    await db.commit()
+    await db.refresh(product)
     return product
 
 @router.get("/{product_id}", response_model=ProductSchema)
 async def get_product(
     product_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get a specific product"""
-    product = db.query(Product).filter(
-        Product.id == product_id,
-        Product.business_id == current_user.business_id
-    ).first()
+    product = await db.scalar(
+        select(Product).where(
+            Product.id == product_id,
+            Product.business_id == current_user.business_id
+        )
+    )
     
     if not product:
         raise HTTPException(
@@ -71,14 +99,16 @@ async def get_product(
 async def update_product(
     product_id: int,
     product_data: ProductUpdate,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update a product"""
-    product = db.query(Product).filter(
-        Product.id == product_id,
-        Product.business_id == current_user.business_id
-    ).first()
+    product = await db.scalar(
+        select(Product).where(
+            Product.id == product_id,
+            Product.business_id == current_user.business_id
+        )
+    )
     
     if not product:
         raise HTTPException(
@@ -90,26 +120,31 @@ async def update_product(
     for field, value in product_data.dict(exclude_unset=True).items():
         setattr(product, field, value)
     
-    db.commit()
-    db.refresh(product)
-    
-    # Check for low stock and create notification
+    # Alert staff if the product just went low; a restock re-arms the alert
     if product.stock <= product.low_stock_threshold:
-        await create_low_stock_notification(product, current_user, db)
+        await record_low_stock(db, current_user.business_id, [product.id])
+    else:
+        await mark_restocked(db, [product.id])
+    
+    invalidate_after_commit(db, current_user.business_id)
+    await db.commit()
+    await db.refresh(product)
     
     return product
 
 @router.delete("/{product_id}")
 async def delete_product(
     product_id: int,
-    current_user: User = Depends(get_manager_or_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_manager_or_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a product"""
-    product = db.query(Product).filter(
-        Product.id == product_id,
-        Product.business_id == current_user.business_id
-    ).first()
+    product = await db.scalar(
+        select(Product).where(
+            Product.id == product_id,
+            Product.business_id == current_user.business_id
+        )
+    )
     
     if not product:
         raise HTTPException(
@@ -117,33 +152,23 @@ async def delete_product(
             detail="Product not found"
         )
     
-    db.delete(product)
-    db.commit()
+    await db.delete(product)
+    invalidate_after_commit(db, current_user.business_id)
+    await db.commit()
     
     return {"message": "Product deleted successfully"}
 
 @router.get("/low-stock/alerts")
 async def get_low_stock_products(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get products with low stock"""
-    products = db.query(Product).filter(
-        Product.business_id == current_user.business_id,
-        Product.stock <= Product.low_stock_threshold
-    ).all()
+    products = (await db.scalars(
+        select(Product).where(
+            Product.business_id == current_user.business_id,
+            Product.stock <= Product.low_stock_threshold
+        )
+    )).all()
     
     return products
-
-async def create_low_stock_notification(product: Product, user: User, db: Session):
-    """Create a low stock notification"""
-    notification = Notification(
-        user_id=user.id,
-        type="low_stock",
-        title="Low Stock Alert",
-        message=f"{product.name} is running low ({product.stock} units remaining)",
-        priority="high" if product.stock == 0 else "medium"
-    )
-    
-    db.add(notification)
-    db.commit()
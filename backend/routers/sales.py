@@ -1,163 +1,69 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func, extract, desc
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func, desc, case
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from database import get_db
-from models import Payment, PaymentItem, Product, Customer, User
+from models import Payment, PaymentStatus
 from schemas import SalesAnalytics
-from auth import get_current_active_user
+from auth import Principal, get_current_active_user
+from services.analytics import SalesAnalyticsEngine
+from services.cache import response_cache
+from services.time_buckets import business_buckets
+from services.exports import (
+    ExportFormatError,
+    export_encoder,
+    sales_export_query,
+    stream_rows,
+    summarize_sales
+)
 
 router = APIRouter()
 
 @router.get("/analytics", response_model=SalesAnalytics)
 async def get_sales_analytics(
     days: int = 30,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get comprehensive sales analytics"""
     business_id = current_user.business_id
-    start_date = datetime.utcnow() - timedelta(days=days)
-    
-    # Total revenue
-    total_revenue = db.query(func.sum(Payment.amount)).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        Payment.created_at >= start_date
-    ).scalar() or 0
-    
-    # Total orders
-    total_orders = db.query(Payment).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        Payment.created_at >= start_date
-    ).count()
-    
-    # Average order value
-    average_order_value = total_revenue / total_orders if total_orders > 0 else 0
-    
-    # Active customers (customers who made purchases in the period)
-    active_customers = db.query(func.count(func.distinct(Payment.customer_id))).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        Payment.created_at >= start_date
-    ).scalar() or 0
-    
-    # Growth rate (compare with previous period)
-    previous_start = start_date - timedelta(days=days)
-    previous_revenue = db.query(func.sum(Payment.amount)).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        Payment.created_at >= previous_start,
-        Payment.created_at < start_date
-    ).scalar() or 0
-    
-    growth_rate = ((total_revenue - previous_revenue) / previous_revenue * 100) if previous_revenue > 0 else 0
-    
-    # Daily sales
-    daily_sales = db.query(
-        func.date(Payment.created_at).label('date'),
-        func.sum(Payment.amount).label('sales'),
-        func.count(Payment.id).label('orders')
-    ).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        Payment.created_at >= start_date
-    ).group_by(func.date(Payment.created_at)).order_by('date').all()
-    
-    # Top products
-    top_products = db.query(
-        Product.name,
-        Product.category,
-        func.sum(PaymentItem.quantity).label('quantity_sold'),
-        func.sum(PaymentItem.total_price).label('revenue')
-    ).join(PaymentItem).join(Payment).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        Payment.created_at >= start_date
-    ).group_by(Product.id, Product.name, Product.category).order_by(
-        desc('revenue')
-    ).limit(10).all()
-    
-    # Sales by category
-    sales_by_category = db.query(
-        Product.category,
-        func.sum(PaymentItem.total_price).label('revenue'),
-        func.sum(PaymentItem.quantity).label('quantity')
-    ).join(PaymentItem).join(Payment).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        Payment.created_at >= start_date
-    ).group_by(Product.category).order_by(desc('revenue')).all()
-    
-    return SalesAnalytics(
-        total_revenue=total_revenue,
-        total_orders=total_orders,
-        average_order_value=average_order_value,
-        active_customers=active_customers,
-        growth_rate=growth_rate,
-        daily_sales=[
-            {
-                "date": sale.date.isoformat(),
-                "sales": sale.sales,
-                "orders": sale.orders
-            } for sale in daily_sales
-        ],
-        top_products=[
-            {
-                "name": product.name,
-                "category": product.category,
-                "quantity_sold": product.quantity_sold,
-                "revenue": product.revenue
-            } for product in top_products
-        ],
-        sales_by_category=[
-            {
-                "category": category.category,
-                "revenue": category.revenue,
-                "quantity": category.quantity
-            } for category in sales_by_category
-        ]
+    return await response_cache.get_or_compute(
+        db,
+        "sales.analytics",
+        business_id,
+        lambda session: SalesAnalyticsEngine(session, business_id).compute(days),
+        days=days
     )
 
-@router.get("/dashboard")
-async def get_sales_dashboard(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """Get sales dashboard data"""
-    business_id = current_user.business_id
-    today = datetime.utcnow().date()
-    
-    # Today's sales
-    today_sales = db.query(func.sum(Payment.amount)).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        func.date(Payment.created_at) == today
-    ).scalar() or 0
-    
-    # This week's sales
-    week_start = today - timedelta(days=today.weekday())
-    week_sales = db.query(func.sum(Payment.amount)).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        func.date(Payment.created_at) >= week_start
-    ).scalar() or 0
-    
-    # This month's sales
-    month_start = today.replace(day=1)
-    month_sales = db.query(func.sum(Payment.amount)).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed",
-        func.date(Payment.created_at) >= month_start
-    ).scalar() or 0
+async def _sales_dashboard(db: AsyncSession, business_id: int) -> dict:
+    """Sales today, this week and this month, and the latest transactions"""
+    buckets = await business_buckets(db, business_id)
+    today_start, today_end = buckets.day()
+    week_start, _ = buckets.week()
+    month_start, _ = buckets.month()
+    
+    def sales_since(start):
+        return func.coalesce(func.sum(case((Payment.created_at >= start, Payment.amount), else_=0)), 0)
+    
+    # Today's, this week's and this month's sales in one range scan
+    today_sales, week_sales, month_sales = (await db.execute(
+        select(sales_since(today_start), sales_since(week_start), sales_since(month_start)).where(
+            Payment.business_id == business_id,
+            Payment.status == PaymentStatus.COMPLETED,
+            Payment.created_at >= min(week_start, month_start),
+            Payment.created_at < today_end
+        )
+    )).one()
     
     # Recent transactions
-    recent_transactions = db.query(Payment).filter(
-        Payment.business_id == business_id
-    ).order_by(desc(Payment.created_at)).limit(5).all()
+    recent_transactions = (await db.scalars(
+        select(Payment).where(
+            Payment.business_id == business_id
+        ).order_by(desc(Payment.created_at)).limit(5)
+    )).all()
     
     return {
         "today_sales": today_sales,
@@ -166,40 +72,61 @@ async def get_sales_dashboard(
         "recent_transactions": recent_transactions
     }
 
+@router.get("/dashboard")
+async def get_sales_dashboard(
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get sales dashboard data"""
+    business_id = current_user.business_id
+    return await response_cache.get_or_compute(
+        db,
+        "sales.dashboard",
+        business_id,
+        lambda session: _sales_dashboard(session, business_id)
+    )
+
 @router.get("/reports/export")
 async def export_sales_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     format: str = "csv",
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Export sales report"""
-    # This would generate and return a CSV/PDF report
-    # For now, return the data that would be in the report
+    """Export completed sales as CSV, NDJSON or Parquet, one row per line item.
+
+    Rows stream from a database cursor as they are encoded, so memory use
+    doesn't grow with the export. Totals come back in the X-Total-Records,
+    X-Total-Revenue and X-Average-Transaction headers.
+    """
+    try:
+        media_type, extension, encoder = export_encoder(format)
+    except ExportFormatError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    try:
+        start = datetime.fromisoformat(start_date) if start_date else None
+        end = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_date and end_date must be ISO dates"
+        )
     
     business_id = current_user.business_id
-    
-    query = db.query(Payment).filter(
-        Payment.business_id == business_id,
-        Payment.status == "completed"
-    )
-    
-    if start_date:
-        query = query.filter(Payment.created_at >= datetime.fromisoformat(start_date))
-    
-    if end_date:
-        query = query.filter(Payment.created_at <= datetime.fromisoformat(end_date))
-    
-    payments = query.order_by(desc(Payment.created_at)).all()
-    
-    return {
-        "format": format,
-        "total_records": len(payments),
-        "data": payments,
-        "summary": {
-            "total_revenue": sum([p.amount for p in payments]),
-            "total_transactions": len(payments),
-            "average_transaction": sum([p.amount for p in payments]) / len(payments) if payments else 0
+    summary = await summarize_sales(db, business_id, start, end)
+    
+    return StreamingResponse(
+        encoder(stream_rows(sales_export_query(business_id, start, end))),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="sales-report-{datetime.utcnow():%Y%m%d}.{extension}"',
+            "X-Total-Records": str(summary["total_records"]),
+            "X-Total-Revenue": f"{summary['total_revenue']:.2f}",
+            "X-Average-Transaction": f"{summary['average_transaction']:.2f}"
         }
-    }
+    )
@@ -1,49 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from datetime import datetime, timedelta
 import uuid
 
 from database import get_db
-from models import User, TeamInvitation, Notification
+from models import (
+    User,
+    TeamInvitation,
+    NotificationType,
+    NotificationPriority,
+    UserRole,
+    UserStatus
+)
 from schemas import (
     User as UserSchema, 
     UserUpdate, 
     TeamInvitationCreate, 
     TeamInvitation as TeamInvitationSchema
 )
-from auth import get_current_active_user, get_admin_user, get_password_hash
-from services.email import EmailService
+from auth import Principal, get_current_active_user, get_admin_user, hash_password, invalidate_principal
+from services.jobs import enqueue
+from services.tasks import send_team_invitation_email
+from services.notifications import create_notifications
 
 router = APIRouter()
-email_service = EmailService()
 
 @router.get("/members", response_model=List[UserSchema])
 async def get_team_members(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get all team members for the business"""
-    members = db.query(User).filter(
-        User.business_id == current_user.business_id
-    ).all()
+    members = (await db.scalars(
+        select(User).where(User.business_id == current_user.business_id)
+    )).all()
     
     return members
 
 @router.post("/invite", response_model=TeamInvitationSchema)
 async def invite_team_member(
     invitation_data: TeamInvitationCreate,
-    background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Invite a new team member (admin only)"""
     
     # Check if user with email already exists
-    existing_user = db.query(User).filter(
-        User.email == invitation_data.email,
-        User.business_id == current_user.business_id
-    ).first()
+    existing_user = await db.scalar(
+        select(User).where(
+            User.email == invitation_data.email,
+            User.business_id == current_user.business_id
+        )
+    )
     
     if existing_user:
         raise HTTPException(
@@ -52,11 +62,13 @@ async def invite_team_member(
         )
     
     # Check if invitation already exists
-    existing_invitation = db.query(TeamInvitation).filter(
-        TeamInvitation.email == invitation_data.email,
-        TeamInvitation.business_id == current_user.business_id,
-        TeamInvitation.status == "pending"
-    ).first()
+    existing_invitation = await db.scalar(
+        select(TeamInvitation).where(
+            TeamInvitation.email == invitation_data.email,
+            TeamInvitation.business_id == current_user.business_id,
+            TeamInvitation.status == UserStatus.PENDING
+        )
+    )
     
     if existing_invitation:
         raise HTTPException(
@@ -69,7 +81,7 @@ async def invite_team_member(
         business_id=current_user.business_id,
         email=invitation_data.email,
         name=invitation_data.name,
-        role=invitation_data.role,
+        role=UserRole(invitation_data.role),
         message=invitation_data.message,
         invitation_token=str(uuid.uuid4()),
         invited_by=current_user.id,
@@ -77,38 +89,36 @@ async def invite_team_member(
     )
     
     db.add(invitation)
-    db.commit()
-    db.refresh(invitation)
+    await db.flush()
     
-    # Send invitation email
-    background_tasks.add_task(
-        send_invitation_email,
-        invitation, current_user
-    )
+    # Send invitation email once the invitation is committed
+    enqueue(db, send_team_invitation_email, {"invitation_id": invitation.id, "invited_by_name": current_user.name})
     
     # Create notification for admin
-    notification = Notification(
-        user_id=current_user.id,
-        type="role_invite",
-        title="Team Invitation Sent",
-        message=f"Invitation sent to {invitation_data.name} ({invitation_data.email})",
-        priority="medium"
-    )
+    await create_notifications(db, [{
+        "user_id": current_user.id,
+        "type": NotificationType.ROLE_INVITE,
+        "title": "Team Invitation Sent",
+        "message": f"Invitation sent to {invitation_data.name} ({invitation_data.email})",
+        "priority": NotificationPriority.MEDIUM
+    }])
     
-    db.add(notification)
-    db.commit()
+    await db.commit()
+    await db.refresh(invitation)
     
     return invitation
 
 @router.get("/invitations", response_model=List[TeamInvitationSchema])
 async def get_team_invitations(
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get all team invitations (admin only)"""
-    invitations = db.query(TeamInvitation).filter(
-        TeamInvitation.business_id == current_user.business_id
-    ).order_by(TeamInvitation.created_at.desc()).all()
+    invitations = (await db.scalars(
+        select(TeamInvitation).where(
+            TeamInvitation.business_id == current_user.business_id
+        ).order_by(TeamInvitation.created_at.desc())
+    )).all()
     
     return invitations
 
@@ -116,14 +126,16 @@ async def get_team_invitations(
 async def accept_invitation(
     token: str,
     password: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Accept a team invitation"""
-    invitation = db.query(TeamInvitation).filter(
-        TeamInvitation.invitation_token == token,
-        TeamInvitation.status == "pending",
-        TeamInvitation.expires_at > datetime.utcnow()
-    ).first()
+    invitation = await db.scalar(
+        select(TeamInvitation).where(
+            TeamInvitation.invitation_token == token,
+            TeamInvitation.status == UserStatus.PENDING,
+            TeamInvitation.expires_at > datetime.utcnow()
+        )
+    )
     
     if not invitation:
         raise HTTPException(
@@ -132,38 +144,40 @@ async def accept_invitation(
         )
     
     # Create user account
-    hashed_password = get_password_hash(password)
+    hashed_password = await hash_password(password)
     user = User(
         name=invitation.name,
         email=invitation.email,
         hashed_password=hashed_password,
         role=invitation.role,
         business_id=invitation.business_id,
-        status="active"
+        status=UserStatus.ACTIVE
     )
     
     db.add(user)
     
     # Update invitation status
-    invitation.status = "active"
+    invitation.status = UserStatus.ACTIVE
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
-    return {"message": "Invitation accepted successfully", "user": user}
+    return {"message": "Invitation accepted successfully", "user": UserSchema.model_validate(user)}
 
 @router.put("/members/{user_id}", response_model=UserSchema)
 async def update_team_member(
     user_id: int,
     user_data: UserUpdate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update a team member (admin only)"""
-    user = db.query(User).filter(
-        User.id == user_id,
-        User.business_id == current_user.business_id
-    ).first()
+    user = await db.scalar(
+        select(User).where(
+            User.id == user_id,
+            User.business_id == current_user.business_id
+        )
+    )
     
     if not user:
         raise HTTPException(
@@ -180,24 +194,33 @@ async def update_team_member(
     
     # Update user fields
     for field, value in user_data.dict(exclude_unset=True).items():
+        if field == "role" and value:
+            value = UserRole(value)
+        elif field == "status" and value:
+            value = UserStatus(value)
         setattr(user, field, value)
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    
+    # Tokens issued before the change no longer carry the right role/status
+    invalidate_principal(user.id)
     
     return user
 
 @router.delete("/members/{user_id}")
 async def remove_team_member(
     user_id: int,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Remove a team member (admin only)"""
-    user = db.query(User).filter(
-        User.id == user_id,
-        User.business_id == current_user.business_id
-    ).first()
+    user = await db.scalar(
+        select(User).where(
+            User.id == user_id,
+            User.business_id == current_user.business_id
+        )
+    )
     
     if not user:
         raise HTTPException(
@@ -212,23 +235,26 @@ async def remove_team_member(
             detail="Cannot remove yourself from the team"
         )
     
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
+    
+    invalidate_principal(user_id)
     
     return {"message": "Team member removed successfully"}
 
 @router.post("/invitations/{invitation_id}/resend")
 async def resend_invitation(
     invitation_id: int,
-    background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Resend a team invitation (admin only)"""
-    invitation = db.query(TeamInvitation).filter(
-        TeamInvitation.id == invitation_id,
-        TeamInvitation.business_id == current_user.business_id
-    ).first()
+    invitation = await db.scalar(
+        select(TeamInvitation).where(
+            TeamInvitation.id == invitation_id,
+            TeamInvitation.business_id == current_user.business_id
+        )
+    )
     
     if not invitation:
         raise HTTPException(
@@ -239,30 +265,11 @@ async def resend_invitation(
     # Update invitation token and expiry
     invitation.invitation_token = str(uuid.uuid4())
     invitation.expires_at = datetime.utcnow() + timedelta(days=7)
-    invitation.status = "pending"
-    
-    db.commit()
+    invitation.status = UserStatus.PENDING
     
     # Resend invitation email
-    background_tasks.add_task(
-        send_invitation_email,
-        invitation, current_user
-    )
+    enqueue(db, send_team_invitation_email, {"invitation_id": invitation.id, "invited_by_name": current_user.name})
+    
+    await db.commit()
     
     return {"message": "Invitation resent successfully"}
-
-async def send_invitation_email(invitation: TeamInvitation, invited_by: User):
-    """Send invitation email"""
-    try:
-        await email_service.send_team_invitation(
-            to_email=invitation.email,
-            to_name=invitation.name,
-            business_name=invited_by.business.name,
-            invited_by_name=invited_by.name,
-            role=invitation.role.value,
-            invitation_token=invitation.invitation_token,
-            custom_message=invitation.message
-        )
-    except Exception as e:
-        # Log error but don't fail the invitation creation
-        print(f"Failed to send invitation email: {str(e)}")
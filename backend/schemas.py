@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, field_validator
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
 
+from services.time_buckets import is_valid_timezone
+
 # Enums
 class UserRole(str, Enum):
     ADMIN = "admin"
@@ -59,6 +61,11 @@ class User(UserBase):
         from_attributes = True
 
 # Business schemas
+def _known_timezone(value: str) -> str:
+    if not is_valid_timezone(value):
+        raise ValueError(f"Unknown timezone {value}; use an IANA name like Africa/Nairobi")
+    return value
+
 class BusinessBase(BaseModel):
     name: str
     business_type: Optional[str] = None
@@ -67,9 +74,15 @@ class BusinessBase(BaseModel):
     phone: Optional[str] = None
     email: Optional[str] = None
     currency: str = "KES"
+    timezone: str = "Africa/Nairobi"
     tax_pin: Optional[str] = None
     business_license: Optional[str] = None
 
+    @field_validator("timezone")
+    @classmethod
+    def known_timezone(cls, value):
+        return _known_timezone(value)
+
 class BusinessCreate(BusinessBase):
     pass
 
@@ -81,10 +94,16 @@ class BusinessUpdate(BaseModel):
     phone: Optional[str] = None
     email: Optional[str] = None
     currency: Optional[str] = None
+    timezone: Optional[str] = None
     tax_pin: Optional[str] = None
     business_license: Optional[str] = None
     logo_url: Optional[str] = None
 
+    @field_validator("timezone")
+    @classmethod
+    def known_timezone(cls, value):
+        return _known_timezone(value) if value is not None else value
+
 class Business(BusinessBase):
     id: int
     logo_url: Optional[str]
@@ -169,6 +188,25 @@ class PaymentCreate(BaseModel):
     method: PaymentMethod
     items: List[PaymentItemCreate]
 
+class OfflineSale(PaymentCreate):
+    client_reference: str  # Unique per sale on the till; makes re-syncing safe
+    recorded_at: Optional[datetime] = None  # When the till rang up the sale
+
+class OfflineSyncRequest(BaseModel):
+    sales: List[OfflineSale]
+
+class OfflineSaleResult(BaseModel):
+    client_reference: str
+    status: str  # created, duplicate or rejected
+    payment_id: Optional[int] = None
+    detail: Optional[str] = None
+
+class OfflineSyncResponse(BaseModel):
+    created: int
+    duplicates: int
+    rejected: int
+    results: List[OfflineSaleResult]
+
 class PaymentUpdate(BaseModel):
     status: Optional[PaymentStatus] = None
     transaction_id: Optional[str] = None
@@ -182,6 +220,7 @@ class Payment(BaseModel):
     status: PaymentStatus
     method: PaymentMethod
     transaction_id: Optional[str]
+    checkout_request_id: Optional[str] = None
     mpesa_receipt_number: Optional[str]
     created_at: datetime
     customer: Optional[Customer] = None
@@ -278,3 +317,22 @@ class MpesaCallbackData(BaseModel):
     mpesa_receipt_number: Optional[str] = None
     transaction_date: Optional[str] = None
     phone_number: Optional[str] = None
+
+class MpesaReconciliationRun(BaseModel):
+    started_at: datetime
+    duration_seconds: float
+    backlog: int
+    queried: int
+    completed: int
+    failed: int
+    still_pending: int
+    errors: int
+    concurrency_limit: float
+    
+    class Config:
+        from_attributes = True
+
+class MpesaReconciliationStatus(BaseModel):
+    backlog: int
+    oldest_pending_at: Optional[datetime] = None
+    recent_sweeps: List[MpesaReconciliationRun]
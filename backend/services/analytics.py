@@ -0,0 +1,137 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import func, select, union_all, null, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import DailySalesRollup, DailyCustomerRollup, Product
+from schemas import SalesAnalytics
+from services.time_buckets import business_buckets
+
+class SalesAnalyticsEngine:
+    """Computes the sales analytics for a business from the daily rollups.
+
+    Headline metrics for the current and previous windows come back in a
+    single round trip, and the product and category breakdowns in one more.
+    Days are the business's own, in its timezone, as the rollups are keyed.
+    """
+
+    def __init__(self, db: AsyncSession, business_id: int):
+        self.db = db
+        self.business_id = business_id
+
+    async def compute(self, days: int = 30) -> SalesAnalytics:
+        """Analytics for the last `days` whole days, today included"""
+        today = (await business_buckets(self.db, self.business_id)).today
+        start_day = today - timedelta(days=days - 1)
+        previous_start = start_day - timedelta(days=days)
+
+        headline = await self._headline(start_day, previous_start)
+        top_products, sales_by_category = await self._breakdowns(start_day)
+
+        total_revenue = headline["revenue"]
+        total_orders = headline["orders"]
+        previous_revenue = headline["previous_revenue"]
+
+        return SalesAnalytics(
+            total_revenue=total_revenue,
+            total_orders=total_orders,
+            average_order_value=total_revenue / total_orders if total_orders > 0 else 0,
+            active_customers=headline["customers"],
+            growth_rate=((total_revenue - previous_revenue) / previous_revenue * 100) if previous_revenue > 0 else 0,
+            daily_sales=headline["daily_sales"],
+            top_products=top_products,
+            sales_by_category=sales_by_category
+        )
+
+    async def _headline(self, start_day, previous_start) -> dict:
+        """Daily series for both windows plus distinct customers, in one query"""
+        windowed = select(
+            DailyCustomerRollup.day,
+            DailyCustomerRollup.customer_id,
+            DailyCustomerRollup.orders,
+            DailyCustomerRollup.revenue
+        ).where(
+            DailyCustomerRollup.business_id == self.business_id,
+            DailyCustomerRollup.day >= previous_start
+        ).cte("windowed")
+
+        daily = select(
+            literal_column("'daily'").label("kind"),
+            windowed.c.day,
+            func.sum(windowed.c.revenue).label("revenue"),
+            func.sum(windowed.c.orders).label("orders"),
+            null().label("customers")
+        ).group_by(windowed.c.day)
+
+        customers = select(
+            literal_column("'customers'"),
+            null(),
+            null(),
+            null(),
+            func.count(func.distinct(windowed.c.customer_id))
+        ).where(
+            windowed.c.day >= start_day,
+            # Rows stay at zero orders once their only payments were reverted
+            windowed.c.orders > 0
+        )
+
+        rows = (await self.db.execute(union_all(daily, customers))).all()
+
+        headline = {"revenue": 0, "orders": 0, "previous_revenue": 0, "customers": 0, "daily_sales": []}
+        for row in sorted((r for r in rows if r.kind == "daily"), key=lambda r: r.day):
+            if row.day >= start_day:
+                headline["revenue"] += row.revenue or 0
+                headline["orders"] += row.orders or 0
+                headline["daily_sales"].append({
+                    "date": row.day.isoformat(),
+                    "sales": row.revenue,
+                    "orders": row.orders
+                })
+            else:
+                headline["previous_revenue"] += row.revenue or 0
+
+        for row in rows:
+            if row.kind == "customers":
+                headline["customers"] = row.customers or 0
+
+        return headline
+
+    async def _breakdowns(self, start_day):
+        """Top products and sales by category from one per-product grouping"""
+        rows = (await self.db.execute(
+            select(
+                Product.name,
+                DailySalesRollup.category,
+                func.sum(DailySalesRollup.quantity).label("quantity"),
+                func.sum(DailySalesRollup.revenue).label("revenue")
+            ).join(
+                Product, Product.id == DailySalesRollup.product_id
+            ).where(
+                DailySalesRollup.business_id == self.business_id,
+                DailySalesRollup.day >= start_day
+            ).group_by(DailySalesRollup.product_id, Product.name, DailySalesRollup.category)
+        )).all()
+
+        rows = sorted(rows, key=lambda r: r.revenue or 0, reverse=True)
+
+        top_products = [
+            {
+                "name": row.name,
+                "category": row.category,
+                "quantity_sold": row.quantity,
+                "revenue": row.revenue
+            } for row in rows[:10]
+        ]
+
+        categories = defaultdict(lambda: {"revenue": 0, "quantity": 0})
+        for row in rows:
+            categories[row.category]["revenue"] += row.revenue or 0
+            categories[row.category]["quantity"] += row.quantity or 0
+
+        sales_by_category = [
+            {"category": category, "revenue": totals["revenue"], "quantity": totals["quantity"]}
+            for category, totals in sorted(categories.items(), key=lambda item: item[1]["revenue"], reverse=True)
+        ]
+
+        return top_products, sales_by_category
@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import session_scope
+
+try:
+    import redis.asyncio
+except ImportError:  # The shared cache backend is optional
+    redis = None
+
+load_dotenv()
+
+# A response computed at the business's current data version is served as is for this long
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "60"))
+
+# An outdated or expired response is still served, while a fresh one is
+# computed in the background, until it is this old
+RESPONSE_CACHE_STALE_SECONDS = float(os.getenv("RESPONSE_CACHE_STALE_SECONDS", "300"))
+
+# Responses kept per process by the in-process backend
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+
+# Share responses and data versions between processes (needs the redis package)
+REDIS_URL = os.getenv("REDIS_URL")
+
+class LocalCacheBackend:
+    """Responses in a per-process LRU, with per-business data versions.
+
+    Versions only move in this process, so writes made by other processes
+    show up once the TTL runs out; use the Redis backend to share them.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._clock = itertools.count(1)
+
+    async def lookup(self, key: str, business_id: int) -> Tuple[Optional[dict], int]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry, self._versions.get(business_id, 0)
+
+    async def store(self, key: str, entry: dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def bump(self, business_ids: Iterable[int]):
+        for business_id in business_ids:
+            self._versions[business_id] = next(self._clock)
+
+class RedisCacheBackend:
+    """Responses and data versions in Redis, shared by every process"""
+
+    def __init__(self, url: str, stale_seconds: float = RESPONSE_CACHE_STALE_SECONDS):
+        self._client = redis.asyncio.Redis.from_url(url)
+        self.expire_seconds = max(1, int(stale_seconds))
+
+    async def lookup(self, key: str, business_id: int) -> Tuple[Optional[dict], int]:
+        entry, version = await self._client.mget(f"cache:{key}", f"cache:version:{business_id}")
+        return (json.loads(entry) if entry else None), int(version or 0)
+
+    async def store(self, key: str, entry: dict):
+        await self._client.set(f"cache:{key}", json.dumps(entry, separators=(",", ":")), ex=self.expire_seconds)
+
+    async def bump(self, business_ids: Iterable[int]):
+        pipeline = self._client.pipeline(transaction=False)
+        for business_id in business_ids:
+            pipeline.incr(f"cache:version:{business_id}")
+        await pipeline.execute()
+
+def _default_backend():
+    if REDIS_URL and redis is not None:
+        return RedisCacheBackend(REDIS_URL)
+    if REDIS_URL:
+        print("⚠️  REDIS_URL is set but the redis package isn't installed; caching responses per process")
+    return LocalCacheBackend()
+
+class ResponseCache:
+    """Read-through cache of per-business responses, keyed by endpoint and parameters.
+
+    Each entry carries the business's data version from when it was
+    computed; payment, product and customer writes bump the version once
+    they commit (invalidate_after_commit). A current entry younger than the
+    TTL is served straight from the backend. An outdated or expired one is
+    served stale, up to RESPONSE_CACHE_STALE_SECONDS old, while a single
+    background task per key recomputes it in a session of its own.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+        stale_seconds: float = RESPONSE_CACHE_STALE_SECONDS
+    ):
+        self.backend = backend or _default_backend()
+        self.ttl = ttl_seconds
+        self.stale = stale_seconds
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._bumping: Set[asyncio.Task] = set()
+
+    async def get_or_compute(
+        self,
+        db: AsyncSession,
+        name: str,
+        business_id: int,
+        compute: Callable[[AsyncSession], Awaitable],
+        **params
+    ):
+        """The cached JSON-ready response, computing it with compute(db) on a miss"""
+        key = f"{name}:{business_id}:{json.dumps(params, sort_keys=True, separators=(',', ':'))}"
+        try:
+            entry, version = await self.backend.lookup(key, business_id)
+        except Exception as e:
+            print(f"❌ Response cache lookup failed: {e}")
+            return jsonable_encoder(await compute(db))
+
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if entry["version"] == version and age < self.ttl:
+                return entry["value"]
+            if age < self.stale:
+                self._refresh_in_background(key, version, compute)
+                return entry["value"]
+        return await self._compute(db, key, version, compute)
+
+    async def _compute(self, db: AsyncSession, key: str, version: int, compute):
+        # Tagged with the version read before computing, so a write that
+        # commits meanwhile leaves the entry outdated rather than wrongly current
+        value = jsonable_encoder(await compute(db))
+        try:
+            await self.backend.store(key, {"value": value, "version": version, "stored_at": time.time()})
+        except Exception as e:
+            print(f"❌ Response cache store failed: {e}")
+        return value
+
+    def _refresh_in_background(self, key: str, version: int, compute):
+        if key not in self._refreshing:
+            self._refreshing[key] = asyncio.create_task(self._refresh(key, version, compute))
+
+    async def _refresh(self, key: str, version: int, compute):
+        try:
+            async with session_scope() as db:
+                await self._compute(db, key, version, compute)
+        except Exception as e:
+            print(f"❌ Response cache refresh of {key} failed: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def invalidate(self, business_ids: Iterable[int], loop: asyncio.AbstractEventLoop):
+        """Bump the data version of businesses whose data changed, on the event loop.
+
+        Safe from any thread: commits run on the loop (DATABASE_ASYNC) or in
+        the threadpool, and neither may block on a backend round trip.
+        """
+        loop.call_soon_threadsafe(self._start_bump, list(business_ids))
+
+    def _start_bump(self, business_ids: List[int]):
+        task = asyncio.create_task(self._bump(business_ids))
+        self._bumping.add(task)
+        task.add_done_callback(self._bumping.discard)
+
+    async def _bump(self, business_ids: List[int]):
+        try:
+            await self.backend.bump(business_ids)
+        except Exception as e:
+            print(f"❌ Response cache invalidation failed: {e}")
+
+response_cache = ResponseCache()
+
+def invalidate_after_commit(db: AsyncSession, business_id: int):
+    """Mark the business's cached responses outdated once this transaction commits.
+
+    Call it from the request (or task) on the event loop; the commit may
+    happen in a worker thread, so the loop the bump runs on is noted here.
+    """
+    db.info.setdefault("cache_invalidations", set()).add(business_id)
+    db.info["cache_loop"] = asyncio.get_running_loop()
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    business_ids = session.info.pop("cache_invalidations", None)
+    loop = session.info.pop("cache_loop", None)
+    if business_ids:
+        response_cache.invalidate(business_ids, loop)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_uncommitted(session):
+    session.info.pop("cache_invalidations", None)
+    session.info.pop("cache_loop", None)
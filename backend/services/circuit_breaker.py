@@ -0,0 +1,130 @@
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Calls slower than this count against the circuit even when they succeed
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("MPESA_BREAKER_SLOW_CALL_SECONDS", "5"))
+
+# Trip when at least this share of the calls in the window failed or were slow,
+# once the window holds enough calls to judge
+BREAKER_FAILURE_RATE = float(os.getenv("MPESA_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("MPESA_BREAKER_MIN_CALLS", "5"))
+BREAKER_WINDOW_SECONDS = float(os.getenv("MPESA_BREAKER_WINDOW_SECONDS", "60"))
+
+# How long an open circuit fails fast before letting a probe call through
+BREAKER_OPEN_SECONDS = float(os.getenv("MPESA_BREAKER_OPEN_SECONDS", "30"))
+
+class CircuitOpenError(Exception):
+    """The circuit is open: the call was refused without being attempted"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+
+class CircuitBreaker:
+    """Fails fast while a dependency is failing or slow.
+
+    closed: calls go through; their outcomes (failed, slow or fine) are
+    kept for window_seconds, and the circuit opens once the bad share
+    reaches failure_rate. open: every call is refused with CircuitOpenError
+    for open_seconds. half-open: one probe call goes through at a time; a
+    good probe closes the circuit, a bad one opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        min_calls: int = BREAKER_MIN_CALLS,
+        window_seconds: float = BREAKER_WINDOW_SECONDS,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        is_failure: Optional[Callable[[Exception], bool]] = None
+    ):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.is_failure = is_failure or (lambda error: True)
+
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._calls = deque()  # (finished at, bad)
+        self._probing = False
+
+    def retry_after(self) -> float:
+        """Seconds until calls will be let through again; 0 if they are now"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def _before_call(self) -> bool:
+        """Let a call through or raise; returns whether it is the half-open probe"""
+        if self.state == "open":
+            if self.retry_after() > 0:
+                raise CircuitOpenError(self.name, self.retry_after())
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            if self._probing:
+                raise CircuitOpenError(self.name, self.open_seconds)
+            self._probing = True
+            return True
+        return False
+
+    def _open(self, now: float):
+        if self.state != "open":
+            print(f"⚠️  Circuit {self.name} opened")
+        self.state = "open"
+        self.opened_at = now
+        self._calls.clear()
+
+    def _record(self, probe: bool, bad: bool):
+        now = time.monotonic()
+        if probe:
+            self._probing = False
+            if bad:
+                self._open(now)
+            else:
+                self.state = "closed"
+                self._calls.clear()
+                print(f"✅ Circuit {self.name} closed")
+            return
+        if self.state != "closed":
+            return
+
+        self._calls.append((now, bad))
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+        if len(self._calls) >= self.min_calls:
+            bad_calls = sum(1 for _, was_bad in self._calls if was_bad)
+            if bad_calls / len(self._calls) >= self.failure_rate:
+                self._open(now)
+
+    @asynccontextmanager
+    async def guard(self):
+        """Wrap one call to the dependency"""
+        probe = self._before_call()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._record(probe, bad=self.is_failure(e))
+            raise
+        except BaseException:
+            # Cancelled: no verdict on the dependency, but free the probe slot
+            if probe:
+                self._probing = False
+            raise
+        self._record(probe, bad=time.monotonic() - started > self.slow_call_seconds)
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "retry_after": round(self.retry_after(), 1)}
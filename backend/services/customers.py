@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import update, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Customer
+
+async def record_purchases(db: AsyncSession, spent: Dict[int, float], purchased_at: Dict[int, datetime]):
+    """Add completed purchases to customer totals in one statement.
+
+    Totals are incremented in SQL, so concurrent sales to the same customer
+    add up, and last_purchase only ever moves forward. Both dicts are keyed
+    by customer id.
+    """
+    if not spent:
+        return
+
+    latest = case(purchased_at, value=Customer.id)
+    await db.execute(
+        update(Customer).where(Customer.id.in_(spent.keys())).values(
+            total_purchases=Customer.total_purchases + case(spent, value=Customer.id),
+            last_purchase=case(
+                (Customer.last_purchase.is_(None), latest),
+                (Customer.last_purchase < latest, latest),
+                else_=Customer.last_purchase
+            )
+        ).execution_options(synchronize_session=False)
+    )
+
+async def revert_purchases(db: AsyncSession, spent: Dict[int, float]):
+    """Take purchases that are no longer completed back out of customer totals"""
+    if not spent:
+        return
+
+    await db.execute(
+        update(Customer).where(Customer.id.in_(spent.keys())).values(
+            total_purchases=Customer.total_purchases - case(spent, value=Customer.id)
+        ).execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from database import session_scope
+from models import Customer, Payment, PaymentItem, PaymentStatus, Product
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+
+load_dotenv()
+
+# Rows fetched from the database cursor, and encoded, per chunk
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))
+
+# One row per line item; a payment without items gets one row with empty item fields
+EXPORT_COLUMNS = [
+    "payment_id",
+    "created_at",
+    "transaction_id",
+    "mpesa_receipt_number",
+    "method",
+    "customer_name",
+    "payment_amount",
+    "product_name",
+    "quantity",
+    "unit_price",
+    "line_total"
+]
+
+class ExportFormatError(Exception):
+    """The requested format is unknown, or needs a library that isn't installed"""
+
+def _completed_payments(business_id: int, start: Optional[datetime], end: Optional[datetime]):
+    conditions = [Payment.business_id == business_id, Payment.status == PaymentStatus.COMPLETED]
+    if start:
+        conditions.append(Payment.created_at >= start)
+    if end:
+        conditions.append(Payment.created_at <= end)
+    return conditions
+
+async def summarize_sales(
+    db: AsyncSession,
+    business_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> dict:
+    """Totals for the export, computed by the database"""
+    count, revenue = (await db.execute(
+        select(func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0)).where(
+            *_completed_payments(business_id, start, end)
+        )
+    )).one()
+    return {
+        "total_records": count,
+        "total_revenue": float(revenue),
+        "average_transaction": float(revenue) / count if count else 0
+    }
+
+def sales_export_query(business_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Flat rows for the export: payments joined to their customer and line items, newest first"""
+    return select(
+        Payment.id.label("payment_id"),
+        Payment.created_at,
+        Payment.transaction_id,
+        Payment.mpesa_receipt_number,
+        Payment.method,
+        Customer.name.label("customer_name"),
+        Payment.amount.label("payment_amount"),
+        Product.name.label("product_name"),
+        PaymentItem.quantity,
+        PaymentItem.unit_price,
+        PaymentItem.total_price.label("line_total")
+    ).outerjoin(
+        Customer, Customer.id == Payment.customer_id
+    ).outerjoin(
+        PaymentItem, PaymentItem.payment_id == Payment.id
+    ).outerjoin(
+        Product, Product.id == PaymentItem.product_id
+    ).where(
+        *_completed_payments(business_id, start, end)
+    ).order_by(Payment.created_at.desc(), Payment.id.desc(), PaymentItem.id)
+
+async def stream_rows(query, chunk_rows: int = EXPORT_CHUNK_ROWS) -> AsyncIterator[List[dict]]:
+    """Read query through a server-side cursor, chunk by chunk, in a session of its own.
+
+    The response streams after the request's own session is gone, and
+    only one chunk is held in memory at a time.
+    """
+    async with session_scope() as db:
+        result = await db.stream(query.execution_options(yield_per=chunk_rows))
+        try:
+            async for rows in result.partitions(chunk_rows):
+                yield [_plain(row._mapping) for row in rows]
+        finally:
+            await result.close()
+
+def _plain(row) -> dict:
+    values = dict(row)
+    values["method"] = values["method"].value if values["method"] is not None else None
+    return values
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+async def csv_chunks(chunks: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in chunks:
+        writer.writerows([_text(row[column]) for column in EXPORT_COLUMNS] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+async def ndjson_chunks(chunks: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield "".join(
+            json.dumps(row, default=_text, separators=(",", ":")) + "\n" for row in rows
+        ).encode()
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file for ParquetWriter that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ("payment_id", pyarrow.int64()),
+        ("created_at", pyarrow.timestamp("us", tz="UTC")),
+        ("transaction_id", pyarrow.string()),
+        ("mpesa_receipt_number", pyarrow.string()),
+        ("method", pyarrow.string()),
+        ("customer_name", pyarrow.string()),
+        ("payment_amount", pyarrow.float64()),
+        ("product_name", pyarrow.string()),
+        ("quantity", pyarrow.int64()),
+        ("unit_price", pyarrow.float64()),
+        ("line_total", pyarrow.float64())
+    ])
+
+async def parquet_chunks(chunks: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """One row group per chunk; the footer goes out last"""
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        async for rows in chunks:
+            writer.write_table(pyarrow.Table.from_pylist(rows, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+# format: (media type, file extension, encoder)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv", csv_chunks),
+    "ndjson": ("application/x-ndjson", "ndjson", ndjson_chunks),
+    "parquet": ("application/vnd.apache.parquet", "parquet", parquet_chunks)
+}
+
+def export_encoder(format: str):
+    """(media type, file extension, encoder) for a format, or ExportFormatError"""
+    if format not in EXPORT_FORMATS:
+        raise ExportFormatError(f"Unknown export format {format}; use one of {', '.join(EXPORT_FORMATS)}")
+    if format == "parquet" and pyarrow is None:
+        raise ExportFormatError("Parquet export needs pyarrow installed on the server")
+    return EXPORT_FORMATS[format]
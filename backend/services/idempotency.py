@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Response
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from models import IdempotencyKey
+
+load_dotenv()
+
+# How long a stored response can be replayed, and how many stay in memory per process
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+MAX_KEY_LENGTH = 255
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body"""
+
+class IdempotencyKeyInProgress(Exception):
+    """Another request holding the same key has not finished yet"""
+
+@dataclass(frozen=True)
+class StoredResponse:
+    business_id: int
+    key: str
+    fingerprint: str
+    status_code: int
+    body: str
+    expires_at: datetime
+
+    def to_response(self) -> Response:
+        return Response(
+            content=self.body,
+            status_code=self.status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+def request_fingerprint(payload) -> str:
+    """Stable hash of a request body, so a key can't be replayed for a different request"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class IdempotencyStore:
+    """Stored responses for retried requests, keyed by (business, Idempotency-Key).
+
+    The database row is the source of truth: it is claimed before the
+    request does any work and completed in the same transaction as the
+    work itself, so a response is only ever stored for work that committed.
+    A concurrent retry blocks on the unique key and then replays. Completed
+    responses are kept in a per-process LRU so hot retries skip the database.
+    """
+
+    def __init__(self, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], StoredResponse]" = OrderedDict()
+
+    def _cached(self, business_id: int, key: str) -> Optional[StoredResponse]:
+        entry = self._entries.get((business_id, key))
+        if entry is None:
+            return None
+        if entry.expires_at <= datetime.utcnow():
+            del self._entries[(business_id, key)]
+            return None
+        self._entries.move_to_end((business_id, key))
+        return entry
+
+    def remember(self, stored: StoredResponse):
+        """Put a committed response in the in-memory front"""
+        self._entries[(stored.business_id, stored.key)] = stored
+        self._entries.move_to_end((stored.business_id, stored.key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _check(self, stored: StoredResponse, fingerprint: str) -> StoredResponse:
+        if stored.fingerprint != fingerprint:
+            raise IdempotencyKeyReused()
+        return stored
+
+    async def lookup(self, db: AsyncSession, business_id: int, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """The stored response for this key, or None if the key is unused or expired"""
+        cached = self._cached(business_id, key)
+        if cached:
+            return self._check(cached, fingerprint)
+
+        row = await db.scalar(
+            select(IdempotencyKey).where(
+                IdempotencyKey.business_id == business_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.expires_at > datetime.utcnow()
+            )
+        )
+        if row is None:
+            return None
+        if row.status_code is None:
+            if row.fingerprint != fingerprint:
+                raise IdempotencyKeyReused()
+            raise IdempotencyKeyInProgress()
+
+        stored = StoredResponse(
+            business_id=business_id,
+            key=key,
+            fingerprint=row.fingerprint,
+            status_code=row.status_code,
+            body=row.response,
+            expires_at=row.expires_at
+        )
+        self.remember(stored)
+        return self._check(stored, fingerprint)
+
+    async def claim(self, db: AsyncSession, business_id: int, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """Reserve the key for this request, or return the response to replay.
+
+        Must be called before the request writes anything: if another
+        request won the key, the transaction is rolled back and its stored
+        response is returned instead. Returns None once the key is reserved.
+        """
+        stored = await self.lookup(db, business_id, key, fingerprint)
+        if stored:
+            return stored
+
+        # An expired row still holds the unique key until it is purged
+        await db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.business_id == business_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.expires_at <= datetime.utcnow()
+            )
+        )
+
+        db.add(IdempotencyKey(
+            business_id=business_id,
+            key=key,
+            fingerprint=fingerprint,
+            expires_at=datetime.utcnow() + self.ttl
+        ))
+        try:
+            await db.flush()
+        except IntegrityError:
+            await db.rollback()
+            stored = await self.lookup(db, business_id, key, fingerprint)
+            if stored is None:
+                raise IdempotencyKeyInProgress()
+            return stored
+
+        return None
+
+    async def complete(self, db: AsyncSession, business_id: int, key: str, status_code: int, body: str) -> StoredResponse:
+        """Store the response for a claimed key; commits with the caller's transaction"""
+        result = (await db.execute(
+            update(IdempotencyKey).where(
+                IdempotencyKey.business_id == business_id,
+                IdempotencyKey.key == key
+            ).values(
+                status_code=status_code,
+                response=body
+            ).returning(IdempotencyKey.fingerprint, IdempotencyKey.expires_at).execution_options(
+                synchronize_session=False
+            )
+        )).one()
+
+        return StoredResponse(
+            business_id=business_id,
+            key=key,
+            fingerprint=result.fingerprint,
+            status_code=status_code,
+            body=body,
+            expires_at=result.expires_at
+        )
+
+    async def lookup_many(self, db: AsyncSession, business_id: int, keys: List[str]) -> Dict[str, Optional[StoredResponse]]:
+        """Live entries for a batch of keys in one query.
+
+        Keys still being processed by another request map to None; unused
+        or expired keys are left out. Fingerprints are for the caller to check.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            cached = self._cached(business_id, key)
+            if cached:
+                found[key] = cached
+            else:
+                missing.append(key)
+
+        if missing:
+            rows = (await db.scalars(
+                select(IdempotencyKey).where(
+                    IdempotencyKey.business_id == business_id,
+                    IdempotencyKey.key.in_(missing),
+                    IdempotencyKey.expires_at > datetime.utcnow()
+                )
+            )).all()
+            for row in rows:
+                if row.status_code is None:
+                    found[row.key] = None
+                    continue
+                found[row.key] = StoredResponse(
+                    business_id=business_id,
+                    key=row.key,
+                    fingerprint=row.fingerprint,
+                    status_code=row.status_code,
+                    body=row.response,
+                    expires_at=row.expires_at
+                )
+                self.remember(found[row.key])
+
+        return found
+
+    async def store_many(self, db: AsyncSession, business_id: int, entries: List[Tuple[str, str, int, str]]) -> List[StoredResponse]:
+        """Store completed responses for unused keys with one bulk insert.
+
+        Entries are (key, fingerprint, status_code, body). Writes in the
+        caller's transaction; if another request stored one of the keys
+        first, the flush raises IntegrityError and the caller rolls back.
+        """
+        if not entries:
+            return []
+
+        keys = [key for key, _, _, _ in entries]
+        await db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.business_id == business_id,
+                IdempotencyKey.key.in_(keys),
+                IdempotencyKey.expires_at <= datetime.utcnow()
+            )
+        )
+
+        expires_at = datetime.utcnow() + self.ttl
+        stored = [
+            StoredResponse(
+                business_id=business_id,
+                key=key,
+                fingerprint=fingerprint,
+                status_code=status_code,
+                body=body,
+                expires_at=expires_at
+            ) for key, fingerprint, status_code, body in entries
+        ]
+        await db.execute(
+            insert(IdempotencyKey),
+            [
+                {
+                    "business_id": business_id,
+                    "key": entry.key,
+                    "fingerprint": entry.fingerprint,
+                    "status_code": entry.status_code,
+                    "response": entry.body,
+                    "expires_at": entry.expires_at
+                } for entry in stored
+            ]
+        )
+        return stored
+
+    async def purge_expired(self, db: AsyncSession) -> int:
+        """Delete expired keys; returns how many rows were removed"""
+        now = datetime.utcnow()
+        result = await db.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now)
+        )
+        for cache_key in [k for k, entry in self._entries.items() if entry.expires_at <= now]:
+            del self._entries[cache_key]
+        return result.rowcount
+
+idempotency_store = IdempotencyStore()
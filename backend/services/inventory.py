@@ -0,0 +1,59 @@
+from typing import Dict, List, Optional
+
+from sqlalchemy import update, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import Product
+
+class InsufficientStockError(Exception):
+    """Raised when a stock deduction can't be covered for every product"""
+
+    def __init__(self, product_ids: List[int]):
+        self.product_ids = product_ids
+        super().__init__(f"Insufficient stock for products {product_ids}")
+
+async def deduct_stock(
+    db: AsyncSession,
+    business_id: int,
+    quantities: Dict[int, int],
+    products: Optional[Dict[int, Product]] = None
+) -> Dict[int, int]:
+    """Take stock for a whole basket in one conditional UPDATE.
+
+    Each row is only decremented if it still has enough stock, so
+    concurrent checkouts can never oversell, and no row lock is held
+    between reading and writing the stock. Returns the new stock per
+    product id.
+
+    If any product is short, InsufficientStockError is raised after the
+    rows that did have stock were decremented; the caller must roll back.
+    """
+    if not quantities:
+        return {}
+
+    quantity = case(quantities, value=Product.id)
+    result = await db.execute(
+        update(Product).where(
+            Product.business_id == business_id,
+            Product.id.in_(quantities.keys()),
+            Product.stock >= quantity
+        ).values(
+            stock=Product.stock - quantity
+        ).returning(
+            Product.id, Product.stock
+        ).execution_options(synchronize_session=False)
+    )
+    new_stock = {row.id: row.stock for row in result}
+
+    short = [product_id for product_id in quantities if product_id not in new_stock]
+    if short:
+        raise InsufficientStockError(short)
+
+    # Keep loaded products in step without marking them dirty, which
+    # would write the absolute value back and undo concurrent deductions
+    for product_id, stock in new_stock.items():
+        if products and product_id in products:
+            set_committed_value(products[product_id], "stock", stock)
+
+    return new_stock
@@ -0,0 +1,345 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import select, update, func, or_, and_, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import session_scope
+from models import Job, JobStatus
+
+load_dotenv()
+
+# Worker coroutines per process, and how often idle workers look for new jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+
+# Retries: attempts per job and exponential backoff between them
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+
+# A running job whose worker hasn't finished it in this long is assumed lost and run again
+JOB_LOCK_TIMEOUT_SECONDS = int(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "300"))
+
+# Run workers inside the API process; turn off when running worker.py separately
+JOB_WORKER_IN_PROCESS = os.getenv("JOB_WORKER_IN_PROCESS", "true").lower() in ("1", "true", "yes")
+
+class JobPriority:
+    """Lower runs first"""
+    STK_PUSH = 0
+    EMAIL = 10
+    NOTIFICATION = 20
+    MAINTENANCE = 30
+
+class RetryLater(Exception):
+    """Raised by a handler to run its job again in `delay` seconds, without using up an attempt"""
+
+    def __init__(self, delay: float, reason: str = ""):
+        self.delay = delay
+        super().__init__(reason or f"retry in {delay:.0f}s")
+
+@dataclass(frozen=True)
+class JobHandler:
+    name: str
+    fn: Callable
+    priority: int
+    max_attempts: int
+    on_failure: Optional[Callable] = None
+
+_handlers: Dict[str, JobHandler] = {}
+_periodic: Dict[str, int] = {}
+
+def job_handler(
+    name: str,
+    priority: int = JobPriority.NOTIFICATION,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    on_failure: Optional[Callable] = None
+):
+    """Register a coroutine as the handler for jobs called `name`.
+
+    The handler is called as fn(db, **payload) with its own session, which
+    is committed together with the job being marked done. on_failure is
+    called the same way, plus error=, once the last attempt has failed.
+    """
+    def register(fn):
+        _handlers[name] = JobHandler(name, fn, priority, max_attempts, on_failure)
+        fn.job_name = name
+        return fn
+    return register
+
+def periodic_job(name: str, every_seconds: int, priority: int = JobPriority.MAINTENANCE):
+    """Register a handler that is enqueued once every `every_seconds` across all processes"""
+    def register(fn):
+        job_handler(name, priority=priority, max_attempts=1)(fn)
+        _periodic[name] = every_seconds
+        return fn
+    return register
+
+def enqueue(
+    db: AsyncSession,
+    handler: Callable,
+    payload: Optional[dict] = None,
+    run_at: Optional[datetime] = None,
+    priority: Optional[int] = None
+) -> Job:
+    """Add a job in the caller's transaction; it only becomes visible when the caller commits.
+
+    Payloads hold ids, not ORM objects: the handler loads fresh rows itself.
+    """
+    registered = _handlers[handler.job_name]
+    job = Job(
+        name=registered.name,
+        payload=json.dumps(payload or {}, separators=(",", ":")),
+        priority=registered.priority if priority is None else priority,
+        status=JobStatus.PENDING,
+        attempts=0,
+        max_attempts=registered.max_attempts,
+        run_at=run_at or datetime.utcnow()
+    )
+    db.add(job)
+    db.info["jobs_enqueued"] = True
+    return job
+
+async def enqueue_once(
+    db: AsyncSession,
+    handler: Callable,
+    dedupe_key: str,
+    payload: Optional[dict] = None,
+    run_at: Optional[datetime] = None,
+    while_pending: bool = False
+):
+    """Like enqueue, but does nothing if a job with this dedupe key was already added.
+
+    Used to coalesce bursts of triggers into one job, e.g. one per time slot.
+    With while_pending, the key only stands until a worker claims the job:
+    triggers that arrive once it has started queue another run.
+    """
+    registered = _handlers[handler.job_name]
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    key_column = "pending_key" if while_pending else "dedupe_key"
+    await db.execute(
+        dialect_insert(Job).values(
+            name=registered.name,
+            payload=json.dumps(payload or {}, separators=(",", ":")),
+            priority=registered.priority,
+            status=JobStatus.PENDING,
+            attempts=0,
+            max_attempts=registered.max_attempts,
+            run_at=run_at or datetime.utcnow(),
+            **{key_column: dedupe_key}
+        ).on_conflict_do_nothing(index_elements=[key_column])
+    )
+    db.info["jobs_enqueued"] = True
+
+async def count_outstanding(db: AsyncSession, handler: Callable) -> int:
+    """Jobs for this handler that are queued or running"""
+    return await db.scalar(
+        select(func.count(Job.id)).where(
+            Job.status.in_([JobStatus.PENDING, JobStatus.RUNNING]),
+            Job.name == handler.job_name
+        )
+    )
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for a job that has failed `attempts` times"""
+    delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+# The runner in this process, woken as soon as a transaction that enqueued jobs commits
+_local_runner: Optional["JobRunner"] = None
+
+@event.listens_for(Session, "after_commit")
+def _wake_local_runner(session):
+    if session.info.pop("jobs_enqueued", False) and _local_runner is not None:
+        _local_runner.wake()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_enqueued(session):
+    session.info.pop("jobs_enqueued", None)
+
+class JobRunner:
+    """Drains the jobs table with a bounded number of worker coroutines.
+
+    Workers claim one job at a time, highest priority first, with an
+    UPDATE ... RETURNING over a SKIP LOCKED subquery, so any number of
+    processes can share the queue. A scheduler coroutine enqueues the
+    periodic jobs; their dedupe key makes each run happen once overall.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, worker_id: Optional[str] = None):
+        self.workers = workers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._stopping = False
+
+    async def start(self):
+        global _local_runner
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._schedule()))
+        _local_runner = self
+
+    async def stop(self, timeout: float = 10):
+        """Let running jobs finish, then cancel whatever is left"""
+        global _local_runner
+        if _local_runner is self:
+            _local_runner = None
+        self._stopping = True
+        if self.wakeup:
+            self.wakeup.set()
+        if self._tasks:
+            done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._tasks = []
+
+    def wake(self):
+        """Safe to call from any thread"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _work(self):
+        while not self._stopping:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"❌ Job queue unavailable: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            try:
+                await self._run(job)
+            except Exception as e:
+                # The job stays running and is picked up again after the lock timeout
+                print(f"❌ Could not record the outcome of job {job.name} #{job.id}: {e}")
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        claimable = select(Job.id).where(
+            or_(
+                and_(Job.status == JobStatus.PENDING, Job.run_at <= now),
+                and_(Job.status == JobStatus.RUNNING, Job.locked_at < now - timedelta(seconds=JOB_LOCK_TIMEOUT_SECONDS))
+            )
+        ).order_by(Job.priority, Job.run_at, Job.id).limit(1).with_for_update(skip_locked=True)
+
+        async with session_scope() as db:
+            job = (await db.execute(
+                update(Job).where(Job.id.in_(claimable.scalar_subquery())).values(
+                    status=JobStatus.RUNNING,
+                    attempts=Job.attempts + 1,
+                    locked_by=self.worker_id,
+                    locked_at=now,
+                    pending_key=None
+                ).returning(
+                    Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts
+                ).execution_options(synchronize_session=False)
+            )).first()
+            await db.commit()
+            return job
+
+    async def _run(self, job):
+        handler = _handlers.get(job.name)
+        payload = json.loads(job.payload)
+
+        async with session_scope() as db:
+            try:
+                if handler is None:
+                    raise LookupError(f"No handler registered for job {job.name}")
+
+                await handler.fn(db, **payload)
+                await self._finish(db, job.id, status=JobStatus.DONE, finished_at=datetime.utcnow(), last_error=None)
+                await db.commit()
+                return
+
+            except RetryLater as e:
+                await db.rollback()
+                await self._finish(
+                    db,
+                    job.id,
+                    status=JobStatus.PENDING,
+                    attempts=Job.attempts - 1,
+                    run_at=datetime.utcnow() + timedelta(seconds=e.delay),
+                    last_error=f"Deferred: {e}"
+                )
+                await db.commit()
+                return
+
+            except Exception as e:
+                await db.rollback()
+                error = f"{type(e).__name__}: {e}"
+
+            if job.attempts < job.max_attempts:
+                await self._finish(
+                    db,
+                    job.id,
+                    status=JobStatus.PENDING,
+                    run_at=datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts)),
+                    last_error=error
+                )
+                await db.commit()
+                return
+
+            print(f"❌ Job {job.name} #{job.id} failed after {job.attempts} attempts: {error}")
+            if handler and handler.on_failure:
+                try:
+                    await handler.on_failure(db, error=error, **payload)
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    print(f"❌ Failure handler for job {job.name} #{job.id} failed: {e}")
+
+            await self._finish(db, job.id, status=JobStatus.FAILED, finished_at=datetime.utcnow(), last_error=error)
+            await db.commit()
+
+    async def _finish(self, db: AsyncSession, job_id: int, **values):
+        await db.execute(
+            update(Job).where(Job.id == job_id).values(
+                locked_by=None, locked_at=None, **values
+            ).execution_options(synchronize_session=False)
+        )
+
+    async def _schedule(self):
+        """Enqueue each periodic job once per interval, whichever process gets there first"""
+        scheduled = {}
+        while not self._stopping:
+            now = time.time()
+            due = {
+                name: int(now // every)
+                for name, every in _periodic.items()
+                if scheduled.get(name) != int(now // every)
+            }
+
+            if due:
+                try:
+                    async with session_scope() as db:
+                        for name, slot in due.items():
+                            await enqueue_once(db, _handlers[name].fn, f"{name}:{slot}")
+                        await db.commit()
+                    scheduled.update(due)
+                    self.wakeup.set()
+                except Exception as e:
+                    print(f"❌ Could not schedule periodic jobs: {e}")
+
+            await asyncio.sleep(1)
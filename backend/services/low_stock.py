@@ -0,0 +1,117 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from models import LowStockAlert, NotificationPriority, NotificationType, Product
+from services.notifications import notify_staff
+
+load_dotenv()
+
+# A product that crosses its threshold again this soon after an alert is not alerted again
+LOW_STOCK_ALERT_WINDOW_SECONDS = int(os.getenv("LOW_STOCK_ALERT_WINDOW_SECONDS", "3600"))
+
+# Crossings in a business within this many seconds are sent together, in one insert
+LOW_STOCK_ALERT_DELAY_SECONDS = int(os.getenv("LOW_STOCK_ALERT_DELAY_SECONDS", "10"))
+
+async def mark_low(db: AsyncSession, business_id: int, product_ids: List[int]) -> List[int]:
+    """Note products now at or below their threshold; returns those that just crossed it.
+
+    A product only crosses once until mark_restocked re-arms it, so a sale
+    that leaves an already-low product lower is a no-op. Runs in the
+    caller's transaction, after the stock update that locked the rows.
+    """
+    if not product_ids:
+        return []
+    now = datetime.utcnow()
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(LowStockAlert).values([
+        {"product_id": product_id, "business_id": business_id, "low": True, "pending": True, "crossed_at": now}
+        for product_id in product_ids
+    ])
+    crossed = (await db.scalars(
+        stmt.on_conflict_do_update(
+            index_elements=[LowStockAlert.product_id],
+            set_={"low": True, "pending": True, "crossed_at": now},
+            where=LowStockAlert.low == False
+        ).returning(LowStockAlert.product_id)
+    )).all()
+    return list(crossed)
+
+async def mark_restocked(db: AsyncSession, product_ids: List[int]):
+    """Re-arm products whose stock is back above their threshold"""
+    if not product_ids:
+        return
+    await db.execute(
+        update(LowStockAlert).where(
+            LowStockAlert.product_id.in_(product_ids),
+            LowStockAlert.low == True
+        ).values(low=False).execution_options(synchronize_session=False)
+    )
+
+async def send_low_stock_alerts(db: AsyncSession, business_id: int) -> Dict[str, int]:
+    """Alert the business's admins and managers about its pending crossings.
+
+    Products restocked since crossing are dropped, and products alerted
+    within the window are folded into that alert; the rest go out to every
+    staff member in one bulk insert. Returns counts of each.
+    """
+    now = datetime.utcnow()
+    rows = (await db.execute(
+        select(
+            LowStockAlert.product_id,
+            LowStockAlert.notified_at,
+            Product.name,
+            Product.stock,
+            Product.low_stock_threshold
+        ).join(Product, Product.id == LowStockAlert.product_id).where(
+            LowStockAlert.business_id == business_id,
+            LowStockAlert.pending == True
+        ).order_by(Product.name).with_for_update(of=LowStockAlert)
+    )).all()
+
+    window_start = now - timedelta(seconds=LOW_STOCK_ALERT_WINDOW_SECONDS)
+    alerted, coalesced, restocked = [], [], []
+    for row in rows:
+        if row.stock > row.low_stock_threshold:
+            restocked.append(row)
+        elif row.notified_at is not None and row.notified_at > window_start:
+            coalesced.append(row)
+        else:
+            alerted.append(row)
+
+    await notify_staff(db, {business_id: [
+        {
+            "type": NotificationType.LOW_STOCK,
+            "title": "Low Stock Alert",
+            "message": f"{row.name} is running low ({row.stock} units remaining)",
+            "priority": NotificationPriority.HIGH if row.stock == 0 else NotificationPriority.MEDIUM
+        } for row in alerted
+    ]})
+
+    if alerted:
+        await db.execute(
+            update(LowStockAlert).where(
+                LowStockAlert.product_id.in_([row.product_id for row in alerted])
+            ).values(pending=False, notified_at=now, coalesced=0).execution_options(synchronize_session=False)
+        )
+    if coalesced:
+        await db.execute(
+            update(LowStockAlert).where(
+                LowStockAlert.product_id.in_([row.product_id for row in coalesced])
+            ).values(
+                pending=False, coalesced=LowStockAlert.coalesced + 1
+            ).execution_options(synchronize_session=False)
+        )
+    if restocked:
+        await db.execute(
+            update(LowStockAlert).where(
+                LowStockAlert.product_id.in_([row.product_id for row in restocked])
+            ).values(pending=False).execution_options(synchronize_session=False)
+        )
+
+    return {"alerted": len(alerted), "coalesced": len(coalesced), "restocked": len(restocked)}
@@ -1,60 +1,174 @@
-import requests
+import httpx
+import asyncio
 import base64
+import time
 from datetime import datetime
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+
 load_dotenv()
 
+# Daraja host; point at the sandbox, production or a local stand-in
+MPESA_BASE_URL = os.getenv("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
+
+# Timeouts and connection pool for calls to Daraja
+MPESA_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MPESA_CONNECT_TIMEOUT_SECONDS", "5"))
+MPESA_READ_TIMEOUT_SECONDS = float(os.getenv("MPESA_READ_TIMEOUT_SECONDS", "30"))
+MPESA_MAX_CONNECTIONS = int(os.getenv("MPESA_MAX_CONNECTIONS", "20"))
+
+# Refresh the access token this long before Daraja says it expires
+MPESA_TOKEN_EXPIRY_MARGIN_SECONDS = int(os.getenv("MPESA_TOKEN_EXPIRY_MARGIN_SECONDS", "60"))
+
+class MpesaAPIError(Exception):
+    """Daraja answered with an HTTP error; keeps the status and Daraja's errorCode"""
+
+    def __init__(self, response: httpx.Response):
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        self.status_code = response.status_code
+        self.error_code = body.get("errorCode")
+        super().__init__(f"{response.status_code} {body.get('errorMessage') or response.reason_phrase}")
+
+def _is_daraja_failure(error: Exception) -> bool:
+    """Rejected requests (4xx other than 429) say nothing about Daraja's health"""
+    if isinstance(error, MpesaAPIError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
 class MpesaService:
-    def __init__(self):
+    def __init__(self, base_url: Optional[str] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
         self.consumer_key = os.getenv("MPESA_CONSUMER_KEY")
         self.consumer_secret = os.getenv("MPESA_CONSUMER_SECRET")
         self.business_short_code = os.getenv("MPESA_BUSINESS_SHORT_CODE", "174379")
         self.passkey = os.getenv("MPESA_PASSKEY")
         self.callback_url = os.getenv("MPESA_CALLBACK_URL", "https://your-domain.com/api/payments/mpesa/callback")
-        
-        # Sandbox URLs (change to production URLs for live)
-        self.auth_url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-        self.stk_push_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-        self.query_url = "https://sandbox.safaricom.co.ke/mpesa/stkpushquery/v1/query"
-    
+
+        self.base_url = (base_url or MPESA_BASE_URL).rstrip("/")
+        self.auth_url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
+        self.stk_push_url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
+        self.query_url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
+
+        # One pooled client per service, created on first use inside the event loop
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # One circuit per Daraja endpoint, so a failing query API doesn't stop STK pushes
+        self.breakers = {
+            name: CircuitBreaker(f"mpesa.{name}", is_failure=_is_daraja_failure)
+            for name in ("auth", "stkpush", "query")
+        }
+
+        # Cached access token, shared by every request until shortly before it expires
+        self._access_token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_refresh: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(MPESA_READ_TIMEOUT_SECONDS, connect=MPESA_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=MPESA_MAX_CONNECTIONS,
+                    max_keepalive_connections=MPESA_MAX_CONNECTIONS
+                ),
+                transport=self._transport
+            )
+        return self._client
+
+    async def aclose(self):
+        """Close the connection pool (on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _fetch_access_token(self):
+        # Create basic auth header
+        auth_string = f"{self.consumer_key}:{self.consumer_secret}"
+        auth_bytes = auth_string.encode('ascii')
+        auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
+
+        headers = {
+            "Authorization": f"Basic {auth_b64}",
+            "Content-Type": "application/json"
+        }
+
+        async with self.breakers["auth"].guard():
+            response = await self.client.get(self.auth_url, headers=headers)
+            if response.is_error:
+                raise MpesaAPIError(response)
+
+        data = response.json()
+        self._access_token = data["access_token"]
+        self._token_expires_at = time.monotonic() + int(data.get("expires_in", 3599)) - MPESA_TOKEN_EXPIRY_MARGIN_SECONDS
+        return self._access_token
+
     async def get_access_token(self):
-        """Get M-Pesa access token"""
+        """Get M-Pesa access token, cached until shortly before it expires"""
+        if self._access_token and time.monotonic() < self._token_expires_at:
+            return self._access_token
+
         try:
-            # Create basic auth header
-            auth_string = f"{self.consumer_key}:{self.consumer_secret}"
-            auth_bytes = auth_string.encode('ascii')
-            auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
-            
+            # Concurrent callers wait on the same in-flight token request
+            if self._token_refresh is None or self._token_refresh.done():
+                self._token_refresh = asyncio.ensure_future(self._fetch_access_token())
+            return await asyncio.shield(self._token_refresh)
+
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"Failed to get M-Pesa access token: {str(e)}")
+
+    def invalidate_access_token(self):
+        """Drop the cached token, e.g. after Daraja rejects it"""
+        self._access_token = None
+        self._token_expires_at = 0.0
+
+    def unavailable_for(self, *endpoints: str) -> float:
+        """Seconds until all the given endpoints' circuits let calls through; 0 if they do now"""
+        return max(self.breakers[name].retry_after() for name in endpoints)
+
+    def breaker_states(self) -> dict:
+        return {name: breaker.snapshot() for name, breaker in self.breakers.items()}
+
+    async def _post(self, endpoint: str, url: str, payload: dict):
+        """POST to Daraja with the cached token, retrying once if it was revoked early"""
+        for attempt in range(2):
+            access_token = await self.get_access_token()
             headers = {
-                "Authorization": f"Basic {auth_b64}",
+                "Authorization": f"Bearer {access_token}",
                 "Content-Type": "application/json"
             }
-            
-            response = requests.get(self.auth_url, headers=headers)
-            response.raise_for_status()
-            
-            return response.json()["access_token"]
-            
-        except Exception as e:
-            raise Exception(f"Failed to get M-Pesa access token: {str(e)}")
-    
+
+            async with self.breakers[endpoint].guard():
+                response = await self.client.post(url, json=payload, headers=headers)
+                if response.status_code == 401 and attempt == 0:
+                    self.invalidate_access_token()
+                    continue
+
+                if response.is_error:
+                    raise MpesaAPIError(response)
+                return response.json()
+
     def generate_password(self):
         """Generate M-Pesa password"""
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         password_string = f"{self.business_short_code}{self.passkey}{timestamp}"
         password_bytes = password_string.encode('ascii')
         password_b64 = base64.b64encode(password_bytes).decode('ascii')
-        
+
         return password_b64, timestamp
-    
+
     async def stk_push(self, phone_number: str, amount: float, account_reference: str, transaction_desc: str):
         """Initiate STK Push payment"""
         try:
-            access_token = await self.get_access_token()
             password, timestamp = self.generate_password()
-            
+
             # Format phone number
             if phone_number.startswith("0"):
                 phone_number = "254" + phone_number[1:]
@@ -62,12 +176,7 @@ class MpesaService:
                 phone_number = phone_number[1:]
             elif not phone_number.startswith("254"):
                 phone_number = "254" + phone_number
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-            
+
             payload = {
                 "BusinessShortCode": self.business_short_code,
                 "Password": password,
@@ -81,37 +190,31 @@ class MpesaService:
                 "AccountReference": account_reference,
                 "TransactionDesc": transaction_desc
             }
-            
-            response = requests.post(self.stk_push_url, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            return response.json()
-            
+
+            return await self._post("stkpush", self.stk_push_url, payload)
+
+        except (MpesaAPIError, CircuitOpenError):
+            raise
         except Exception as e:
             raise Exception(f"STK Push failed: {str(e)}")
-    
+
     async def query_transaction(self, checkout_request_id: str):
         """Query STK Push transaction status"""
         try:
-            access_token = await self.get_access_token()
             password, timestamp = self.generate_password()
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-            
+
             payload = {
                 "BusinessShortCode": self.business_short_code,
                 "Password": password,
                 "Timestamp": timestamp,
                 "CheckoutRequestID": checkout_request_id
             }
-            
-            response = requests.post(self.query_url, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            return response.json()
-            
+
+            return await self._post("query", self.query_url, payload)
+
+        except (MpesaAPIError, CircuitOpenError):
+            raise
         except Exception as e:
             raise Exception(f"Transaction query failed: {str(e)}")
+
+mpesa_service = MpesaService()
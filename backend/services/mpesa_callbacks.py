@@ -0,0 +1,252 @@
+import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, update, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from models import (
+    Customer,
+    MpesaCallbackInbox,
+    NotificationPriority,
+    NotificationType,
+    Payment,
+    PaymentStatus
+)
+from services.cache import invalidate_after_commit
+from services.customers import record_purchases
+from services.notifications import notify_staff
+from services.rollup import record_completed_payments
+
+load_dotenv()
+
+# Callbacks applied per batch
+MPESA_CALLBACK_BATCH_SIZE = int(os.getenv("MPESA_CALLBACK_BATCH_SIZE", "500"))
+
+# A callback can arrive before the STK push job has committed its
+# CheckoutRequestID; unmatched callbacks are matched again for this long
+MPESA_CALLBACK_MATCH_GRACE_SECONDS = int(os.getenv("MPESA_CALLBACK_MATCH_GRACE_SECONDS", "600"))
+
+@dataclass(frozen=True)
+class StkResult:
+    checkout_request_id: str
+    result_code: int
+    receipt: Optional[str] = None
+
+def parse_stk_callback(payload: str) -> Optional[StkResult]:
+    """The outcome of an STK push callback, or None if it isn't one"""
+    callback = json.loads(payload).get("Body", {}).get("stkCallback", {})
+    checkout_request_id = callback.get("CheckoutRequestID")
+    if not checkout_request_id:
+        return None
+
+    receipt = None
+    for item in callback.get("CallbackMetadata", {}).get("Item", []):
+        if item.get("Name") == "MpesaReceiptNumber":
+            receipt = item.get("Value")
+
+    return StkResult(
+        checkout_request_id=checkout_request_id,
+        result_code=int(callback.get("ResultCode", -1)),
+        receipt=receipt
+    )
+
+async def notify_payment_outcomes(db: AsyncSession, completed: list, failed: list):
+    """Tell each business's staff which M-Pesa payments went through or failed"""
+    if not completed and not failed:
+        return
+    customer_ids = {payment.customer_id for payment in completed} | {payment.customer_id for payment in failed}
+    names = dict((await db.execute(
+        select(Customer.id, Customer.name).where(Customer.id.in_(customer_ids))
+    )).all())
+
+    notifications = defaultdict(list)
+    for payment in completed:
+        notifications[payment.business_id].append({
+            "type": NotificationType.PAYMENT,
+            "title": "Payment Received",
+            "message": f"M-Pesa payment of KSh {payment.amount:,.0f} received from {names.get(payment.customer_id, 'a customer')}",
+            "priority": NotificationPriority.MEDIUM
+        })
+    for payment in failed:
+        notifications[payment.business_id].append({
+            "type": NotificationType.PAYMENT,
+            "title": "Payment Failed",
+            "message": f"M-Pesa payment of KSh {payment.amount:,.0f} from {names.get(payment.customer_id, 'a customer')} did not go through",
+            "priority": NotificationPriority.HIGH
+        })
+    await notify_staff(db, notifications)
+
+async def settle_payments(
+    db: AsyncSession,
+    receipts: Dict[int, Optional[str]],
+    failures: List[int],
+    settled_at: datetime
+) -> Tuple[Set[int], Set[int]]:
+    """Complete (with their receipts) and fail pending payments in bulk.
+
+    Only pending payments change, so concurrent callbacks and reconciliation
+    sweeps settle each payment once; returns the ids completed and failed
+    by this call. Customer totals and rollups follow the completions, and
+    the business's staff are notified of each outcome.
+    """
+    completed = []
+    if receipts:
+        completed = (await db.execute(
+            update(Payment).where(
+                Payment.id.in_(receipts.keys()),
+                Payment.status == PaymentStatus.PENDING
+            ).values(
+                status=PaymentStatus.COMPLETED,
+                mpesa_receipt_number=case(receipts, value=Payment.id)
+            ).returning(
+                Payment.id, Payment.business_id, Payment.customer_id, Payment.amount, Payment.method, Payment.created_at
+            ).execution_options(synchronize_session=False)
+        )).all()
+
+        # Payments completed without a receipt (by a status query) get it from a later callback
+        known = {payment_id: receipt for payment_id, receipt in receipts.items() if receipt}
+        if known:
+            await db.execute(
+                update(Payment).where(
+                    Payment.id.in_(known.keys()),
+                    Payment.status == PaymentStatus.COMPLETED,
+                    Payment.mpesa_receipt_number.is_(None)
+                ).values(
+                    mpesa_receipt_number=case(known, value=Payment.id)
+                ).execution_options(synchronize_session=False)
+            )
+
+    failed = []
+    if failures:
+        failed = (await db.execute(
+            update(Payment).where(
+                Payment.id.in_(failures),
+                Payment.status == PaymentStatus.PENDING
+            ).values(
+                status=PaymentStatus.FAILED
+            ).returning(
+                Payment.id, Payment.business_id, Payment.customer_id, Payment.amount
+            ).execution_options(synchronize_session=False)
+        )).all()
+
+    spent = defaultdict(float)
+    for payment in completed:
+        spent[payment.customer_id] += payment.amount
+    await record_purchases(db, spent, {customer_id: settled_at for customer_id in spent})
+    await record_completed_payments(db, completed)
+    await notify_payment_outcomes(db, completed, failed)
+    for business_id in {payment.business_id for payment in completed + failed}:
+        invalidate_after_commit(db, business_id)
+
+    return {payment.id for payment in completed}, {payment.id for payment in failed}
+
+async def apply_callback_batch(db: AsyncSession, limit: int = MPESA_CALLBACK_BATCH_SIZE) -> int:
+    """Apply up to `limit` unprocessed callbacks from the inbox; returns how many were taken.
+
+    Repeated callbacks for the same CheckoutRequestID are applied once, a
+    success winning over failures. Payments only move out of pending, so a
+    callback arriving again in a later batch is recorded as a duplicate.
+    Unmatched callbacks whose payment has since appeared are taken again,
+    within MPESA_CALLBACK_MATCH_GRACE_SECONDS. Completed payments, customer
+    totals and rollups are written with a fixed number of statements per
+    batch. Runs in the caller's transaction.
+    """
+    now = datetime.utcnow()
+    await db.execute(
+        update(MpesaCallbackInbox).where(
+            MpesaCallbackInbox.processed_at >= now - timedelta(seconds=MPESA_CALLBACK_MATCH_GRACE_SECONDS),
+            MpesaCallbackInbox.outcome == "unmatched",
+            select(Payment.id).where(
+                Payment.checkout_request_id == MpesaCallbackInbox.checkout_request_id
+            ).exists()
+        ).values(
+            processed_at=None,
+            outcome=None
+        ).execution_options(synchronize_session=False)
+    )
+
+    # Claim the batch with a write, so concurrent appliers never share rows
+    pending = select(MpesaCallbackInbox.id).where(
+        MpesaCallbackInbox.processed_at.is_(None)
+    ).order_by(MpesaCallbackInbox.id).limit(limit).with_for_update(skip_locked=True)
+    rows = (await db.execute(
+        update(MpesaCallbackInbox).where(
+            MpesaCallbackInbox.id.in_(pending.scalar_subquery())
+        ).values(
+            processed_at=now
+        ).returning(
+            MpesaCallbackInbox.id, MpesaCallbackInbox.payload
+        ).execution_options(synchronize_session=False)
+    )).all()
+    if not rows:
+        return 0
+    rows = sorted(rows, key=lambda row: row.id)
+
+    outcomes = {}
+    checkout_ids = {}
+    chosen = {}  # CheckoutRequestID -> (inbox id, result)
+    for row in rows:
+        try:
+            result = parse_stk_callback(row.payload)
+        except (ValueError, TypeError, AttributeError):
+            result = None
+        if result is None:
+            outcomes[row.id] = "invalid"
+            continue
+
+        checkout_ids[row.id] = result.checkout_request_id
+        current = chosen.get(result.checkout_request_id)
+        if current is None or (current[1].result_code != 0 and result.result_code == 0):
+            if current is not None:
+                outcomes[current[0]] = "duplicate"
+            chosen[result.checkout_request_id] = (row.id, result)
+        else:
+            outcomes[row.id] = "duplicate"
+
+    payments = {
+        payment.checkout_request_id: payment.id
+        for payment in (await db.execute(
+            select(Payment.id, Payment.checkout_request_id).where(
+                Payment.checkout_request_id.in_(chosen.keys())
+            )
+        )).all()
+    } if chosen else {}
+
+    receipts = {}
+    failures = []
+    inbox_ids = {}
+    for checkout_request_id, (inbox_id, result) in chosen.items():
+        payment_id = payments.get(checkout_request_id)
+        if payment_id is None:
+            outcomes[inbox_id] = "unmatched"
+            continue
+        inbox_ids[payment_id] = inbox_id
+        if result.result_code == 0:
+            receipts[payment_id] = result.receipt
+        else:
+            failures.append(payment_id)
+
+    completed, failed = await settle_payments(db, receipts, failures, now)
+    for payment_id, inbox_id in inbox_ids.items():
+        if payment_id in completed:
+            outcomes[inbox_id] = "completed"
+        elif payment_id in failed:
+            outcomes[inbox_id] = "failed"
+        else:
+            outcomes[inbox_id] = "duplicate"
+
+    values = {"outcome": case(outcomes, value=MpesaCallbackInbox.id)}
+    if checkout_ids:
+        values["checkout_request_id"] = case(checkout_ids, value=MpesaCallbackInbox.id)
+    await db.execute(
+        update(MpesaCallbackInbox).where(
+            MpesaCallbackInbox.id.in_([row.id for row in rows])
+        ).values(**values).execution_options(synchronize_session=False)
+    )
+
+    return len(rows)
@@ -0,0 +1,287 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select, insert, update, case, func, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import session_scope
+from models import Notification, NotificationCounter, User, UserRole, UserStatus
+from schemas import Notification as NotificationSchema
+
+load_dotenv()
+
+# Events buffered per open stream; a stream that falls further behind is told to resync
+NOTIFICATION_STREAM_QUEUE_SIZE = int(os.getenv("NOTIFICATION_STREAM_QUEUE_SIZE", "100"))
+
+# Comment lines keep idle streams open through proxies
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = float(os.getenv("NOTIFICATION_STREAM_HEARTBEAT_SECONDS", "15"))
+
+# How often each API process picks up notifications created by other processes
+# (e.g. worker.py), for the users it has streams open for
+NOTIFICATION_RELAY_INTERVAL_SECONDS = float(os.getenv("NOTIFICATION_RELAY_INTERVAL_SECONDS", "2"))
+
+# The relay re-reads recent rows below the newest id it has seen, so rows from
+# transactions that committed out of id order are not missed
+RELAY_LOOKBACK_IDS = 1000
+RELAY_LOOKBACK_SECONDS = 60
+
+# Unread counters checked per batch by the repair job
+COUNTER_REPAIR_BATCH_SIZE = 500
+
+class NotificationStream:
+    """One open stream: its queue of events, and the snapshot it started from"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=NOTIFICATION_STREAM_QUEUE_SIZE)
+        self.since_id = 0
+
+    async def snapshot(self) -> dict:
+        """The user's unread count; notifications it already includes won't be sent as new"""
+        async with session_scope() as db:
+            # Read the newest id first: anything created after it can't be in the count
+            newest = await db.scalar(select(func.max(Notification.id)))
+            unread_count = await count_unread(db, self.user_id)
+            await db.commit()
+        self.since_id = newest or 0
+        return {"unread_count": unread_count}
+
+    async def next_event(self, timeout: Optional[float] = None) -> tuple:
+        """The next (event name, data); a stream that fell behind gets a fresh unread count instead"""
+        while True:
+            event_name, data = await asyncio.wait_for(self.queue.get(), timeout)
+            if event_name == "resync":
+                return "unread_count", await self.snapshot()
+            if event_name == "notification" and data["notification"]["id"] <= self.since_id:
+                continue
+            return event_name, data
+
+class NotificationHub:
+    """In-process pub/sub: each open stream gets the events for its user.
+
+    publish() is safe from any thread (sessions run in the threadpool unless
+    DATABASE_ASYNC is set). A relay task polls for notifications created in
+    other processes, once per interval for all open streams together, and
+    publishes those too; ids already published here are skipped.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Dict[int, Set[NotificationStream]] = defaultdict(set)
+        self._published: "OrderedDict[int, None]" = OrderedDict()
+        self._last_seen_id = 0
+        self._relay: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        async with session_scope() as db:
+            self._last_seen_id = await db.scalar(select(func.max(Notification.id))) or 0
+        self._relay = asyncio.create_task(self._relay_loop())
+
+    async def stop(self):
+        if self._relay:
+            self._relay.cancel()
+            self._relay = None
+        self.loop = None
+
+    def subscribe(self, user_id: int) -> NotificationStream:
+        stream = NotificationStream(user_id)
+        self._subscribers[user_id].add(stream)
+        return stream
+
+    def unsubscribe(self, stream: NotificationStream):
+        streams = self._subscribers.get(stream.user_id)
+        if streams is not None:
+            streams.discard(stream)
+            if not streams:
+                del self._subscribers[stream.user_id]
+
+    def publish(self, user_id: int, event_name: str, data: dict):
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._deliver, user_id, event_name, data)
+
+    def _deliver(self, user_id: int, event_name: str, data: dict):
+        notification_id = data.get("notification", {}).get("id")
+        if notification_id is not None:
+            if notification_id in self._published:
+                return
+            self._published[notification_id] = None
+            while len(self._published) > RELAY_LOOKBACK_IDS * 10:
+                self._published.popitem(last=False)
+
+        for stream in self._subscribers.get(user_id, ()):
+            try:
+                stream.queue.put_nowait((event_name, data))
+            except asyncio.QueueFull:
+                # Too far behind to catch up event by event
+                while not stream.queue.empty():
+                    stream.queue.get_nowait()
+                stream.queue.put_nowait(("resync", {}))
+
+    async def _relay_loop(self):
+        while True:
+            await asyncio.sleep(NOTIFICATION_RELAY_INTERVAL_SECONDS)
+            if not self._subscribers:
+                continue
+            try:
+                async with session_scope() as db:
+                    notifications = (await db.scalars(
+                        select(Notification).where(
+                            Notification.id > self._last_seen_id - RELAY_LOOKBACK_IDS,
+                            Notification.created_at >= datetime.utcnow() - timedelta(seconds=RELAY_LOOKBACK_SECONDS),
+                            Notification.user_id.in_(list(self._subscribers))
+                        ).order_by(Notification.id)
+                    )).all()
+                    newest = await db.scalar(select(func.max(Notification.id))) or 0
+            except Exception as e:
+                print(f"❌ Notification relay failed: {e}")
+                continue
+
+            self._last_seen_id = max(self._last_seen_id, newest)
+            for notification in notifications:
+                if notification.id not in self._published and not notification.read:
+                    self._deliver(notification.user_id, *created_event(notification))
+
+hub = NotificationHub()
+
+def created_event(notification) -> tuple:
+    return "notification", {
+        "notification": NotificationSchema.model_validate(notification).model_dump(mode="json"),
+        "unread_delta": 0 if notification.read else 1
+    }
+
+def publish_after_commit(db: AsyncSession, user_id: int, event_name: str, data: dict):
+    """Push an event to the user's open streams once the caller's transaction commits"""
+    db.info.setdefault("notification_events", []).append((user_id, event_name, data))
+
+async def create_notifications(db: AsyncSession, rows: List[dict]) -> List[Notification]:
+    """Insert notifications in one statement; they are pushed to open streams on commit"""
+    if not rows:
+        return []
+    notifications = (await db.scalars(insert(Notification).returning(Notification), rows)).all()
+    await adjust_unread(db, Counter(
+        notification.user_id for notification in notifications if not notification.read
+    ))
+    for notification in notifications:
+        publish_after_commit(db, notification.user_id, *created_event(notification))
+    return notifications
+
+async def notify_staff(db: AsyncSession, notifications: Dict[int, List[dict]]) -> List[Notification]:
+    """Send each business's notifications to its active admins and managers.
+
+    notifications maps business id to the notification fields (without
+    user_id); every staff member gets a copy of each.
+    """
+    business_ids = [business_id for business_id, fields in notifications.items() if fields]
+    if not business_ids:
+        return []
+    staff = (await db.execute(
+        select(User.id, User.business_id).where(
+            User.business_id.in_(business_ids),
+            User.role.in_([UserRole.ADMIN, UserRole.MANAGER]),
+            User.status == UserStatus.ACTIVE
+        )
+    )).all()
+
+    return await create_notifications(db, [
+        {**fields, "user_id": user_id}
+        for user_id, business_id in staff
+        for fields in notifications[business_id]
+    ])
+
+async def adjust_unread(db: AsyncSession, deltas: Dict[int, int]):
+    """Apply unread count changes in the caller's transaction.
+
+    Only users that already have a counter row are touched; count_unread
+    creates the row from a full count the first time it is asked.
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    await db.execute(
+        update(NotificationCounter).where(
+            NotificationCounter.user_id.in_(list(deltas))
+        ).values(
+            unread_count=NotificationCounter.unread_count + case(deltas, value=NotificationCounter.user_id),
+            updated_at=func.now()
+        ).execution_options(synchronize_session=False)
+    )
+
+async def count_unread(db: AsyncSession, user_id: int) -> int:
+    """The user's unread count, read from their counter"""
+    count = await db.scalar(
+        select(NotificationCounter.unread_count).where(NotificationCounter.user_id == user_id)
+    )
+    if count is not None:
+        return count
+
+    count = await db.scalar(
+        select(func.count()).select_from(Notification).where(
+            Notification.user_id == user_id,
+            Notification.read == False
+        )
+    )
+    insert_stmt = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    await db.execute(
+        insert_stmt(NotificationCounter).values(
+            user_id=user_id, unread_count=count
+        ).on_conflict_do_nothing(index_elements=[NotificationCounter.user_id])
+    )
+    return count
+
+async def repair_unread_counters(db: AsyncSession) -> int:
+    """Recount unread notifications and correct counters that drifted; returns how many were fixed"""
+    fixed = 0
+    after = 0
+    while True:
+        # Holding the counter rows keeps writers from moving them mid-recount
+        counters = dict((await db.execute(
+            select(NotificationCounter.user_id, NotificationCounter.unread_count).where(
+                NotificationCounter.user_id > after
+            ).order_by(NotificationCounter.user_id).limit(COUNTER_REPAIR_BATCH_SIZE).with_for_update()
+        )).all())
+        if not counters:
+            break
+
+        actual = dict((await db.execute(
+            select(Notification.user_id, func.count()).where(
+                Notification.user_id.in_(list(counters)),
+                Notification.read == False
+            ).group_by(Notification.user_id)
+        )).all())
+        wrong = {
+            user_id: actual.get(user_id, 0)
+            for user_id, count in counters.items() if count != actual.get(user_id, 0)
+        }
+        if wrong:
+            await db.execute(
+                update(NotificationCounter).where(
+                    NotificationCounter.user_id.in_(list(wrong))
+                ).values(
+                    unread_count=case(wrong, value=NotificationCounter.user_id),
+                    updated_at=func.now()
+                ).execution_options(synchronize_session=False)
+            )
+        await db.commit()
+
+        fixed += len(wrong)
+        after = max(counters)
+        if len(counters) < COUNTER_REPAIR_BATCH_SIZE:
+            break
+    return fixed
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    for user_id, event_name, data in session.info.pop("notification_events", ()):
+        hub.publish(user_id, event_name, data)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_uncommitted(session):
+    session.info.pop("notification_events", None)
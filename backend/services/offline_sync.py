@@ -0,0 +1,247 @@
+import json
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Payment, PaymentItem, PaymentStatus, PaymentMethod, Customer, Product
+from schemas import OfflineSale, OfflineSaleResult
+from services.inventory import deduct_stock, InsufficientStockError
+from services.idempotency import idempotency_store, request_fingerprint, StoredResponse, MAX_KEY_LENGTH
+from services.rollup import record_completed_payments
+from services.customers import record_purchases
+
+MAX_SYNC_SALES = 500
+
+# Stock moved between the snapshot and the update; re-validate on a fresh snapshot
+MAX_SNAPSHOT_ATTEMPTS = 3
+
+def _idempotency_key(client_reference: str) -> str:
+    # Separate namespace from the Idempotency-Key header of POST /api/payments
+    return f"sync:{client_reference}"
+
+def _recorded_at(sale: OfflineSale, now: datetime) -> datetime:
+    """When the sale happened, as naive UTC, never in the future"""
+    if sale.recorded_at is None:
+        return now
+    recorded_at = sale.recorded_at
+    if recorded_at.tzinfo is not None:
+        recorded_at = recorded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(recorded_at, now)
+
+async def sync_offline_sales(
+    db: AsyncSession,
+    business_id: int,
+    sales: List[OfflineSale]
+) -> Tuple[List[OfflineSaleResult], Dict[int, int], Dict[int, Product], List[StoredResponse]]:
+    """Record a batch of sales rung up while a till was offline.
+
+    Sales are validated in order against one snapshot of the customers and
+    products they reference, so earlier sales in the batch use up stock for
+    later ones. Accepted sales are written as completed payments with
+    set-based statements: the query count doesn't grow with the batch.
+
+    Each sale's client_reference is stored as an idempotency key in the same
+    transaction, so re-sending a batch reports duplicates instead of
+    recording sales twice. Runs in the caller's transaction; the caller
+    commits and then remembers the returned stored responses.
+
+    Returns the per-sale results in request order, the new stock of every
+    product that changed, the product snapshot, and the stored responses.
+    """
+    results: Dict[int, OfflineSaleResult] = {}
+    fingerprints = {}
+    seen = set()
+
+    for index, sale in enumerate(sales):
+        reference = sale.client_reference
+        if not reference or len(_idempotency_key(reference)) > MAX_KEY_LENGTH:
+            results[index] = OfflineSaleResult(
+                client_reference=reference,
+                status="rejected",
+                detail="client_reference is missing or too long"
+            )
+        elif reference in seen:
+            results[index] = OfflineSaleResult(
+                client_reference=reference,
+                status="duplicate",
+                detail="Repeated within this batch"
+            )
+        else:
+            seen.add(reference)
+            fingerprints[index] = request_fingerprint(sale.model_dump(mode="json"))
+
+    # Sales this business already synced
+    stored = await idempotency_store.lookup_many(
+        db, business_id, [_idempotency_key(sales[index].client_reference) for index in fingerprints]
+    )
+    pending = []
+    for index, fingerprint in fingerprints.items():
+        key = _idempotency_key(sales[index].client_reference)
+        if key not in stored:
+            pending.append(index)
+        elif stored[key] is None:
+            results[index] = OfflineSaleResult(
+                client_reference=sales[index].client_reference,
+                status="rejected",
+                detail="Still being processed by another sync"
+            )
+        elif stored[key].fingerprint != fingerprint:
+            results[index] = OfflineSaleResult(
+                client_reference=sales[index].client_reference,
+                status="rejected",
+                detail="client_reference was already used for a different sale"
+            )
+        else:
+            results[index] = OfflineSaleResult(
+                client_reference=sales[index].client_reference,
+                status="duplicate",
+                payment_id=json.loads(stored[key].body)["payment_id"]
+            )
+
+    customer_ids = {sales[index].customer_id for index in pending}
+    product_ids = {item.product_id for index in pending for item in sales[index].items}
+
+    customers = set((await db.scalars(
+        select(Customer.id).where(
+            Customer.id.in_(customer_ids),
+            Customer.business_id == business_id
+        )
+    )).all()) if customer_ids else set()
+
+    for attempt in range(MAX_SNAPSHOT_ATTEMPTS):
+        products = {
+            product.id: product
+            for product in (await db.scalars(
+                select(Product).where(
+                    Product.id.in_(product_ids),
+                    Product.business_id == business_id
+                ).execution_options(populate_existing=True)
+            )).all()
+        } if product_ids else {}
+
+        # Validate in order against the snapshot
+        available = {product_id: product.stock for product_id, product in products.items()}
+        accepted = []
+        rejected = {}
+        for index in pending:
+            sale = sales[index]
+            basket = defaultdict(int)
+            for item in sale.items:
+                basket[item.product_id] += item.quantity
+
+            if sale.customer_id not in customers:
+                rejected[index] = "Customer not found"
+            elif any(item.quantity <= 0 for item in sale.items):
+                rejected[index] = "Item quantities must be positive"
+            elif any(product_id not in products for product_id in basket):
+                missing = next(product_id for product_id in basket if product_id not in products)
+                rejected[index] = f"Product with id {missing} not found"
+            elif any(available[product_id] < quantity for product_id, quantity in basket.items()):
+                short = [products[product_id].name for product_id, quantity in basket.items() if available[product_id] < quantity]
+                rejected[index] = f"Insufficient stock for {', '.join(short)}"
+            else:
+                for product_id, quantity in basket.items():
+                    available[product_id] -= quantity
+                accepted.append(index)
+
+        quantities = {
+            product_id: products[product_id].stock - stock
+            for product_id, stock in available.items()
+            if stock != products[product_id].stock
+        }
+        try:
+            new_stock = await deduct_stock(db, business_id, quantities, products)
+            break
+        except InsufficientStockError:
+            await db.rollback()
+            if attempt == MAX_SNAPSHOT_ATTEMPTS - 1:
+                raise
+
+    for index, detail in rejected.items():
+        results[index] = OfflineSaleResult(
+            client_reference=sales[index].client_reference,
+            status="rejected",
+            detail=detail
+        )
+
+    if not accepted:
+        return [results[index] for index in range(len(sales))], new_stock, products, []
+
+    now = datetime.utcnow()
+    transaction_ids = {index: str(uuid.uuid4()) for index in accepted}
+    payments = (await db.execute(
+        insert(Payment).returning(
+            Payment.id,
+            Payment.business_id,
+            Payment.customer_id,
+            Payment.amount,
+            Payment.method,
+            Payment.transaction_id,
+            Payment.created_at
+        ),
+        [
+            {
+                "customer_id": sales[index].customer_id,
+                "business_id": business_id,
+                "amount": sales[index].amount,
+                "status": PaymentStatus.COMPLETED,
+                "method": PaymentMethod(sales[index].method),
+                "transaction_id": transaction_ids[index],
+                "created_at": _recorded_at(sales[index], now)
+            } for index in accepted
+        ]
+    )).all()
+    # Match rows back by transaction id, which lets the insert go out in one statement
+    by_transaction = {payment.transaction_id: payment.id for payment in payments}
+    payment_ids = {index: by_transaction[transaction_ids[index]] for index in accepted}
+
+    items = [
+        {
+            "payment_id": payment_ids[index],
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+            "total_price": item.unit_price * item.quantity
+        } for index in accepted for item in sales[index].items
+    ]
+    if items:
+        await db.execute(insert(PaymentItem), items)
+
+    # Customer totals for the whole batch in one statement
+    spent = defaultdict(float)
+    last_purchase = {}
+    for index in accepted:
+        sale = sales[index]
+        spent[sale.customer_id] += sale.amount
+        recorded_at = _recorded_at(sale, now)
+        last_purchase[sale.customer_id] = max(last_purchase.get(sale.customer_id, recorded_at), recorded_at)
+
+    await record_purchases(db, spent, last_purchase)
+
+    await record_completed_payments(db, payments)
+
+    stored_responses = await idempotency_store.store_many(
+        db,
+        business_id,
+        [
+            (
+                _idempotency_key(sales[index].client_reference),
+                fingerprints[index],
+                200,
+                json.dumps({"payment_id": payment_ids[index]}, separators=(",", ":"))
+            ) for index in accepted
+        ]
+    )
+
+    for index in accepted:
+        results[index] = OfflineSaleResult(
+            client_reference=sales[index].client_reference,
+            status="created",
+            payment_id=payment_ids[index]
+        )
+
+    return [results[index] for index in range(len(sales))], new_stock, products, stored_responses
@@ -0,0 +1,67 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DateTime, Select, literal, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+class InvalidCursorError(ValueError):
+    """The cursor wasn't issued for this listing, or was tampered with"""
+
+class Keyset:
+    """Cursor pagination over a unique sort key, e.g. (created_at, id).
+
+    Each page seeks past the last row of the previous one with a row-value
+    comparison, which a composite index on the same columns (after the
+    equality filters) answers directly, so every page costs the same as
+    the first. Cursors are opaque base64 strings of the last row's key.
+    """
+
+    def __init__(self, name: str, *columns, descending: bool = False):
+        self.name = name
+        self.columns = columns
+        self.descending = descending
+
+    def encode(self, row) -> str:
+        values = [getattr(row, column.key) for column in self.columns]
+        payload = [self.name, [value.isoformat() if isinstance(value, datetime) else value for value in values]]
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+    def decode(self, cursor: str) -> list:
+        try:
+            name, values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if name != self.name or len(values) != len(self.columns):
+                raise InvalidCursorError(cursor)
+            return [
+                datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+                for column, value in zip(self.columns, values)
+            ]
+        except (ValueError, TypeError) as e:
+            raise InvalidCursorError(cursor) from e
+
+    def apply(self, query: Select, cursor: str, limit: int) -> Select:
+        """Order by the key and start after the cursor ("" for the first page); fetches one extra row"""
+        if cursor:
+            key = tuple_(*self.columns)
+            after = tuple_(*(
+                literal(value, column.type) for column, value in zip(self.columns, self.decode(cursor))
+            ))
+            query = query.where(key < after if self.descending else key > after)
+        return query.order_by(*(
+            column.desc() if self.descending else column.asc() for column in self.columns
+        )).limit(limit + 1)
+
+async def fetch_page(
+    db: AsyncSession,
+    query: Select,
+    keyset: Keyset,
+    cursor: str,
+    limit: int
+) -> Tuple[List, Optional[str]]:
+    """One page of query's rows, and the cursor for the next page (None on the last)"""
+    rows = (await db.scalars(keyset.apply(query, cursor, limit))).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, keyset.encode(rows[-1])
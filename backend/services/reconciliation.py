@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+import httpx
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from models import MpesaReconciliationRun, Payment, PaymentMethod, PaymentStatus
+from services.circuit_breaker import CircuitOpenError
+from services.mpesa import MpesaAPIError, MpesaService, mpesa_service
+from services.mpesa_callbacks import settle_payments
+from services.throttle import AdaptiveConcurrencyLimit, RateLimiter
+
+load_dotenv()
+
+# Payments pending this long without a callback are checked with Daraja,
+# and a payment still in progress is checked again after the recheck interval
+MPESA_RECONCILE_AFTER_SECONDS = int(os.getenv("MPESA_RECONCILE_AFTER_SECONDS", "120"))
+MPESA_RECONCILE_RECHECK_SECONDS = int(os.getenv("MPESA_RECONCILE_RECHECK_SECONDS", "300"))
+
+# Payments claimed per batch, and how long one sweep may keep claiming batches
+# (keep it below JOB_LOCK_TIMEOUT_SECONDS)
+MPESA_RECONCILE_BATCH_SIZE = int(os.getenv("MPESA_RECONCILE_BATCH_SIZE", "200"))
+MPESA_RECONCILE_SWEEP_SECONDS = int(os.getenv("MPESA_RECONCILE_SWEEP_SECONDS", "240"))
+
+# Status queries per second, and the ceiling for queries in flight (the
+# actual cap adapts below it, halving when Daraja pushes back)
+MPESA_QUERY_RATE_PER_SECOND = float(os.getenv("MPESA_QUERY_RATE_PER_SECOND", "10"))
+MPESA_QUERY_MAX_CONCURRENCY = int(os.getenv("MPESA_QUERY_MAX_CONCURRENCY", "16"))
+
+# Daraja's ways of saying the customer hasn't finished yet
+PROCESSING_ERROR_CODES = {"500.001.1001"}
+PROCESSING_RESULT_CODES = {"4999"}
+
+# Responses that mean Daraja is overloaded or rate limiting us
+OVERLOAD_STATUS_CODES = {429, 502, 503, 504}
+
+def pending_mpesa_payments(now: datetime):
+    """Filter for M-Pesa payments pending long enough to be reconciled"""
+    return (
+        Payment.status == PaymentStatus.PENDING,
+        Payment.method == PaymentMethod.MPESA,
+        Payment.checkout_request_id.isnot(None),
+        Payment.created_at < now - timedelta(seconds=MPESA_RECONCILE_AFTER_SECONDS)
+    )
+
+def _caused_by_transport_error(error: BaseException) -> bool:
+    while error is not None:
+        if isinstance(error, httpx.TransportError):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+class Reconciler:
+    """Resolves M-Pesa payments whose callback never arrived.
+
+    Each sweep claims batches of overdue pending payments (stamping
+    status_checked_at, so concurrent sweeps never share rows and a payment
+    is not asked about again before the recheck interval), queries Daraja
+    for them concurrently, and settles the outcomes with bulk updates. The
+    rate limiter and adaptive concurrency cap live as long as the process,
+    so what a sweep learns about Daraja's capacity carries to the next.
+    """
+
+    def __init__(self, service: Optional[MpesaService] = None):
+        self.service = service or mpesa_service
+        self.rate = RateLimiter(MPESA_QUERY_RATE_PER_SECOND)
+        self.concurrency = AdaptiveConcurrencyLimit(
+            initial=max(1, MPESA_QUERY_MAX_CONCURRENCY // 4),
+            maximum=MPESA_QUERY_MAX_CONCURRENCY
+        )
+
+    async def backlog(self, db: AsyncSession, business_id: Optional[int] = None):
+        """Number of overdue pending payments and when the oldest was created"""
+        query = select(func.count(Payment.id), func.min(Payment.created_at)).where(
+            *pending_mpesa_payments(datetime.utcnow())
+        )
+        if business_id is not None:
+            query = query.where(Payment.business_id == business_id)
+        return (await db.execute(query)).one()
+
+    async def _claim(self, db: AsyncSession, limit: int):
+        now = datetime.utcnow()
+        due = select(Payment.id).where(
+            *pending_mpesa_payments(now),
+            or_(
+                Payment.status_checked_at.is_(None),
+                Payment.status_checked_at < now - timedelta(seconds=MPESA_RECONCILE_RECHECK_SECONDS)
+            )
+        ).order_by(Payment.created_at, Payment.id).limit(limit).with_for_update(skip_locked=True)
+
+        rows = (await db.execute(
+            update(Payment).where(Payment.id.in_(due.scalar_subquery())).values(
+                status_checked_at=now
+            ).returning(
+                Payment.id, Payment.checkout_request_id
+            ).execution_options(synchronize_session=False)
+        )).all()
+        # Release the row locks before talking to Daraja
+        await db.commit()
+        return rows
+
+    async def _query(self, checkout_request_id: str) -> str:
+        """completed, failed, pending or error for one payment"""
+        token = await self.concurrency.acquire()
+        overloaded = False
+        try:
+            await self.rate.acquire()
+            response = await self.service.query_transaction(checkout_request_id)
+        except CircuitOpenError:
+            return "error"
+        except MpesaAPIError as e:
+            if e.error_code in PROCESSING_ERROR_CODES:
+                return "pending"
+            overloaded = e.status_code in OVERLOAD_STATUS_CODES
+            return "error"
+        except Exception as e:
+            # Timeouts and dropped connections count as overload too
+            overloaded = _caused_by_transport_error(e)
+            return "error"
+        finally:
+            await self.concurrency.release(token, overloaded)
+
+        result_code = str(response.get("ResultCode", ""))
+        if result_code == "0":
+            return "completed"
+        if result_code in PROCESSING_RESULT_CODES or result_code == "":
+            return "pending"
+        return "failed"
+
+    async def sweep(
+        self,
+        db: AsyncSession,
+        budget_seconds: float = MPESA_RECONCILE_SWEEP_SECONDS
+    ) -> Optional[MpesaReconciliationRun]:
+        """Reconcile overdue payments until none are left or the time budget is spent.
+
+        Records the sweep as a MpesaReconciliationRun, unless there was no backlog.
+        """
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+        backlog, _ = await self.backlog(db)
+        if not backlog:
+            return None
+        totals = Counter()
+
+        while time.monotonic() - started < budget_seconds:
+            # Leave the backlog for the next sweep while Daraja fails fast
+            if self.service.unavailable_for("auth", "query"):
+                break
+            payments = await self._claim(db, MPESA_RECONCILE_BATCH_SIZE)
+            if not payments:
+                break
+
+            outcomes = await asyncio.gather(*(
+                self._query(payment.checkout_request_id) for payment in payments
+            ))
+            results = dict(zip((payment.id for payment in payments), outcomes))
+
+            # Status queries don't return the receipt; a late callback fills it in
+            completed, failed = await settle_payments(
+                db,
+                {payment_id: None for payment_id, outcome in results.items() if outcome == "completed"},
+                [payment_id for payment_id, outcome in results.items() if outcome == "failed"],
+                datetime.utcnow()
+            )
+            await db.commit()
+
+            totals["queried"] += len(payments)
+            totals["completed"] += len(completed)
+            totals["failed"] += len(failed)
+            totals["still_pending"] += sum(1 for outcome in outcomes if outcome == "pending")
+            totals["errors"] += sum(1 for outcome in outcomes if outcome == "error")
+
+            if len(payments) < MPESA_RECONCILE_BATCH_SIZE:
+                break
+
+        run = MpesaReconciliationRun(
+            started_at=started_at,
+            duration_seconds=round(time.monotonic() - started, 3),
+            backlog=backlog,
+            concurrency_limit=round(self.concurrency.limit, 2),
+            **totals
+        )
+        db.add(run)
+        if totals["queried"]:
+            print(
+                f"🔄 M-Pesa reconciliation: {totals['queried']} of {backlog} queried in {run.duration_seconds}s, "
+                f"{totals['completed']} completed, {totals['failed']} failed, {totals['errors']} errors"
+            )
+        return run
+
+reconciler = Reconciler()
@@ -0,0 +1,98 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, delete, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from models import Notification, NotificationArchive, NotificationRetentionRun
+
+load_dotenv()
+
+# Read notifications older than this leave the live table; unread ones always stay
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "30"))
+
+# archive: move them to notification_archive; delete: drop them (anything
+# but "delete" archives, so a typo never discards history)
+NOTIFICATION_RETENTION_MODE = "delete" if os.getenv("NOTIFICATION_RETENTION_MODE", "archive").lower() == "delete" else "archive"
+
+# Rows moved per transaction, and how long one run may keep going
+# (keep it below JOB_LOCK_TIMEOUT_SECONDS)
+NOTIFICATION_RETENTION_BATCH_SIZE = int(os.getenv("NOTIFICATION_RETENTION_BATCH_SIZE", "1000"))
+NOTIFICATION_RETENTION_MAX_SECONDS = int(os.getenv("NOTIFICATION_RETENTION_MAX_SECONDS", "240"))
+
+async def _retire_batch(db: AsyncSession, cutoff: datetime, mode: str, limit: int) -> int:
+    """Archive or delete one batch of expired notifications and commit; returns the row count"""
+    ids = (await db.scalars(
+        select(Notification.id).where(
+            Notification.read == True,
+            Notification.created_at < cutoff
+        ).order_by(Notification.id).limit(limit).with_for_update(skip_locked=True)
+    )).all()
+    if not ids:
+        return 0
+
+    if mode != "delete":
+        await db.execute(
+            insert(NotificationArchive).from_select(
+                ["id", "user_id", "type", "title", "message", "priority", "created_at", "archived_at"],
+                select(
+                    Notification.id,
+                    Notification.user_id,
+                    Notification.type,
+                    Notification.title,
+                    Notification.message,
+                    Notification.priority,
+                    Notification.created_at,
+                    literal(datetime.utcnow())
+                ).where(Notification.id.in_(ids))
+            )
+        )
+    # Only read rows leave, so unread counters are unaffected
+    await db.execute(
+        delete(Notification).where(Notification.id.in_(ids)).execution_options(synchronize_session=False)
+    )
+    # Short transactions: the row locks are released after every batch
+    await db.commit()
+    return len(ids)
+
+async def apply_notification_retention(
+    db: AsyncSession,
+    retention_days: int = NOTIFICATION_RETENTION_DAYS,
+    mode: str = NOTIFICATION_RETENTION_MODE,
+    budget_seconds: float = NOTIFICATION_RETENTION_MAX_SECONDS
+) -> NotificationRetentionRun:
+    """Retire read notifications past the retention period, batch by batch, until done or out of time"""
+    started_at = datetime.utcnow()
+    started = time.monotonic()
+    cutoff = started_at - timedelta(days=retention_days)
+    batches = retired = 0
+    finished = False
+
+    while time.monotonic() - started < budget_seconds:
+        count = await _retire_batch(db, cutoff, mode, NOTIFICATION_RETENTION_BATCH_SIZE)
+        if count:
+            batches += 1
+            retired += count
+        if count < NOTIFICATION_RETENTION_BATCH_SIZE:
+            finished = True
+            break
+
+    run = NotificationRetentionRun(
+        started_at=started_at,
+        duration_seconds=round(time.monotonic() - started, 3),
+        mode=mode,
+        cutoff=cutoff,
+        batches=batches,
+        archived=0 if mode == "delete" else retired,
+        deleted=retired if mode == "delete" else 0,
+        finished=finished
+    )
+    db.add(run)
+    if retired:
+        print(
+            f"🗄️  Notification retention: {retired} {mode}d in {batches} batches, "
+            f"{run.duration_seconds}s{'' if finished else ' (time budget reached, continuing next run)'}"
+        )
+    return run
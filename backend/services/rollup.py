@@ -0,0 +1,216 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, insert, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import (
+    Business,
+    DailySalesRollup,
+    DailyCustomerRollup,
+    MonthlyRevenueRollup,
+    Payment,
+    PaymentItem,
+    PaymentStatus,
+    Product
+)
+from services.time_buckets import business_zone, local_day, local_day_column, local_month_column
+
+async def _upsert(db: AsyncSession, model, rows: list, key_columns: list, sum_columns: list):
+    """Insert rollup rows, adding to the counters of rows that already exist"""
+    if not rows:
+        return
+
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(model).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={column: getattr(model, column) + stmt.excluded[column] for column in sum_columns}
+    )
+    await db.execute(stmt)
+
+async def record_completed_payment(db: AsyncSession, payment: Payment, at: Optional[datetime] = None):
+    """Add a payment that just moved to completed to the daily rollups.
+
+    Must be called exactly once per payment, in the same transaction that
+    marks it completed. Line items have to be flushed before calling.
+    """
+    await record_completed_payments(db, [payment], at=at)
+
+async def record_completed_payments(db: AsyncSession, payments: list, at: Optional[datetime] = None, sign: int = 1):
+    """Add a batch of newly completed payments to the daily and monthly rollups.
+
+    Takes anything with the payment's id, business_id, customer_id, amount,
+    method and created_at (ORM objects or RETURNING rows), and costs the same
+    five statements however many payments there are. Payments count towards the
+    business day, in the business's timezone, of `at` (default created_at).
+    With sign=-1 the payments are taken back out (record_reverted_payments).
+    """
+    if not payments:
+        return
+
+    zones = dict((await db.execute(
+        select(Business.id, Business.timezone).where(Business.id.in_({payment.business_id for payment in payments}))
+    )).all())
+    days = {
+        payment.id: local_day(at or payment.created_at, business_zone(zones.get(payment.business_id)))
+        for payment in payments
+    }
+    businesses = {payment.id: payment.business_id for payment in payments}
+
+    customer_totals = defaultdict(lambda: {"orders": 0, "revenue": 0.0})
+    month_totals = defaultdict(lambda: {"orders": 0, "revenue": 0.0})
+    for payment in payments:
+        for totals in (
+            customer_totals[(payment.business_id, days[payment.id], payment.customer_id)],
+            month_totals[(payment.business_id, days[payment.id].replace(day=1), payment.method)]
+        ):
+            totals["orders"] += sign
+            totals["revenue"] += sign * payment.amount
+
+    await _upsert(
+        db,
+        DailyCustomerRollup,
+        [
+            {
+                "business_id": business_id,
+                "day": payment_day,
+                "customer_id": customer_id,
+                **totals
+            } for (business_id, payment_day, customer_id), totals in customer_totals.items()
+        ],
+        key_columns=["business_id", "day", "customer_id"],
+        sum_columns=["orders", "revenue"]
+    )
+
+    await _upsert(
+        db,
+        MonthlyRevenueRollup,
+        [
+            {
+                "business_id": business_id,
+                "month": month,
+                "method": method,
+                **totals
+            } for (business_id, month, method), totals in month_totals.items()
+        ],
+        key_columns=["business_id", "month", "method"],
+        sum_columns=["orders", "revenue"]
+    )
+
+    lines = (await db.execute(
+        select(
+            PaymentItem.payment_id,
+            PaymentItem.product_id,
+            Product.category,
+            func.sum(PaymentItem.quantity).label("quantity"),
+            func.sum(PaymentItem.total_price).label("revenue")
+        ).join(Product, Product.id == PaymentItem.product_id).where(
+            PaymentItem.payment_id.in_(days.keys())
+        ).group_by(PaymentItem.payment_id, PaymentItem.product_id, Product.category)
+    )).all()
+
+    # One row per rollup key, since an upsert can't touch the same row twice
+    sales_totals = defaultdict(lambda: {"quantity": 0, "revenue": 0.0})
+    for line in lines:
+        totals = sales_totals[(businesses[line.payment_id], days[line.payment_id], line.product_id, line.category)]
+        totals["quantity"] += sign * line.quantity
+        totals["revenue"] += sign * line.revenue
+
+    await _upsert(
+        db,
+        DailySalesRollup,
+        [
+            {
+                "business_id": business_id,
+                "day": payment_day,
+                "product_id": product_id,
+                "category": category,
+                **totals
+            } for (business_id, payment_day, product_id, category), totals in sales_totals.items()
+        ],
+        key_columns=["business_id", "day", "product_id", "category"],
+        sum_columns=["quantity", "revenue"]
+    )
+
+async def record_reverted_payments(db: AsyncSession, payments: list):
+    """Take payments that just moved out of completed back out of the rollups.
+
+    Like record_completed_payments, must be called exactly once per
+    payment, in the transaction that changes its status.
+    """
+    await record_completed_payments(db, payments, sign=-1)
+
+async def rebuild_rollups(db: AsyncSession, business_id: Optional[int] = None):
+    """Recompute the daily and monthly rollups from the payments history.
+
+    Used to backfill existing data, or to repair the rollups if they drift.
+    Runs in the caller's transaction; the caller commits.
+    """
+    businesses = select(Business.id, Business.timezone)
+    if business_id is not None:
+        businesses = businesses.where(Business.id == business_id)
+
+    for model in (DailyCustomerRollup, DailySalesRollup, MonthlyRevenueRollup):
+        stale = delete(model)
+        if business_id is not None:
+            stale = stale.where(model.business_id == business_id)
+        await db.execute(stale)
+
+    # One pass per business, since each counts days in its own timezone
+    for business, zone in (await db.execute(businesses)).all():
+        day = local_day_column(Payment.created_at, business_zone(zone), db.bind.dialect.name)
+        month = local_month_column(Payment.created_at, business_zone(zone), db.bind.dialect.name)
+        completed = [Payment.business_id == business, Payment.status == PaymentStatus.COMPLETED]
+
+        customer_rows = select(
+            Payment.business_id,
+            day,
+            Payment.customer_id,
+            func.count(Payment.id),
+            func.sum(Payment.amount)
+        ).where(*completed).group_by(Payment.business_id, day, Payment.customer_id)
+
+        await db.execute(
+            insert(DailyCustomerRollup).from_select(
+                ["business_id", "day", "customer_id", "orders", "revenue"],
+                customer_rows
+            )
+        )
+
+        sales_rows = select(
+            Payment.business_id,
+            day,
+            PaymentItem.product_id,
+            Product.category,
+            func.sum(PaymentItem.quantity),
+            func.sum(PaymentItem.total_price)
+        ).select_from(PaymentItem).join(
+            Payment, Payment.id == PaymentItem.payment_id
+        ).join(
+            Product, Product.id == PaymentItem.product_id
+        ).where(*completed).group_by(Payment.business_id, day, PaymentItem.product_id, Product.category)
+
+        await db.execute(
+            insert(DailySalesRollup).from_select(
+                ["business_id", "day", "product_id", "category", "quantity", "revenue"],
+                sales_rows
+            )
+        )
+
+        month_rows = select(
+            Payment.business_id,
+            month,
+            Payment.method,
+            func.count(Payment.id),
+            func.sum(Payment.amount)
+        ).where(*completed).group_by(Payment.business_id, month, Payment.method)
+
+        await db.execute(
+            insert(MonthlyRevenueRollup).from_select(
+                ["business_id", "month", "method", "orders", "revenue"],
+                month_rows
+            )
+        )
@@ -0,0 +1,170 @@
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from dotenv import load_dotenv
+
+from models import (
+    Business,
+    Job,
+    JobStatus,
+    MpesaReconciliationRun,
+    NotificationRetentionRun,
+    Payment,
+    PaymentStatus,
+    TeamInvitation,
+    UserStatus
+)
+from services.email import EmailService
+from services.idempotency import idempotency_store
+from services.circuit_breaker import CircuitOpenError
+from services.jobs import job_handler, periodic_job, enqueue_once, count_outstanding, JobPriority, RetryLater, JOB_POLL_INTERVAL_SECONDS
+from services.low_stock import mark_low, send_low_stock_alerts, LOW_STOCK_ALERT_DELAY_SECONDS
+from services.mpesa import mpesa_service
+from services.mpesa_callbacks import apply_callback_batch, notify_payment_outcomes, MPESA_CALLBACK_BATCH_SIZE
+from services.notifications import repair_unread_counters
+from services.reconciliation import reconciler
+from services.retention import apply_notification_retention
+
+load_dotenv()
+
+# Finished jobs are kept this long for inspection
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+# New M-Pesa checkouts are refused while this many STK pushes are queued or running
+MPESA_MAX_OUTSTANDING_STK_PUSHES = int(os.getenv("MPESA_MAX_OUTSTANDING_STK_PUSHES", "200"))
+
+email_service = EmailService()
+
+async def fail_stk_push(db: AsyncSession, payment_id: int, error: str):
+    """Give up on an M-Pesa payment whose STK push could not be sent"""
+    payment = await db.get(Payment, payment_id)
+    if payment and payment.status == PaymentStatus.PENDING:
+        payment.status = PaymentStatus.FAILED
+        await notify_payment_outcomes(db, [], [payment])
+
+@job_handler("mpesa.stk_push", priority=JobPriority.STK_PUSH, max_attempts=3, on_failure=fail_stk_push)
+async def initiate_stk_push(db: AsyncSession, payment_id: int):
+    """Send the STK push prompt for a pending M-Pesa payment"""
+    payment = await db.scalar(
+        select(Payment).options(selectinload(Payment.customer)).where(Payment.id == payment_id)
+    )
+    if payment is None or payment.status != PaymentStatus.PENDING:
+        return
+
+    try:
+        response = await mpesa_service.stk_push(
+            phone_number=payment.customer.phone,
+            amount=payment.amount,
+            account_reference=f"PAY-{payment.id}",
+            transaction_desc=f"Payment for order #{payment.id}"
+        )
+    except CircuitOpenError as e:
+        # Nothing was sent: wait for the circuit to let calls through again,
+        # keeping the attempts for pushes Daraja actually fails
+        raise RetryLater(e.retry_after, str(e)) from e
+
+    # The callback is matched back to the payment on this id
+    payment.checkout_request_id = response.get("CheckoutRequestID")
+
+async def stk_push_retry_after(db: AsyncSession) -> float:
+    """Seconds before another STK push should be queued; 0 if one can be now.
+
+    Pushes are refused while Daraja's auth or STK push circuit is open in
+    this process, or while the queue of outstanding pushes (shared by all
+    workers) is full.
+    """
+    retry_after = mpesa_service.unavailable_for("auth", "stkpush")
+    if retry_after:
+        return retry_after
+    if await count_outstanding(db, initiate_stk_push) >= MPESA_MAX_OUTSTANDING_STK_PUSHES:
+        return max(1.0, JOB_POLL_INTERVAL_SECONDS)
+    return 0.0
+
+@periodic_job("mpesa.apply_callbacks", every_seconds=60, priority=JobPriority.STK_PUSH)
+async def apply_mpesa_callbacks(db: AsyncSession):
+    """Apply the M-Pesa callback inbox; triggered by incoming callbacks, swept every minute"""
+    while await apply_callback_batch(db) == MPESA_CALLBACK_BATCH_SIZE:
+        await db.commit()
+
+@periodic_job("mpesa.reconcile", every_seconds=60, priority=JobPriority.STK_PUSH)
+async def reconcile_mpesa_payments(db: AsyncSession):
+    """Ask Daraja about M-Pesa payments whose callback never arrived"""
+    await reconciler.sweep(db)
+
+@job_handler("email.team_invitation", priority=JobPriority.EMAIL)
+async def send_team_invitation_email(db: AsyncSession, invitation_id: int, invited_by_name: str):
+    """Email a pending team invitation"""
+    invitation = await db.get(TeamInvitation, invitation_id)
+    if invitation is None or invitation.status != UserStatus.PENDING:
+        return
+
+    business = await db.get(Business, invitation.business_id)
+    await email_service.send_team_invitation(
+        to_email=invitation.email,
+        to_name=invitation.name,
+        business_name=business.name,
+        invited_by_name=invited_by_name,
+        role=invitation.role.value,
+        invitation_token=invitation.invitation_token,
+        custom_message=invitation.message
+    )
+
+@job_handler("notifications.low_stock_alerts", priority=JobPriority.NOTIFICATION)
+async def alert_low_stock(db: AsyncSession, business_id: int):
+    """Send a business's pending low-stock alerts to its admins and managers"""
+    await send_low_stock_alerts(db, business_id)
+
+async def record_low_stock(db: AsyncSession, business_id: int, product_ids: List[int]):
+    """Note products left at or below their threshold; crossings are alerted shortly after commit.
+
+    Crossings within the same LOW_STOCK_ALERT_DELAY_SECONDS slot share one job.
+    """
+    if not await mark_low(db, business_id, product_ids):
+        return
+    now = time.time()
+    slot = int(now // LOW_STOCK_ALERT_DELAY_SECONDS)
+    await enqueue_once(
+        db,
+        alert_low_stock,
+        f"{alert_low_stock.job_name}:{business_id}:{slot}",
+        {"business_id": business_id},
+        run_at=datetime.utcnow() + timedelta(seconds=(slot + 1) * LOW_STOCK_ALERT_DELAY_SECONDS - now)
+    )
+
+@periodic_job("maintenance.repair_notification_counters", every_seconds=24 * 60 * 60)
+async def repair_notification_counters(db: AsyncSession):
+    fixed = await repair_unread_counters(db)
+    if fixed:
+        print(f"🔧 Corrected {fixed} unread notification counters")
+
+@periodic_job("maintenance.notification_retention", every_seconds=60 * 60)
+async def retire_old_notifications(db: AsyncSession):
+    await apply_notification_retention(db)
+
+@periodic_job("maintenance.purge_idempotency_keys", every_seconds=60 * 60)
+async def purge_idempotency_keys(db: AsyncSession):
+    await idempotency_store.purge_expired(db)
+
+@periodic_job("maintenance.purge_finished_jobs", every_seconds=24 * 60 * 60)
+async def purge_finished_jobs(db: AsyncSession):
+    await db.execute(
+        delete(Job).where(
+            Job.status.in_([JobStatus.DONE, JobStatus.FAILED]),
+            Job.finished_at < datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS)
+        )
+    )
+    await db.execute(
+        delete(MpesaReconciliationRun).where(
+            MpesaReconciliationRun.started_at < datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS)
+        )
+    )
+    await db.execute(
+        delete(NotificationRetentionRun).where(
+            NotificationRetentionRun.started_at < datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS)
+        )
+    )
@@ -0,0 +1,60 @@
+import asyncio
+import time
+from typing import Optional
+
+class RateLimiter:
+    """Token bucket: at most `rate` acquisitions per second, in bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so they are served in order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class AdaptiveConcurrencyLimit:
+    """Caps requests in flight, adjusting the cap AIMD-style.
+
+    Every success raises the limit by 1/limit (about one per round of
+    requests); an overload signal halves it. Requests that were already in
+    flight when the limit was cut don't cut it again, so one burst of
+    errors counts as a single congestion event.
+    """
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._epoch = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> int:
+        """Wait for a slot; pass the returned token to release()"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return self._epoch
+
+    async def release(self, token: int, overloaded: bool = False):
+        async with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                if token == self._epoch:
+                    self.limit = max(float(self.minimum), self.limit / 2)
+                    self._epoch += 1
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._condition.notify_all()
@@ -0,0 +1,102 @@
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Business
+
+DEFAULT_TIMEZONE = "Africa/Nairobi"
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+def business_zone(name: Optional[str]) -> ZoneInfo:
+    """The zone for an IANA name, or the default zone if it is empty or unknown"""
+    if name and is_valid_timezone(name):
+        return ZoneInfo(name)
+    return ZoneInfo(DEFAULT_TIMEZONE)
+
+def local_day(moment: datetime, zone: ZoneInfo) -> date:
+    """The business day a stored timestamp falls on (naive timestamps are UTC)"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(zone).date()
+
+def local_day_column(column, zone: ZoneInfo, dialect: str):
+    """SQL for the business day of a timestamp column, for grouping (not for filtering).
+
+    The zone is inlined rather than bound, so the expression is textually the
+    same in SELECT and GROUP BY; zone keys are validated IANA names.
+    """
+    if dialect == "postgresql":
+        return func.date(func.timezone(literal_column(f"'{zone.key}'"), column))
+    return func.date(column, _sqlite_offset(zone))
+
+def local_month_column(column, zone: ZoneInfo, dialect: str):
+    """SQL for the first business day of the month of a timestamp column, for grouping"""
+    if dialect == "postgresql":
+        return func.date(func.date_trunc(literal_column("'month'"), func.timezone(literal_column(f"'{zone.key}'"), column)))
+    return func.date(column, _sqlite_offset(zone), literal_column("'start of month'"))
+
+def _sqlite_offset(zone: ZoneInfo):
+    # SQLite has no zone database: shift by the zone's current offset, which
+    # is exact for zones without daylight saving time, like East Africa's
+    offset = datetime.now(zone).utcoffset()
+    return literal_column(f"'{int(offset.total_seconds() // 60):+d} minutes'")
+
+class TimeBuckets:
+    """Calendar periods of a business's timezone, as half-open UTC ranges.
+
+    Payments are stored with UTC timestamps, while "today" for a shop in
+    Nairobi starts at 21:00 UTC the evening before. Filtering on
+    start <= created_at < end keeps the column bare, so the
+    (business_id, status, created_at) index answers it with a range scan.
+    """
+
+    def __init__(self, zone: Optional[str] = None, now: Optional[datetime] = None):
+        self.zone = business_zone(zone)
+        self.today = local_day(now or datetime.utcnow(), self.zone)
+
+    def start_of(self, day: date) -> datetime:
+        """The UTC instant a local day starts, naive like the stored timestamps"""
+        return datetime.combine(day, time(), self.zone).astimezone(timezone.utc).replace(tzinfo=None)
+
+    def days(self, first: date, last: date) -> Tuple[datetime, datetime]:
+        """[start of first, start of the day after last)"""
+        return self.start_of(first), self.start_of(last + timedelta(days=1))
+
+    def day(self) -> Tuple[datetime, datetime]:
+        return self.days(self.today, self.today)
+
+    def week(self) -> Tuple[datetime, datetime]:
+        """Monday to Sunday"""
+        monday = self.today - timedelta(days=self.today.weekday())
+        return self.days(monday, monday + timedelta(days=6))
+
+    def month(self) -> Tuple[datetime, datetime]:
+        return self.months(1)[0][1:]
+
+    def last_days(self, days: int) -> Tuple[datetime, datetime]:
+        """The last `days` whole days, today included"""
+        return self.days(self.today - timedelta(days=days - 1), self.today)
+
+    def months(self, count: int) -> List[Tuple[date, datetime, datetime]]:
+        """(first day, start, end) of the last `count` calendar months, oldest first, this one included"""
+        firsts = [self.today.replace(day=1)]
+        while len(firsts) < count:
+            firsts.insert(0, (firsts[0] - timedelta(days=1)).replace(day=1))
+        return [
+            (first, self.start_of(first), self.start_of((first + timedelta(days=32)).replace(day=1)))
+            for first in firsts
+        ]
+
+async def business_buckets(db: AsyncSession, business_id: int, now: Optional[datetime] = None) -> TimeBuckets:
+    """TimeBuckets in the business's own timezone"""
+    zone = await db.scalar(select(Business.timezone).where(Business.id == business_id))
+    return TimeBuckets(zone, now)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Background job worker: runs STK pushes, emails, notifications and maintenance
+Start as many as needed alongside the API (set JOB_WORKER_IN_PROCESS=false there)
+"""
+
+import argparse
+import asyncio
+import signal
+
+from database import engine, Base, test_connection
+from models import *  # Import all models to ensure the jobs table exists
+from services.jobs import JobRunner, JOB_WORKERS
+from services.mpesa import mpesa_service
+import services.tasks  # Register the job handlers
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Concurrent jobs in this process")
+    args = parser.parse_args()
+
+    if not test_connection():
+        return False
+    Base.metadata.create_all(bind=engine)
+
+    runner = JobRunner(workers=args.workers)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await runner.start()
+    print(f"🚀 Job worker {runner.worker_id} running {args.workers} workers")
+
+    await stopping.wait()
+    print("🛑 Stopping, letting running jobs finish...")
+    await runner.stop()
+    await mpesa_service.aclose()
+    return True
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -132,6 +132,45 @@ class ApiClient {
     })
   }
 
+  // Notification endpoints
+  async getNotifications(params?: { skip?: number; limit?: number; unread_only?: boolean }) {
+    const queryString = params ? `?${new URLSearchParams(params as any)}` : ""
+    return this.request(`/notifications${queryString}`)
+  }
+
+  async markNotificationRead(id: string, read = true) {
+    return this.request(`/notifications/${id}`, {
+      method: "PUT",
+      body: JSON.stringify({ read }),
+    })
+  }
+
+  async markAllNotificationsRead() {
+    return this.request("/notifications/mark-all-read", {
+      method: "POST",
+    })
+  }
+
+  async deleteNotification(id: string) {
+    return this.request(`/notifications/${id}`, {
+      method: "DELETE",
+    })
+  }
+
+  // Live notifications over server-sent events, instead of polling /notifications/unread/count.
+  // EventSource can't send headers, so the token goes in the query string; it reconnects by itself.
+  streamNotifications(handlers: Record<string, (data: any) => void>): EventSource | null {
+    if (typeof window === "undefined" || !this.token) {
+      return null
+    }
+
+    const source = new EventSource(`${this.baseURL}/notifications/stream?token=${encodeURIComponent(this.token)}`)
+    for (const [event, handler] of Object.entries(handlers)) {
+      source.addEventListener(event, (e) => handler(JSON.parse((e as MessageEvent).data)))
+    }
+    return source
+  }
+
   setToken(token: string) {
     this.token = token
     if (typeof window !== "undefined") {